@@ -0,0 +1,366 @@
+"""
+Offline end-to-end benchmark of the voice pipeline.
+
+Recorded utterances are fed (in real time, 20ms packets) through
+AudioRecorder -> STTScheduler/STTEngine -> OllamaClient -> SBV2Client -> SpeechPipeline,
+with local stand-ins for Ollama and SBV2 and a player thread in place of Discord.
+Every speaker talks in their own guild, so N speakers = N concurrent turns.
+
+    python -m bench.pipeline_bench --speakers 1,2,4 --turns 3 --out bench.json
+    python -m bench.pipeline_bench --no-stt --compare bench.json
+
+Whisper runs for real (the model must already be in the local cache);
+--no-stt answers a fixed prompt instead.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench.standins import StandInServer, make_ollama_app, make_sbv2_app, DEFAULT_REPLY
+
+logger = logging.getLogger("bench")
+
+FRAME_SECONDS = 0.02
+FRAME_BYTES = 3840  # 20ms of 48kHz stereo 16-bit PCM
+# After the recording, quiet noise is fed (Discord keeps sending packets while
+# the mic is open) until the recorder ends the utterance, or for this long
+GIVE_UP_SECONDS = 4.0
+
+
+class BenchVoiceClient:
+    def __init__(self):
+        """
+        Plays an AudioSource like discord.py's player: one read() per 20ms on its own thread.
+        """
+        self._thread = None
+        self._stop = threading.Event()
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def play(self, source, after=None):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._play, args=(source, after), daemon=True)
+        self._thread.start()
+
+    def _play(self, source, after):
+        start = time.perf_counter()
+        frames = 0
+        while not self._stop.is_set():
+            if not source.read():
+                break
+            frames += 1
+            delay = start + frames * FRAME_SECONDS - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if after:
+            after(None)
+
+    def stop(self):
+        self._stop.set()
+
+
+class BenchGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = BenchVoiceClient()
+
+
+def load_utterances(pattern):
+    """
+    Recorded utterances as 48kHz stereo 16-bit PCM (what voice_recv delivers).
+    """
+    from src.utils.audio_sources import wav_to_pcm48k
+
+    paths = sorted(p for p in glob.glob(pattern) if not os.path.basename(p).startswith("tts_"))
+    utterances = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pcm = wav_to_pcm48k(f.read())
+        if pcm:
+            utterances.append((os.path.basename(path), pcm))
+    return utterances
+
+
+def noise_frame(rng, level=0.001):
+    samples = (rng.standard_normal(FRAME_BYTES // 2) * level * 32767).astype("<i2")
+    return samples.tobytes()
+
+
+async def speak_into(recorder, pcm, rng):
+    """
+    Feed one utterance (then a quiet tail) at real-time pace.
+    :return: The flushed utterance audio, or None if the recorder never ended it
+    """
+    frames = [pcm[i:i + FRAME_BYTES] for i in range(0, len(pcm) - FRAME_BYTES + 1, FRAME_BYTES)]
+    tail = int(GIVE_UP_SECONDS / FRAME_SECONDS)
+    start = time.perf_counter()
+    for index in range(len(frames) + tail):
+        frame = frames[index] if index < len(frames) else noise_frame(rng)
+        audio = recorder.write(frame)
+        if audio is not None:
+            return audio
+        delay = start + (index + 1) * FRAME_SECONDS - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    return None
+
+
+async def run_turn(trace, audio, stt_scheduler, ollama, pipeline, prompt, user_id):
+    from src.services.latency import current_trace
+    from src.services.llm_scheduler import VOICE
+
+    # Same context handling as VoiceChat.process_transcription
+    current_trace.set(trace)
+    trace.observe("endpointing", "last_voice", "speech_end", backend="vad")
+    text = prompt
+    if stt_scheduler is not None:
+        text = await stt_scheduler.transcribe(audio)
+        if not text:
+            return None
+    sentences = ollama.stream_sentences(text, user_id=user_id, guild_id=trace.guild_id, priority=VOICE)
+    return await pipeline.speak(sentences, source="bench")
+
+
+async def speaker(index, utterances, turns, stt_scheduler, ollama, sbv2, prompt, outcomes):
+    from src.services.latency import TurnTrace
+    from src.services.speech_pipeline import SpeechPipeline
+    from src.utils.audio_recorder import AudioRecorder
+
+    rng = np.random.default_rng(index)
+    guild = BenchGuild(900000 + index)
+    pipeline = SpeechPipeline(guild, sbv2)
+    recorder = AudioRecorder(index)
+    for turn in range(turns):
+        name, pcm = utterances[(index + turn) % len(utterances)]
+        audio = await speak_into(recorder, pcm, rng)
+        if audio is None:
+            logger.warning(f"Speaker {index}: no end of speech detected in {name}")
+            outcomes["missed"] += 1
+            continue
+
+        trace = TurnTrace(guild.id, index)
+        speech_start, last_voice, speech_end = recorder.utterance_times
+        for event, at in (("speech_start", speech_start), ("last_voice", last_voice), ("speech_end", speech_end)):
+            if at is not None:
+                trace.mark(event, at)
+        try:
+            # Own task: the trace must not leak into the next turn's context
+            reply = await asyncio.create_task(run_turn(trace, audio, stt_scheduler, ollama, pipeline, prompt, index))
+        except Exception as e:
+            logger.error(f"Speaker {index}: turn failed: {e}")
+            outcomes["failed"] += 1
+            continue
+        if reply and "playback_start" in trace.marks:
+            outcomes["completed"] += 1
+            logger.info(f"Speaker {index} turn {turn}: {trace.describe()}")
+        else:
+            outcomes["failed"] += 1
+
+
+async def run_level(speakers, turns, utterances, stt_scheduler, ollama, sbv2, prompt):
+    """
+    One measurement: N speakers talking concurrently for a number of turns each.
+    """
+    from src.services.latency import get_metrics
+
+    metrics = get_metrics()
+    metrics.reset()
+    outcomes = {"completed": 0, "failed": 0, "missed": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        speaker(i, utterances, turns, stt_scheduler, ollama, sbv2, prompt, outcomes) for i in range(speakers)
+    ))
+    wall = time.perf_counter() - started
+
+    stages = {
+        stage: {"count": s["count"], "p50_ms": round(s["p50"] * 1000, 1), "p95_ms": round(s["p95"] * 1000, 1)}
+        for stage, s in metrics.summary().items()
+    }
+    return {
+        "speakers": speakers,
+        "turns_per_speaker": turns,
+        **outcomes,
+        "wall_seconds": round(wall, 2),
+        "throughput_turns_per_min": round(outcomes["completed"] / wall * 60, 2) if wall else 0.0,
+        "end_to_end": stages.get("end_to_end"),
+        "stages": stages
+    }
+
+
+async def run(args, utterances):
+    from concurrent.futures import ThreadPoolExecutor
+    from src.services.http_pool import close_all
+    from src.services.ollama_client import OllamaClient
+    from src.services.sbv2_client import SBV2Client
+    from src.services.stt_scheduler import STTScheduler
+
+    stt_scheduler = None
+    executor = None
+    if not args.no_stt:
+        from src.services.stt_engine import STTEngine
+
+        engine = STTEngine(model_size=args.stt_model, lite_model_size=args.stt_lite_model)
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, engine.load)
+        except Exception as e:
+            raise SystemExit(f"Whisper model '{args.stt_model}' could not be loaded ({e}); use --no-stt") from None
+        engine.warmup()
+        if args.stt_lite_model:
+            engine.load_lite()
+        executor = ThreadPoolExecutor(max_workers=2)
+        stt_scheduler = STTScheduler(engine, executor)
+        stt_scheduler.start()
+
+    ollama = OllamaClient()
+    sbv2 = SBV2Client()
+    levels = []
+    try:
+        for speakers in args.speakers:
+            logger.warning(f"Running {speakers} concurrent speaker(s) x {args.turns} turn(s)...")
+            levels.append(await run_level(speakers, args.turns, utterances, stt_scheduler, ollama, sbv2, args.prompt))
+    finally:
+        if stt_scheduler:
+            stt_scheduler.stop()
+        if executor:
+            executor.shutdown(wait=False)
+        await close_all()
+    return levels
+
+
+def compare(results, baseline_path, tolerance, min_delta_ms):
+    """
+    Regressions of end-to-end/stage p95 against an earlier result file, per speaker count.
+    :return: List of messages (empty = no regression)
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {level["speakers"]: level for level in baseline.get("levels", [])}
+    regressions = []
+    for level in results["levels"]:
+        old = previous.get(level["speakers"])
+        if old is None:
+            continue
+        for stage, stats in level["stages"].items():
+            old_stats = old["stages"].get(stage)
+            if not old_stats or not old_stats["p95_ms"]:
+                continue
+            # Relative and absolute: a few ms of jitter on a tiny stage is not a regression
+            increase = stats["p95_ms"] - old_stats["p95_ms"]
+            if increase > old_stats["p95_ms"] * tolerance and increase > min_delta_ms:
+                regressions.append(
+                    f"{level['speakers']} speaker(s) {stage}: p95 {old_stats['p95_ms']}ms -> {stats['p95_ms']}ms"
+                )
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end voice pipeline benchmark")
+    parser.add_argument("--utterances", default="data/temp/*.wav", help="Glob of recorded utterance WAVs")
+    parser.add_argument("--speakers", default="1,2,4", help="Comma-separated concurrent speaker counts")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per speaker")
+    parser.add_argument("--no-stt", action="store_true", help="Skip Whisper and answer --prompt")
+    parser.add_argument("--stt-model", default="tiny", help="Whisper model size (must be cached locally)")
+    parser.add_argument("--stt-lite-model", default="", help="Lite-tier model size ('' = none)")
+    parser.add_argument("--prompt", default="今日はいい天気だね。", help="Transcript used with --no-stt")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="Text the Ollama stand-in answers with")
+    parser.add_argument("--token-rate", type=float, default=30.0, help="Ollama stand-in tokens per second")
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="Ollama stand-in prompt evaluation time")
+    parser.add_argument("--tts-delay", type=float, default=0.15, help="SBV2 stand-in synthesis time per request")
+    parser.add_argument("--tts-delay-per-char", type=float, default=0.01, help="SBV2 stand-in synthesis time per character")
+    parser.add_argument("--tts-seconds-per-char", type=float, default=0.12, help="SBV2 stand-in audio length per character")
+    parser.add_argument("--opus-lib", help="Path of libopus if discord.py cannot find it")
+    parser.add_argument("--out", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier JSON results; exit 1 if a p95 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 increase for --compare")
+    parser.add_argument("--min-delta-ms", type=float, default=50.0, help="Ignore p95 increases smaller than this")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    args.speakers = [int(n) for n in args.speakers.split(",") if n.strip()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    import discord
+    if args.opus_lib:
+        discord.opus.load_opus(args.opus_lib)
+    elif not discord.opus.is_loaded() and not discord.opus._load_default():
+        logger.error("libopus not found; pass --opus-lib")
+        return 2
+
+    ollama_server = StandInServer(make_ollama_app(
+        reply=args.reply, token_rate=args.token_rate, first_token_delay=args.first_token_delay
+    )).start()
+    sbv2_server = StandInServer(make_sbv2_app(
+        delay=args.tts_delay, delay_per_char=args.tts_delay_per_char, seconds_per_char=args.tts_seconds_per_char
+    )).start()
+
+    # src.config reads these at import time: point the clients at the stand-ins first
+    os.environ["OLLAMA_URL"] = ollama_server.url
+    os.environ["SBV2_URL"] = sbv2_server.url
+    os.environ["MEMORY_ENABLED"] = "false"
+
+    try:
+        utterances = load_utterances(args.utterances)
+        if not utterances:
+            logger.error(f"No utterances found: {args.utterances}")
+            return 2
+        levels = asyncio.run(run(args, utterances))
+    finally:
+        ollama_server.stop()
+        sbv2_server.stop()
+
+    results = {
+        "revision": git_revision(),
+        "created": time.time(),
+        "config": {
+            "utterances": len(utterances),
+            "turns": args.turns,
+            "stt_model": None if args.no_stt else args.stt_model,
+            "token_rate": args.token_rate,
+            "first_token_delay": args.first_token_delay,
+            "tts_delay": args.tts_delay,
+            "tts_delay_per_char": args.tts_delay_per_char,
+            "tts_seconds_per_char": args.tts_seconds_per_char
+        },
+        "levels": levels
+    }
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms)
+        for message in regressions:
+            logger.error(f"Regression: {message}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import asyncio
+import io
+import json
+import socket
+import threading
+import time
+import wave
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+DEFAULT_REPLY = "うん、聞こえてるよ！今日はどんな一日だった？お兄ちゃんの話、もっと聞かせてね。"
+
+
+def make_ollama_app(reply=DEFAULT_REPLY, token_rate=30.0, first_token_delay=0.3, chars_per_token=2):
+    """
+    Stand-in for Ollama: /api/chat (NDJSON streaming and non-streaming) and /api/embed.
+    :param reply: Text every chat request answers with
+    :param token_rate: Generated tokens per second
+    :param first_token_delay: Seconds before the first token (prompt evaluation)
+    :param chars_per_token: Characters of the reply per streamed token
+    """
+    app = FastAPI()
+    tokens = [reply[i:i + chars_per_token] for i in range(0, len(reply), chars_per_token)]
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        if not payload.get("messages"):
+            # Model preload
+            return JSONResponse({"model": payload.get("model"), "done": True})
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(first_token_delay + len(tokens) / token_rate)
+            return JSONResponse({"message": {"role": "assistant", "content": reply}, "done": True})
+
+        async def generate():
+            await asyncio.sleep(first_token_delay)
+            for token in tokens:
+                yield json.dumps({"message": {"role": "assistant", "content": token}, "done": False}) + "\n"
+                await asyncio.sleep(1.0 / token_rate)
+            yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True}) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        payload = await request.json()
+        texts = payload.get("input") or []
+        return JSONResponse({"embeddings": [[0.0] * 8 for _ in texts]})
+
+    return app
+
+
+def make_sbv2_app(delay=0.15, delay_per_char=0.01, seconds_per_char=0.12, sample_rate=44100, chunk_bytes=16384):
+    """
+    Stand-in for Style-Bert-VITS2: GET /voice returns a 16-bit mono WAV.
+    :param delay: Fixed synthesis time (seconds)
+    :param delay_per_char: Extra synthesis time per character of text
+    :param seconds_per_char: Audio length per character (sets the WAV size)
+    :param sample_rate: WAV sample rate (SBV2 uses 44.1kHz)
+    :param chunk_bytes: The body is streamed in chunks of this size
+    """
+    app = FastAPI()
+    wavs = {}  # {length in samples: WAV bytes}
+
+    def make_wav(text):
+        samples = max(1, int(len(text) * seconds_per_char * sample_rate))
+        if samples not in wavs:
+            t = np.arange(samples) / sample_rate
+            # Voice-like: a pitch with vibrato and a syllable-rate amplitude envelope
+            tone = np.sin(2 * np.pi * (220 + 20 * np.sin(2 * np.pi * 5 * t)) * t)
+            envelope = 0.4 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+            pcm = (tone * envelope * 32767).astype("<i2").tobytes()
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(sample_rate)
+                w.writeframes(pcm)
+            wavs[samples] = buffer.getvalue()
+        return wavs[samples]
+
+    @app.get("/voice")
+    async def voice(text: str = ""):
+        await asyncio.sleep(delay + delay_per_char * len(text))
+        data = make_wav(text)
+
+        async def body():
+            for i in range(0, len(data), chunk_bytes):
+                yield data[i:i + chunk_bytes]
+
+        return StreamingResponse(body(), media_type="audio/wav")
+
+    @app.get("/status")
+    async def status():
+        return Response("ok")
+
+    return app
+
+
+class StandInServer:
+    def __init__(self, app, host="127.0.0.1"):
+        """
+        Runs a stand-in app with uvicorn on its own thread and event loop,
+        so it does not compete with the pipeline under test for the loop.
+        """
+        self.app = app
+        self.host = host
+        self.port = _free_port(host)
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout=10.0):
+        import uvicorn
+
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.server.serve()), daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"Stand-in server did not start on {self.url}")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.should_exit = True
+        if self.thread:
+            self.thread.join(timeout=5)
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
@@ -0,0 +1,343 @@
+"""
+Replay captured voice packets (!capture) through VoiceChat, offline.
+
+Packets go through the same path as live ones: the Opus gate (SpeechGateSink),
+then VoiceChat.on_voice_packet with its recorders, barge-in detection and
+end-of-speech timers. Measures per-packet CPU, recorder memory, flush
+(end-of-speech) timing and, with Whisper, STT queueing under multi-speaker load.
+
+    python -m bench.voice_replay data/captures/*.mvcap --speed 1
+    python -m bench.voice_replay a.mvcap --speed max --copies 16 --stagger 0.7 --stt-model tiny
+
+--speed: 1 = real time, N = N times faster, max = as fast as possible.
+The recorders and the end-of-speech timers (VoiceChat.call_at) run on the
+capture's clock, so end-of-speech decisions are the same at every speed.
+--copies multiplexes the capture(s) into one synthetic channel of many
+speakers (user ids are remapped per copy).
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+logger = logging.getLogger("bench")
+
+# Remapped user id of copy c of user u: u + c * COPY_ID_STRIDE
+COPY_ID_STRIDE = 1 << 56
+
+
+class ReplayClock:
+    def __init__(self):
+        """
+        Capture time of the packet being replayed (what the recorders see as "now").
+        """
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def multiplexed_records(paths, copies, stagger):
+    """
+    Records of every capture file, repeated `copies` times with each copy
+    shifted by `stagger` seconds and its own user ids, merged in time order.
+    """
+    from src.utils.voice_capture import read_capture
+
+    def shifted(path, copy):
+        offset = copy * stagger
+        for timestamp, user_id, kind, payload in read_capture(path):
+            yield timestamp + offset, user_id + copy * COPY_ID_STRIDE, kind, payload
+
+    streams = [shifted(path, copy) for path in paths for copy in range(copies)]
+    return heapq.merge(*streams, key=lambda record: record[0])
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, top = np.percentile(values, [50, 95, 100])  # Interpolated between ranks
+    return {"count": len(values), "p50": round(float(p50), 3), "p95": round(float(p95), 3), "max": round(float(top), 3)}
+
+
+class ReplayBot:
+    def __init__(self, loop):
+        """
+        What VoiceChat needs from the bot: its loop. Nothing is sent anywhere.
+        """
+        self.loop = loop
+
+    def dispatch(self, event, *args):
+        pass
+
+    def get_channel(self, channel_id):
+        return None
+
+    def get_cog(self, name):
+        return None
+
+
+class ReplayGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class ReplayMember:
+    def __init__(self, user_id, guild):
+        self.id = user_id
+        self.name = f"speaker-{user_id}"
+        self.bot = False
+        self.guild = guild
+
+
+class ReplayPacket:
+    def __init__(self, opus=None, pcm=b""):
+        """
+        The parts of voice_recv's VoiceData that the sink and VoiceChat read.
+        """
+        self.opus = opus
+        self.pcm = pcm
+
+
+class ReadySTT:
+    # Recorder-only replay: VoiceChat handles packets once STT "is ready"
+    is_ready = True
+
+
+def make_replay_cog(bot, clock, stt=None, stt_scheduler=None):
+    """
+    VoiceChat whose packets come from a capture: its recorders and end-of-speech
+    timers run on the capture's clock, and turns stop after transcription.
+    """
+    from src.bot.cogs.voice_chat import VoiceChat
+
+    class ReplayVoiceChat(VoiceChat):
+        def __init__(self):
+            super().__init__(bot)
+            self.clock = clock
+            self.stt = stt or ReadySTT()
+            self.stt_scheduler = stt_scheduler
+            # Partial passes need Whisper
+            self.streaming = self.streaming and stt_scheduler is not None
+            self.timers = []  # Heap of (clock time, seq, callback, args)
+            self.timer_seq = itertools.count()
+            self.endpointing = []  # Last voiced packet -> flush, capture time
+            self.durations = []
+            self.transcripts = 0
+            self.barge_in_count = 0
+            self.turns_started = 0
+            self.turns_done = 0
+
+        def call_at(self, when, callback, *args):
+            heapq.heappush(self.timers, (when, next(self.timer_seq), callback, args))
+
+        async def fire_timers(self, until):
+            # Timers that are due before the next packet, on the capture's clock
+            while self.timers and self.timers[0][0] <= until:
+                when, _, callback, args = heapq.heappop(self.timers)
+                clock.now = max(clock.now, when)
+                pending = callback(*args)
+                if pending is not None:
+                    # The flush runs in an executor; the clock waits for it
+                    await pending
+                # Let the re-arm it may have scheduled run
+                await asyncio.sleep(0)
+
+        def utterance_ended(self, user, recorder, audio):
+            speech_start, last_voice, speech_end = recorder.utterance_times
+            if last_voice is not None:
+                self.endpointing.append(speech_end - last_voice)
+            self.durations.append(len(audio) / 16000)
+            super().utterance_ended(user, recorder, audio)
+
+        def barge_in(self, user):
+            self.barge_in_count += 1
+            super().barge_in(user)
+
+        async def process_transcription(self, user, audio, transcriber=None, trace=None):
+            self.turns_started += 1
+            try:
+                if self.stt_scheduler is not None:
+                    await super().process_transcription(user, audio, transcriber, trace)
+            finally:
+                self.turns_done += 1
+
+        async def handle_dialogue(self, user, text, skip_llm=False):
+            # The replay ends at the transcript
+            self.transcripts += 1
+
+    return ReplayVoiceChat()
+
+
+async def replay(args):
+    from src.services.latency import get_metrics
+    from src.utils.voice_capture import KIND_OPUS
+    from src.utils.voice_sink import SpeechGateSink
+
+    loop = asyncio.get_running_loop()
+    clock = ReplayClock()
+    stt = stt_scheduler = None
+    if args.stt_model:
+        from src.services.stt_engine import STTEngine
+        from src.services.stt_scheduler import STTScheduler
+
+        stt = STTEngine(model_size=args.stt_model, lite_model_size="")
+        try:
+            await loop.run_in_executor(None, stt.load)
+        except Exception as e:
+            raise SystemExit(f"Whisper model '{args.stt_model}' could not be loaded ({e})") from None
+        stt_scheduler = STTScheduler(stt)
+
+    cog = make_replay_cog(ReplayBot(loop), clock, stt=stt, stt_scheduler=stt_scheduler)
+    if stt_scheduler:
+        stt_scheduler.executor = cog.executor
+        stt_scheduler.start()
+    # Same path as live packets: Opus gate, then VoiceChat.on_voice_packet
+    sink = SpeechGateSink(cog.on_voice_packet, ignore=cog.ignores)
+    decode = sink.gate.decode
+    decode_times = []
+
+    def timed_decode(user_id, payload):
+        t0 = time.perf_counter()
+        try:
+            return decode(user_id, payload)
+        finally:
+            decode_times.append(time.perf_counter() - t0)
+
+    sink.gate.decode = timed_decode
+
+    guild = ReplayGuild(0)
+    members = {}  # {user_id: ReplayMember}
+    packet_times = []  # Seconds per packet: gate + decode + VoiceChat.on_voice_packet
+    max_backlog = 0
+    peak_buffered = 0
+    packets = 0
+    first_at = None
+    get_metrics().reset()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for timestamp, user_id, kind, payload in multiplexed_records(args.captures, args.copies, args.stagger):
+        if first_at is None:
+            first_at = timestamp
+        await cog.fire_timers(timestamp)
+        if args.speed != "max":
+            delay = started + (timestamp - first_at) / float(args.speed) - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        clock.now = timestamp
+        packets += 1
+
+        member = members.get(user_id)
+        if member is None:
+            member = members[user_id] = ReplayMember(user_id, guild)
+        t0 = time.perf_counter()
+        if kind == KIND_OPUS:
+            sink.write(member, ReplayPacket(opus=payload))
+        else:
+            cog.on_voice_packet(member, ReplayPacket(pcm=payload))
+        packet_times.append(time.perf_counter() - t0)
+        # Timers armed by the packet (call_soon_threadsafe) and the STT scheduler
+        await asyncio.sleep(0)
+
+        if packets % 50 == 0:
+            peak_buffered = max(peak_buffered, sum(r.buffered_bytes for r in cog.recorders.values()))
+        if stt_scheduler:
+            max_backlog = max(max_backlog, stt_scheduler.backlog)
+
+    await cog.fire_timers(float("inf"))
+    while cog.turns_done < len(cog.durations):
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - started
+    tracemalloc_peak = None
+    if args.tracemalloc:
+        tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    capture_seconds = (clock.now - first_at) if first_at is not None else 0.0
+    report = {
+        "captures": args.captures,
+        "copies": args.copies,
+        "speed": args.speed,
+        "speakers": len(cog.recorders),
+        "members": len(members),
+        "packets": packets,
+        "capture_seconds": round(capture_seconds, 2),
+        "wall_seconds": round(wall, 2),
+        "achieved_speed": round(capture_seconds / wall, 2) if wall else None,
+        "packet_us": percentiles([t * 1e6 for t in packet_times]),
+        "packet_cpu_share": round(sum(packet_times) / wall, 4) if wall else None,
+        "opus_decode_us": percentiles([t * 1e6 for t in decode_times]),
+        "opus_frames": {"decoded": sink.gate.decoded, "silent": sink.gate.gated, "concealed": sink.gate.concealed},
+        "flushes": len(cog.durations),
+        "utterance_seconds": percentiles(cog.durations),
+        "endpointing_seconds": percentiles(cog.endpointing),
+        "barge_ins": cog.barge_in_count,
+        "peak_buffered_bytes": peak_buffered,
+        "ring_bytes": sum(r.ring.nbytes for r in cog.recorders.values()),
+        "tracemalloc_peak_bytes": tracemalloc_peak
+    }
+    if stt_scheduler:
+        stt_scheduler.stop()
+        summary = get_metrics().summary()
+        report["stt"] = {
+            "utterances": stt_scheduler.utterances,
+            "batches": stt_scheduler.batches,
+            "shed": stt_scheduler.shed,
+            "tiers": stt_scheduler.tier_counts,
+            "transcripts": cog.transcripts,
+            "max_backlog": max_backlog,
+            "queue": summary.get("stt_queue"),
+            "decode": summary.get("stt_decode")
+        }
+    cog.executor.shutdown(wait=False)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured voice packets through the recorder pipeline")
+    parser.add_argument("captures", nargs="+", help="Capture files (.mvcap)")
+    parser.add_argument("--speed", default="1", help="1 (real time), N (N times faster) or max")
+    parser.add_argument("--copies", type=int, default=1, help="Replay every capture this many times as different speakers")
+    parser.add_argument("--stagger", type=float, default=0.5, help="Seconds between the copies")
+    parser.add_argument("--stt-model", help="Also transcribe the flushed utterances with this Whisper model")
+    parser.add_argument("--opus-lib", help="Path of libopus if discord.py cannot find it")
+    parser.add_argument("--tracemalloc", action="store_true", help="Report the Python heap peak (slower)")
+    parser.add_argument("--out", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.speed != "max" and float(args.speed) <= 0:
+        parser.error("--speed must be positive or 'max'")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    import discord
+    if args.opus_lib:
+        discord.opus.load_opus(args.opus_lib)
+
+    report = asyncio.run(replay(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,73 @@ import discord
 from discord.ext import commands
 import logging
 from ...config import SCORE_CHANNEL_ID
+from ...services.memory_engine import get_memory_engine
+from ...services.latency import get_metrics
+from ...services.score_store import ScoreStore, turn_score
 
 logger = logging.getLogger(__name__)
 
+# Emoji to Score Mapping
+SCORE_EMOJIS = {
+    "👍": 5, "👎": 1, "😄": 4, "😐": 3, "😕": 2,
+    "1️⃣": 1, "2️⃣": 2, "3️⃣": 3, "4️⃣": 4, "5️⃣": 5
+}
+
 class System(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # message_id of each posted score log -> (input, output, turn metadata)
+        self.scores = ScoreStore()
 
     @commands.Cog.listener()
     async def on_ready(self):
         logger.info("System Cog loaded.")
-        
+
+    @commands.command()
+    async def latency(self, ctx, scope: str = "guild"):
+        """
+        Recent p50/p95 per pipeline stage (!latency all for every guild).
+        """
+        guild_id = ctx.guild.id if ctx.guild and scope != "all" else None
+        summary = get_metrics().summary(guild=guild_id)
+        if not summary:
+            await ctx.send("No latency samples yet.")
+            return
+
+        lines = [f"{'stage':<16}{'p50':>9}{'p95':>9}{'n':>6}"]
+        for stage, stats in summary.items():
+            lines.append(f"{stage:<16}{stats['p50'] * 1000:>7.0f}ms{stats['p95'] * 1000:>7.0f}ms{stats['count']:>6}")
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.Cog.listener()
+    async def on_dialogue_turn(self, user, input_text, output_text, source):
+        """
+        Post a score log for a finished turn and index it by message ID,
+        so reactions can be resolved without fetching the message.
+        """
+        if not SCORE_CHANNEL_ID:
+            return
+        channel = self.bot.get_channel(SCORE_CHANNEL_ID)
+        if not channel:
+            return
+
+        embed = discord.Embed(title="Score this reply")
+        # Embed fields are limited to 1024 characters; the index keeps the full text
+        embed.add_field(name="Input", value=_clip(input_text), inline=False)
+        embed.add_field(name="Output", value=_clip(output_text), inline=False)
+        embed.set_footer(text=f"{source} / {user.name}")
+        try:
+            message = await channel.send(embed=embed)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not post score log: {e}")
+            return
+
+        guild = getattr(user, "guild", None)
+        await self.scores.log_turn(
+            message.id, input_text, output_text,
+            user_id=user.id, guild_id=guild.id if guild else None, source=source
+        )
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
         """
@@ -24,71 +80,32 @@ class System(commands.Cog):
         if payload.user_id == self.bot.user.id:
             return
 
-        # Fetch the message
-        channel = self.bot.get_channel(payload.channel_id)
-        if not channel:
-            return
-            
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except discord.NotFound:
-            return
-
-        # Only process Embeds (which are sent by the bot for scoring)
-        # or Bot messages if we change the design.
-        # Assuming we are reacting to the Bot's log in SCORE_CHANNEL.
-        
-        # Emoji to Score Mapping
-        emoji_str = str(payload.emoji)
         score = 0
-        
-        # Simple mapping
-        if "👍" in emoji_str: score = 5
-        elif "👎" in emoji_str: score = 1
-        elif "😄" in emoji_str: score = 4
-        elif "😐" in emoji_str: score = 3
-        elif "😕" in emoji_str: score = 2
-        # Add Number emojis if needed: '1️⃣', '2️⃣'...
-        elif "1️⃣" in emoji_str: score = 1
-        elif "2️⃣" in emoji_str: score = 2
-        elif "3️⃣" in emoji_str: score = 3
-        elif "4️⃣" in emoji_str: score = 4
-        elif "5️⃣" in emoji_str: score = 5
-        
+        emoji_str = str(payload.emoji)
+        for emoji, value in SCORE_EMOJIS.items():
+            if emoji in emoji_str:
+                score = value
+                break
+
         if score == 0:
             return
 
-        # Extract Input/Output from Embed or Message
-        # Assuming the Score Channel Log format:
-        # Embed Title: Input / Output
-        # Embed Description: ...
-        # Or fields.
-        
-        input_text = ""
-        output_text = ""
-        
-        if message.embeds:
-            embed = message.embeds[0]
-            # Heuristic extraction based on typical logging format
-            # Let's assume Field 0 is Input, Field 1 is Output
-            for field in embed.fields:
-                if field.name in ["Input", "入力", "User"]:
-                    input_text = field.value
-                elif field.name in ["Output", "出力", "Bot", "AI"]:
-                    output_text = field.value
-        else:
-            # Fallback if just text
-            content = message.content
-            # Try to split? Too ambiguous.
-            pass
-
-        if input_text and output_text:
-            logger.info(f"LEARNING DATA CAPTURED | Score: {score} | In: {input_text[:20]}... | Out: {output_text[:20]}...")
-            # TODO: Call RAG engine to save
-            # self.bot.rag_engine.add_memory(input_text, output_text, score) 
-            # (Assuming rag_engine is attached to bot or imported)
-        else:
-            logger.debug("Could not extract input/output from scored message.")
+        # Resolved from the local index: no fetch_message round-trip
+        turn = await self.scores.add_score(payload.message_id, payload.user_id, score)
+        if turn is None:
+            logger.debug("Reaction on a message that is not a logged turn.")
+            return
+
+        input_text = turn["input"]
+        output_text = turn["output"]
+        logger.info(f"LEARNING DATA CAPTURED | Score: {score} | In: {input_text[:20]}... | Out: {output_text[:20]}...")
+        # Saved in the background; the turn's score over every reaction is used when ranking memories
+        get_memory_engine().remember(
+            input_text, output_text, score=turn_score(turn), user_id=turn.get("user_id"), guild_id=turn.get("guild_id")
+        )
+
+def _clip(text, limit=1024):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
 
 async def setup(bot):
     await bot.add_cog(System(bot))
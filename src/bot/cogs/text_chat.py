@@ -2,7 +2,6 @@ import discord
 from discord.ext import commands
 import logging
 import asyncio
-import os
 from ...config import CHAT_CHANNEL_ID
 from ...services.ollama_client import OllamaClient
 from ...services.sbv2_client import SBV2Client
@@ -14,6 +13,21 @@ class TextChat(commands.Cog):
         self.bot = bot
         self.ollama = OllamaClient()
         self.sbv2 = SBV2Client()
+        self.warmup_task = None
+
+    async def cog_load(self):
+        # Preload the LLM, the TTS server and the memory collection in the background
+        # so the first real turn doesn't pay their cold-start cost
+        self.warmup_task = asyncio.create_task(self.warmup())
+
+    async def warmup(self):
+        await asyncio.gather(
+            self.ollama.warmup(), self.sbv2.warmup(), self.ollama.memory.warmup(), return_exceptions=True
+        )
+
+    async def cog_unload(self):
+        if self.warmup_task and not self.warmup_task.done():
+            self.warmup_task.cancel()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -31,58 +45,61 @@ class TextChat(commands.Cog):
         user_text = message.content
         logger.info(f"Text Message from {message.author}: {user_text}")
 
+        # Voice Reply (if user is in VC and bot is capable)
+        voice_cog = self.bot.get_cog("VoiceChat")
+        speak = (
+            voice_cog is not None
+            and message.guild.voice_client is not None
+            and message.guild.voice_client.is_connected()
+        )
+
         async with message.channel.typing():
-            # 2. Ollama Generation (Async wrapper)
-            loop = asyncio.get_event_loop()
-            try:
-                # TODO: Add context/RAG here
-                ai_text = await loop.run_in_executor(
-                    None, 
-                    lambda: self.ollama.generate(user_text, user_id=message.author.id)
+            # 2. Ollama Generation (Streaming)
+            # Sentences are handed to TTS while the rest is still generating.
+            speech_queue = asyncio.Queue()
+            speak_task = None
+            if speak:
+                speak_task = asyncio.create_task(
+                    voice_cog.speak_sentences(message.guild, self._drain(speech_queue), source="text_chat")
                 )
+
+            # Sentences are for TTS only; the text reply keeps the model's own formatting
+            reply = []
+            try:
+                async for sentence in self.ollama.stream_sentences(
+                    user_text, user_id=message.author.id, guild_id=message.guild.id, text=reply
+                ):
+                    await speech_queue.put(sentence)
             except Exception as e:
                 logger.error(f"Generate error: {e}")
-                ai_text = "エラーが発生しました。"
+                if not "".join(reply).strip():
+                    reply = ["エラーが発生しました。"]
+                    await speech_queue.put(reply[0])
+            finally:
+                await speech_queue.put(None)
+
+            ai_text = "".join(reply).strip()
 
             # 3. Send Text Reply
-            await message.reply(ai_text)
-            
-            # 4. Voice Reply (if user is in VC and bot is capable)
-            if message.guild.voice_client and message.guild.voice_client.is_connected():
-                
-                # Notify Frontend
-                if hasattr(self.bot, "ws_server"):
-                    await self.bot.ws_server.broadcast({
-                        "type": "speaking", 
-                        "text": ai_text,
-                        "source": "text_chat"
-                    })
-
-                # Generate Audio (Async wrapper)
-                try:
-                    wav_path = await loop.run_in_executor(
-                        None,
-                        lambda: self.sbv2.tts(ai_text)
-                    )
-                except Exception as e:
-                    logger.error(f"TTS error: {e}")
-                    wav_path = None
-                
-                if wav_path and os.path.exists(wav_path):
-                     # Play Audio
-                     def after_play(error):
-                         if error:
-                             logger.error(f"Player error: {error}")
-                         try:
-                             os.remove(wav_path)
-                             logger.info(f"Removed temp file: {wav_path}")
-                         except Exception as e:
-                             logger.error(f"Failed to remove temp file: {e}")
-
-                     source = discord.FFmpegPCMAudio(wav_path)
-                     message.guild.voice_client.play(source, after=after_play)
-                else:
-                    logger.warning("Failed to generate TTS audio.")
+            if ai_text:
+                await message.reply(ai_text)
+                self.bot.dispatch("dialogue_turn", message.author, user_text, ai_text, "text_chat")
+            else:
+                logger.warning("No AI text generated.")
+
+        if speak_task:
+            try:
+                await speak_task
+            except Exception as e:
+                logger.error(f"TTS error: {e}")
+
+    @staticmethod
+    async def _drain(queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            yield item
 
 async def setup(bot):
     await bot.add_cog(TextChat(bot))
@@ -2,19 +2,110 @@ import discord
 from discord.ext import commands, voice_recv
 import logging
 import asyncio
+import time
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from ...services.stt_engine import STTEngine
+from ...services.stt_streaming import StreamingTranscriber
+from ...services.stt_scheduler import STTScheduler
+from ...services.stt_workers import STTWorkerPool
+from ...services.speech_pipeline import SpeechPipeline, synthesize_opus
+from ...services.turn_controller import TurnController
+from ...services.sbv2_client import SBV2Client
+from ...services.ollama_client import OllamaClient, FALLBACK_TEXT
+from ...services.llm_scheduler import VOICE
+from ...services.tts_cache import TTSCache
+from ...services.latency import TurnTrace, current_trace
 from ...utils.audio_recorder import AudioRecorder
-from ...config import VOICE_CHANNEL_ID, CHAT_CHANNEL_ID, BOT_USER_ID
+from ...utils.voice_capture import VoiceCaptureWriter, capture_path
+from ...utils.voice_sink import SpeechGateSink, SILENT_FRAME
+from ...utils.sentence_splitter import iter_text_sentences, split_sentences
+from ...config import (
+    VOICE_CHANNEL_ID, CHAT_CHANNEL_ID, BOT_USER_ID, STT_STREAMING, STT_PARTIAL_INTERVAL, STT_BUSY_BACKLOG, STT_WORKERS,
+    BARGE_IN, BARGE_IN_MIN_SPEECH, VOICE_CAPTURE_DIR, VOICE_CAPTURE_PAYLOAD, RECORDER_IDLE_TTL
+)
 
 logger = logging.getLogger(__name__)
 
+SPEAK_TEST_TEXT = "これはマイクのテストです。聞こえていますか？"
+DIALOGUE_ERROR_TEXT = "ごめんね、聞こえなかったみたい。"
+
 class VoiceChat(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.stt = STTEngine() # Handles model loading
+        # Model is loaded in the background (see cog_load); in worker processes if STT_WORKERS > 0
+        self.stt = STTWorkerPool() if STT_WORKERS > 0 else STTEngine()
         self.recorders = {} # {user_id: AudioRecorder}
-        self.executor = ThreadPoolExecutor(max_workers=2) # parallel transcriptions
+        self.clock = time.time # Time of recorders and end-of-speech timers (the replay uses the capture's)
+        # Recorder lookup/creation + write (voice thread) vs. idle eviction (event loop)
+        self.recorders_lock = threading.Lock()
+        self.pipelines = {} # {guild_id: SpeechPipeline}
+        self.turns = {} # {guild_id: TurnController}
+        self.barged_in = {} # {user_id: utterance counter that already interrupted the bot}
+        self.captures = {} # {guild_id: VoiceCaptureWriter} (!capture)
+        self.sbv2 = SBV2Client()
+        self.ollama = None # Own OllamaClient, only if TextChat is not loaded (see ollama_client)
+        self.tts_cache = TTSCache() # Opus packets of already spoken sentences
+        self.prefill_task = None
+        self.evict_task = None
+        self.executor = ThreadPoolExecutor(max_workers=2) # partial passes + batched final decodes
+        self.stt_scheduler = STTScheduler(self.stt, self.executor) # final decodes of all users, batched
+        # Streaming partial transcription state (touched from the voice thread)
+        self.transcribers = {} # {user_id: (utterance counter, StreamingTranscriber)}
+        self.partial_inflight = set()
+        self.last_partial = {} # {user_id: monotonic time of the last partial pass}
+        self.streaming = STT_STREAMING
+
+    async def cog_load(self):
+        # Loading Whisper takes seconds to minutes; don't block setup_hook / login
+        self.stt.load_in_background()
+        self.stt_scheduler.start()
+        self.prefill_task = asyncio.create_task(self.prefill_tts_cache())
+        self.evict_task = asyncio.create_task(self.evict_idle_recorders())
+
+    async def cog_unload(self):
+        self.stt_scheduler.stop()
+        for capture in self.captures.values():
+            capture.close()
+        self.captures.clear()
+        if isinstance(self.stt, STTWorkerPool):
+            await asyncio.get_event_loop().run_in_executor(None, self.stt.close)
+        if self.prefill_task and not self.prefill_task.done():
+            self.prefill_task.cancel()
+        if self.evict_task:
+            self.evict_task.cancel()
+
+    async def evict_idle_recorders(self):
+        """
+        Drop the recorders (and their ~0.7MB rings) of users who stopped sending packets,
+        e.g. left the channel, so memory tracks the active speakers.
+        """
+        while True:
+            await asyncio.sleep(min(60.0, RECORDER_IDLE_TTL / 2))
+            evicted = []
+            with self.recorders_lock:
+                now = self.clock()
+                for user_id, recorder in list(self.recorders.items()):
+                    with recorder.lock:
+                        if recorder.is_speaking or recorder.timer_armed or now - recorder.last_packet_time < RECORDER_IDLE_TTL:
+                            continue
+                    del self.recorders[user_id]
+                    evicted.append(user_id)
+            for user_id in evicted:
+                self.transcribers.pop(user_id, None)
+                self.last_partial.pop(user_id, None)
+                self.barged_in.pop(user_id, None)
+                logger.debug(f"Evicted idle recorder of {user_id}")
+
+    async def prefill_tts_cache(self):
+        """
+        Make sure the stock lines (fallbacks, errors, test sentence) are cached,
+        so they play without synthesis or encoding when needed.
+        """
+        lines = [FALLBACK_TEXT, DIALOGUE_ERROR_TEXT, SPEAK_TEST_TEXT]
+        for line in lines:
+            for sentence in split_sentences(line):
+                await synthesize_opus(self.sbv2, sentence, cache=self.tts_cache)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -28,50 +119,258 @@ class VoiceChat(commands.Cog):
                 await ctx.voice_client.move_to(channel)
             else:
                 vc = await channel.connect(cls=voice_recv.VoiceRecvClient)
-                # Listen to everyone
-                vc.listen(voice_recv.BasicSink(self.on_voice_packet))
+                # Listen to everyone; Opus is decoded only for frames that may contain speech
+                vc.listen(SpeechGateSink(self.on_voice_packet, ignore=self.ignores))
             await ctx.send(f"Connected to {channel.name}")
+            if not self.stt.is_ready:
+                if self.stt.load_error:
+                    await ctx.send("音声認識モデルの読み込みに失敗しました。")
+                else:
+                    await ctx.send("音声認識モデルを読み込み中です。準備ができるまで聞き取りはできません。")
         else:
             await ctx.send("You are not in a voice channel.")
 
     @commands.command()
     async def leave(self, ctx):
         if ctx.voice_client:
+            turn = self.turns.pop(ctx.guild.id, None)
+            if turn:
+                turn.cancel()
+            pipeline = self.pipelines.pop(ctx.guild.id, None)
+            if pipeline:
+                pipeline.stop()
+            capture = self.captures.pop(ctx.guild.id, None)
+            if capture:
+                capture.close()
             await ctx.voice_client.disconnect()
             await ctx.send("Disconnected.")
 
+    @commands.command()
+    async def capture(self, ctx, action: str = "start"):
+        """
+        Record the received voice packets of this guild for offline replay (!capture start / stop).
+        """
+        capture = self.captures.pop(ctx.guild.id, None)
+        if capture:
+            capture.close()
+            await ctx.send(f"Capture stopped: {capture.path} ({capture.packets} packets)")
+        if action == "start":
+            capture = VoiceCaptureWriter(capture_path(VOICE_CAPTURE_DIR, ctx.guild.id), payload=VOICE_CAPTURE_PAYLOAD)
+            self.captures[ctx.guild.id] = capture
+            await ctx.send(f"Capturing voice packets to {capture.path}")
+
+    def ignores(self, user):
+        """
+        Users whose audio is dropped before decoding (bots, and BOT_USER_ID as a double check).
+        """
+        return user.bot or bool(BOT_USER_ID and str(user.id) == str(BOT_USER_ID))
+
     def on_voice_packet(self, user, data):
         """
-        Callback from BasicSink.
+        Callback from SpeechGateSink (ignored users are already dropped).
         user: discord.Member or User
-        data: VoiceData object (has .pcm)
+        data: VoiceData object (.pcm is b"" for silent frames, which were not decoded)
         """
-        if not user or user.bot:
+        capture = self.captures.get(user.guild.id)
+        if capture:
+            capture.write(user.id, data)
+
+        # Nothing to do with the audio until Whisper is ready
+        if not self.stt.is_ready:
             return
+
+        user_id = user.id
+        pcm = data.pcm
+        # Written under the dict lock, so eviction never drops a recorder that is receiving audio
+        with self.recorders_lock:
+            recorder = self.recorders.get(user_id)
+            if not pcm:
+                # Silent frame: only matters inside an utterance, where it keeps the audio contiguous
+                if recorder is None or not recorder.is_speaking:
+                    return
+                pcm = SILENT_FRAME
+            if recorder is None:
+                recorder = self.recorders[user_id] = AudioRecorder(user_id, clock=self.clock)
+
+            # Write to recorder; read its state in the same critical section,
+            # since the end-of-speech timer may flush it as soon as the lock is released
+            with recorder.lock:
+                audio = recorder.write(pcm)
+                speech_started = recorder.speech_started
+                utterance = recorder.utterances
+
+        # Talking over the bot interrupts it (once per utterance, ignoring clicks/coughs)
+        if BARGE_IN and speech_started is not None and self.barged_in.get(user_id) != utterance:
+            if self.clock() - speech_started >= BARGE_IN_MIN_SPEECH:
+                self.barged_in[user_id] = utterance
+                self.bot.loop.call_soon_threadsafe(self.barge_in, user)
         
-        # Check if ignoring specific ID (Double check safety)
-        if BOT_USER_ID and str(user.id) == str(BOT_USER_ID):
+        if audio is not None:
+            self.utterance_ended(user, recorder, audio)
             return
 
+        if recorder.is_speaking and not recorder.timer_armed:
+            # The silence after the last packet ends the utterance, even if no packet follows
+            recorder.timer_armed = True
+            self.bot.loop.call_soon_threadsafe(self.arm_end_of_speech, user, recorder)
+        if self.streaming and recorder.is_speaking:
+            self.schedule_partial(user, recorder)
+
+    def utterance_ended(self, user, recorder, audio):
+        """
+        Silence detected (packet or timer). Transcribe the utterance (16kHz mono float32).
+        """
+        # Reuse the partial passes if they belong to this utterance (flush bumped the counter)
+        utterance, transcriber = self.transcribers.pop(user.id, (None, None))
+        if utterance != recorder.utterances - 1:
+            transcriber = None
+        trace = self.new_trace(user, recorder)
+        asyncio.run_coroutine_threadsafe(self.process_transcription(user, audio, transcriber, trace), self.bot.loop)
+
+    def arm_end_of_speech(self, user, recorder):
+        """
+        Schedule the end-of-speech check of a recorder for the moment its silence window ends (event loop).
+        New voice only moves the deadline later, so one timer per utterance is enough:
+        when it fires early it re-arms itself.
+        """
+        deadline = recorder.end_of_speech_deadline()
+        if deadline is None:
+            recorder.timer_armed = False
+            return
+        self.call_at(deadline, self.end_of_speech_due, user, recorder)
+
+    def call_at(self, when, callback, *args):
+        """
+        Run callback on the event loop at clock time `when` (bench/voice_replay.py runs these on the capture's clock).
+        """
+        self.bot.loop.call_later(max(0.0, when - self.clock()), callback, *args)
+
+    def end_of_speech_due(self, user, recorder):
+        deadline = recorder.end_of_speech_deadline()
+        if deadline is not None and deadline > self.clock():
+            # The user kept talking
+            self.arm_end_of_speech(user, recorder)
+            return None
+        # Flushing converts the utterance (CPU); keep it off the loop and out of the STT executor
+        return self.bot.loop.run_in_executor(None, self.poll_recorder, user, recorder)
+
+    def poll_recorder(self, user, recorder):
+        audio = recorder.poll()
+        if audio is not None:
+            recorder.timer_armed = False
+            self.utterance_ended(user, recorder, audio)
+        else:
+            # Discarded (too short), already flushed by a packet, or not quite due yet
+            self.bot.loop.call_soon_threadsafe(self.arm_end_of_speech, user, recorder)
+
+    def new_trace(self, user, recorder):
+        """
+        Start the latency trace of a turn from the timestamps of the utterance that was just flushed.
+        """
+        trace = TurnTrace(user.guild.id, user.id)
+        speech_start, last_voice, speech_end = recorder.utterance_times
+        for event, at in (
+            ("speech_start", speech_start),
+            ("last_voice", last_voice),
+            ("last_packet", recorder.last_packet_time),
+            ("speech_end", speech_end)
+        ):
+            if at is not None:
+                trace.mark(event, at)
+        return trace
+
+    def barge_in(self, user):
+        """
+        A user started talking: interrupt the reply being generated/spoken in their guild.
+        """
+        turn = self.turns.get(user.guild.id)
+        if turn is None or not turn.barge_in():
+            return
+        logger.info(f"{user.name} barged in, interrupting the current reply.")
+        if hasattr(self.bot, "ws_server"):
+            self.bot.ws_server.broadcast_nowait({
+                "type": "interrupted",
+                "user_id": user.id,
+                "name": user.name
+            })
+
+    def schedule_partial(self, user, recorder):
+        """
+        Start a partial transcription pass for an ongoing utterance (voice thread).
+        At most one pass per user is in flight, at most one per STT_PARTIAL_INTERVAL.
+        """
         user_id = user.id
-        
-        if user_id not in self.recorders:
-            self.recorders[user_id] = AudioRecorder(user_id)
-        
-        # Write to recorder
-        # data.pcm is bytes
-        file_path = self.recorders[user_id].write(data.pcm)
-        
-        if file_path:
-            # Silence detected and file saved. Transcribe it.
-            asyncio.run_coroutine_threadsafe(self.process_transcription(user, file_path), self.bot.loop)
+        now = time.monotonic()
+        # Partial passes are a luxury: skip them while final decodes are queued
+        if self.stt_scheduler.backlog >= STT_BUSY_BACKLOG:
+            return
+        if user_id in self.partial_inflight or now - self.last_partial.get(user_id, 0) < STT_PARTIAL_INTERVAL:
+            return
+
+        # One transcriber per utterance; a discarded utterance gets a fresh one
+        utterance, transcriber = self.transcribers.get(user_id, (None, None))
+        if transcriber is None or utterance != recorder.utterances:
+            transcriber = StreamingTranscriber(self.stt)
+            self.transcribers[user_id] = (recorder.utterances, transcriber)
+
+        self.partial_inflight.add(user_id)
+        self.last_partial[user_id] = now
+        # Copy only; the conversion runs in the executor, not in the voice thread
+        samples = recorder.snapshot()
+        asyncio.run_coroutine_threadsafe(self.process_partial(user, recorder, transcriber, samples), self.bot.loop)
 
-    async def process_transcription(self, user, file_path):
+    async def process_partial(self, user, recorder, transcriber, samples):
+        loop = asyncio.get_event_loop()
+        try:
+            committed, unstable = await loop.run_in_executor(
+                self.executor,
+                lambda: transcriber.update(recorder.to_whisper_audio(samples))
+            )
+        except Exception as e:
+            logger.error(f"Partial transcription failed: {e}")
+            return
+        finally:
+            self.partial_inflight.discard(user.id)
+
+        if not committed and not unstable:
+            return
+
+        # Cogs can listen with on_partial_transcript(user, committed, unstable)
+        self.bot.dispatch("partial_transcript", user, committed, unstable)
+        if hasattr(self.bot, "ws_server"):
+            await self.bot.ws_server.broadcast({
+                "type": "partial_transcript",
+                "user_id": user.id,
+                "name": user.name,
+                "committed": committed,
+                "unstable": unstable
+            })
+
+    async def process_transcription(self, user, audio, transcriber=None, trace=None):
         logger.info(f"Transcribing audio for {user.name}...")
+        if trace:
+            # STT, Ollama, SBV2 and playback of this turn mark the same trace
+            current_trace.set(trace)
+            trace.observe("endpointing", "last_voice", "speech_end", backend="vad")
         
-        # Run specialized STT in executor
-        loop = asyncio.get_event_loop()
-        text = await loop.run_in_executor(self.executor, self.stt.transcribe, file_path)
+        # Final decodes of all users go through the batching scheduler
+        # With streaming, most of the text is already committed and only the tail is decoded
+        committed = ""
+        if transcriber:
+            loop = asyncio.get_event_loop()
+            committed, audio = await loop.run_in_executor(self.executor, transcriber.take_tail, audio)
+        text = committed
+        if audio is not None:
+            try:
+                tail_text = await self.stt_scheduler.transcribe(audio, initial_prompt=committed or None)
+            except Exception as e:
+                logger.error(f"Transcription failed: {e}")
+                tail_text = ""
+            if tail_text is None:
+                # Too old to answer (STT backlog); skip rather than reply late
+                logger.info(f"Skipped stale utterance of {user.name}")
+                return
+            text = (committed + tail_text).strip()
         
         if text:
             logger.info(f"Transcription ({user.name}): {text}")
@@ -90,16 +389,9 @@ class VoiceChat(commands.Cog):
             
         else:
             logger.debug("No text transcribed.")
-            
-        # Cleanup file (Input audio)
-        try:
-             import os
-             os.remove(file_path)
-        except:
-            pass
 
     @commands.command()
-    async def speak_test(self, ctx, *, text="これはマイクのテストです。聞こえていますか？"):
+    async def speak_test(self, ctx, *, text=SPEAK_TEST_TEXT):
         """
         Debug command to force TTS playback.
         """
@@ -116,99 +408,94 @@ class VoiceChat(commands.Cog):
         # We need a dummy user object or just use ctx.author
         await self.handle_dialogue(ctx.author, f"REPEAT_THIS: {text}", skip_llm=True)
 
+    def ollama_client(self):
+        """
+        TextChat's client if it is loaded (text and voice share the history), otherwise one kept by this cog.
+        """
+        text_cog = self.bot.get_cog("TextChat")
+        if text_cog:
+            return text_cog.ollama
+        if self.ollama is None:
+            self.ollama = OllamaClient()
+        return self.ollama
+
     async def handle_dialogue(self, user, text, skip_llm=False):
         """
-        Main pipeline: Text -> Ollama -> SBV2 -> Voice
+        Main pipeline: Text -> Ollama (stream) -> SBV2 (per sentence) -> Voice
         """
         if not user.guild.voice_client:
             logger.warning("No voice client found in handle_dialogue")
             return
 
-        loop = asyncio.get_event_loop()
-        
-        ollama_client = None
-        sbv2_client = None
-        
-        text_cog = self.bot.get_cog("TextChat")
-        if text_cog:
-            ollama_client = text_cog.ollama
-            sbv2_client = text_cog.sbv2
-        else:
-            from ...services.ollama_client import OllamaClient
-            from ...services.sbv2_client import SBV2Client
-            ollama_client = OllamaClient()
-            sbv2_client = SBV2Client()
+        ollama_client = self.ollama_client()
 
+        # Raw reply as generated (the sentences are cleaned up for TTS)
+        reply = []
         if skip_llm:
             # Extract text (remove REPEAT_THIS prefix if present, purely for clarity)
-            ai_text = text.replace("REPEAT_THIS: ", "")
+            reply.append(text.replace("REPEAT_THIS: ", ""))
+            sentences = iter_text_sentences(reply[0])
         else:
-            try:
-                ai_text = await loop.run_in_executor(
-                    None, 
-                    lambda: ollama_client.generate(text, user_id=user.id)
-                )
-            except Exception as e:
-                logger.error(f"Ollama error: {e}")
-                ai_text = "ごめんね、聞こえなかったみたい。"
+            sentences = ollama_client.stream_sentences(
+                text, user_id=user.id, guild_id=user.guild.id, priority=VOICE, text=reply
+            )
 
+        try:
+            spoken = await self.speak_sentences(user.guild, sentences, source="voice_chat")
+            if spoken is None:
+                logger.info("Reply interrupted.")
+                return
+        except Exception as e:
+            logger.error(f"Dialogue error: {e}")
+            # Cached line, plays without synthesis
+            await self.speak_sentences(user.guild, iter_text_sentences(DIALOGUE_ERROR_TEXT), source="voice_chat")
+            return
+
+        ai_text = "".join(reply).strip()
         if not ai_text:
             logger.warning("No AI text generated.")
             return
 
         logger.info(f"AI Response: {ai_text}")
+        if not skip_llm:
+            # Cogs can listen with on_dialogue_turn(user, input_text, output_text, source)
+            self.bot.dispatch("dialogue_turn", user, text, ai_text, "voice_chat")
 
-        # 2. WebSocket Broadcast
-        if hasattr(self.bot, "ws_server"):
-            await self.bot.ws_server.broadcast({
-                "type": "speaking", 
-                "text": ai_text,
-                "source": "voice_chat"
-            })
-
-        # 3. SBV2 TTS (Async)
-        logger.info("Generating TTS...")
-        try:
-            wav_path = await loop.run_in_executor(
-                None,
-                lambda: sbv2_client.tts(ai_text)
+    def get_pipeline(self, guild):
+        """
+        Return the guild's SpeechPipeline (created on first use).
+        """
+        pipeline = self.pipelines.get(guild.id)
+        if pipeline is None:
+            pipeline = SpeechPipeline(
+                guild, self.sbv2,
+                ws_server=getattr(self.bot, "ws_server", None),
+                cache=self.tts_cache
             )
-        except Exception as e:
-            logger.error(f"TTS error: {e}")
-            return
+            self.pipelines[guild.id] = pipeline
+        return pipeline
 
-        # 4. Play Audio
-        import os
-        if wav_path and os.path.exists(wav_path):
-             file_size = os.path.getsize(wav_path)
-             logger.info(f"Playing audio: {wav_path} (Size: {file_size} bytes)")
-             
-             if file_size == 0:
-                 logger.error("Generated WAV file is empty!")
-                 return
-
-             def after_play(error):
-                 if error:
-                     logger.error(f"Player error: {error}")
-                 else:
-                     logger.info("Playback finished successfully.")
-                 try:
-                     # os.remove(wav_path)
-                     pass # Debug: Keep file for a moment? Or just remove. 
-                     # Let's remove it to keep it clean, but if there's an issue we might want to check it.
-                     # For now, standard remove.
-                     os.remove(wav_path)
-                 except Exception as e:
-                     logger.error(f"Failed to remove temp file: {e}")
-
-             source = discord.FFmpegPCMAudio(wav_path)
-             
-             if user.guild.voice_client.is_playing():
-                 user.guild.voice_client.stop()
-                 
-             user.guild.voice_client.play(source, after=after_play)
-        else:
-            logger.warning("Failed to generate voice audio or file not found.")
+    def get_turn(self, guild):
+        """
+        Return the guild's TurnController (created on first use).
+        """
+        turn = self.turns.get(guild.id)
+        if turn is None:
+            turn = TurnController(self.get_pipeline(guild))
+            self.turns[guild.id] = turn
+        return turn
+
+    async def speak_sentences(self, guild, sentences, source="voice_chat"):
+        """
+        Speak sentences as soon as each one is available.
+        The reply is the guild's current turn: a newer reply or a barge-in cancels it,
+        including the generation of sentences that were not consumed yet.
+        :param sentences: Async iterable of sentences
+        :param source: Origin of the reply (for the frontend)
+        :return: The sentences that were received, or None if the reply was interrupted
+        """
+        pipeline = self.get_pipeline(guild)
+        return await self.get_turn(guild).run(pipeline.speak(sentences, source=source))
 
 async def setup(bot):
     await bot.add_cog(VoiceChat(bot))
@@ -51,6 +51,14 @@ class MyriaBot(commands.Bot):
         from ..services.websocket_server import WebSocketServer
         self.ws_server = WebSocketServer()
 
+    async def close(self):
+        # Flush queued memories, then close pooled HTTP connections (Ollama / SBV2)
+        from ..services.memory_engine import close_memory
+        from ..services.http_pool import close_all
+        await close_memory()
+        await close_all()
+        await super().close()
+
     async def on_ready(self):
         logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
 
@@ -18,13 +18,87 @@ if BOT_USER_ID:
 
 # Services
 WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "medium")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto")  # auto / cuda / cpu
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "auto")  # auto / float16 / int8 ...
+# Streaming STT: re-decode the ongoing utterance every STT_PARTIAL_INTERVAL seconds
+STT_STREAMING = os.getenv("STT_STREAMING", "true").lower() in ("1", "true", "yes")
+STT_PARTIAL_INTERVAL = float(os.getenv("STT_PARTIAL_INTERVAL", 0.5))
+STT_PARTIAL_BEAM = int(os.getenv("STT_PARTIAL_BEAM", 1))
+# Final transcriptions of all users are decoded in batches
+STT_MAX_BATCH = int(os.getenv("STT_MAX_BATCH", 4))
+STT_MAX_WAIT = float(os.getenv("STT_MAX_WAIT", 0.15))  # Seconds an utterance may wait for a batch
+# Quality tiers: full (beam 5) -> fast (beam 1) -> lite (smaller model, beam 1) as the backlog grows
+WHISPER_LITE_MODEL_SIZE = os.getenv("WHISPER_LITE_MODEL_SIZE", "small")  # Empty = no lite model
+STT_BUSY_BACKLOG = int(os.getenv("STT_BUSY_BACKLOG", 2))  # Queued utterances before dropping to 'fast'
+STT_OVERLOAD_BACKLOG = int(os.getenv("STT_OVERLOAD_BACKLOG", 4))  # ... and to 'lite'
+STT_LONG_UTTERANCE = float(os.getenv("STT_LONG_UTTERANCE", 8.0))  # Seconds; long ones step down a tier when busy
+STT_DEADLINE = float(os.getenv("STT_DEADLINE", 8.0))  # Utterances queued longer than this are dropped
+# Out-of-process STT: N worker processes (0 = decode in threads of the bot process)
+STT_WORKERS = int(os.getenv("STT_WORKERS", 0))
+STT_WORKER_THREADS = int(os.getenv("STT_WORKER_THREADS", 0))  # CPU threads per worker (0 = split the cores)
+# A worker that does not answer within TIMEOUT + FACTOR x the request's audio seconds is restarted
+STT_WORKER_TIMEOUT = float(os.getenv("STT_WORKER_TIMEOUT", 10.0))
+STT_WORKER_TIMEOUT_FACTOR = float(os.getenv("STT_WORKER_TIMEOUT_FACTOR", 3.0))
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded
 SBV2_URL = os.getenv("SBV2_URL", "http://127.0.0.1:5000")
+# Max concurrent SBV2 requests per guild while a reply is being spoken
+TTS_MAX_INFLIGHT = int(os.getenv("TTS_MAX_INFLIGHT", 2))
+# Barge-in: stop the current reply when a user talks over it
+BARGE_IN = os.getenv("BARGE_IN", "true").lower() in ("1", "true", "yes")
+BARGE_IN_MIN_SPEECH = float(os.getenv("BARGE_IN_MIN_SPEECH", 0.3))  # Seconds of speech before interrupting
+BARGE_IN_FADE = float(os.getenv("BARGE_IN_FADE", 0.2))  # Fade-out of the interrupted reply (seconds)
+# Recorders of users who sent no packet for this long (seconds) are dropped
+RECORDER_IDLE_TTL = float(os.getenv("RECORDER_IDLE_TTL", 300))
+# Voice packet capture (!capture) for offline replay (bench/voice_replay.py)
+VOICE_CAPTURE_DIR = os.getenv("VOICE_CAPTURE_DIR", "./data/captures")
+VOICE_CAPTURE_PAYLOAD = os.getenv("VOICE_CAPTURE_PAYLOAD", "opus")  # opus (compact) / pcm
+# Cache of synthesized sentences as Opus packets (memory LRU + disk)
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "./data/tts_cache")
+TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", 32))
+TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", 512))
+
+# Conversation sessions (per guild/user)
+CONV_TOKEN_BUDGET = int(os.getenv("CONV_TOKEN_BUDGET", 2048))  # Max estimated prompt tokens
+CONV_WINDOW_TURNS = int(os.getenv("CONV_WINDOW_TURNS", 8))  # Recent turns kept verbatim
+CONV_MAX_SESSIONS = int(os.getenv("CONV_MAX_SESSIONS", 200))
+CONV_IDLE_TTL = float(os.getenv("CONV_IDLE_TTL", 3600))  # Seconds
+
+# HTTP backends (connect/read timeouts in seconds)
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3.0))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 120.0))
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", 2))
+LLM_VOICE_RESERVED = int(os.getenv("LLM_VOICE_RESERVED", 1))  # Ollama slots only voice turns may use
+SBV2_CONNECT_TIMEOUT = float(os.getenv("SBV2_CONNECT_TIMEOUT", 3.0))
+SBV2_READ_TIMEOUT = float(os.getenv("SBV2_READ_TIMEOUT", 30.0))
+SBV2_MAX_CONCURRENCY = int(os.getenv("SBV2_MAX_CONCURRENCY", 4))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.5))
 
 # Vector DB
 CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./data/memory")
+# Scored dialogue logs (append-only JSONL segments)
+SCORE_STORE_DIR = os.getenv("SCORE_STORE_DIR", "./data/scores")
+SCORE_SEGMENT_BYTES = int(os.getenv("SCORE_SEGMENT_BYTES", 1024 * 1024))
+SCORE_COMPACT_SEGMENTS = int(os.getenv("SCORE_COMPACT_SEGMENTS", 8))  # Segments that trigger a compaction
+# Long-term memory (RAG over past dialogue pairs)
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() in ("1", "true", "yes")
+MEMORY_COLLECTION = os.getenv("MEMORY_COLLECTION", "myria_memory")
+MEMORY_EMBED_MODEL = os.getenv("MEMORY_EMBED_MODEL", "bge-m3")  # Ollama embedding model
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", 3))
+MEMORY_BUDGET = float(os.getenv("MEMORY_BUDGET", 0.25))  # Seconds a turn may spend on retrieval
+MEMORY_BATCH = int(os.getenv("MEMORY_BATCH", 16))  # Memories embedded per request
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", 2.0))  # Max seconds a write waits for a batch
+MEMORY_SCORE_WEIGHT = float(os.getenv("MEMORY_SCORE_WEIGHT", 0.3))  # Weight of reaction scores in ranking
+MEMORY_MIN_SIMILARITY = float(os.getenv("MEMORY_MIN_SIMILARITY", 0.35))
 
 # Websocket / API
 WS_HOST = "0.0.0.0"
 WS_PORT = 8000
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", 64))  # Pending messages per client
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 5.0))  # A client slower than this is dropped
+ENVELOPE_INTERVAL = float(os.getenv("ENVELOPE_INTERVAL", 0.06))  # Seconds between envelope/viseme messages
+
+# Latency tracing (/metrics, !latency)
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", 500))  # Recent samples per stage kept for p50/p95
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from ..config import CONV_TOKEN_BUDGET, CONV_WINDOW_TURNS, CONV_MAX_SESSIONS, CONV_IDLE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate without a tokenizer.
+    Japanese (non-ASCII) is roughly one token per character,
+    ASCII roughly one token per four characters.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4 + 4  # + per-message overhead
+
+
+class ConversationSession:
+    def __init__(self, key):
+        """
+        Conversation state for one (guild, user).
+        :param key: (guild_id, user_id)
+        """
+        self.key = key
+        self.summary = ""
+        self.turns = deque()  # (user_text, assistant_text), oldest first
+        self.pending = []  # Turns pushed out of the window, waiting to be summarized
+        self.summary_task = None
+        self.last_active = time.monotonic()
+
+    def messages(self, system_prompt, user_content, token_budget):
+        """
+        Build the message list for the next request.
+        Recent turns are included newest-first until the token budget is used up.
+        """
+        head = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            head.append({"role": "system", "content": f"これまでの会話の要約:\n{self.summary}"})
+
+        used = sum(estimate_tokens(m["content"]) for m in head) + estimate_tokens(user_content)
+        recent = []
+        for user_text, assistant_text in reversed(self.turns):
+            cost = estimate_tokens(user_text) + estimate_tokens(assistant_text)
+            if used + cost > token_budget:
+                break
+            used += cost
+            recent.append({"role": "assistant", "content": assistant_text})
+            recent.append({"role": "user", "content": user_text})
+        recent.reverse()
+
+        return head + recent + [{"role": "user", "content": user_content}]
+
+    def add_turn(self, user_text, assistant_text, window_turns, token_budget):
+        """
+        Record a finished turn and push old turns out of the sliding window.
+        """
+        self.turns.append((user_text, assistant_text))
+        self.last_active = time.monotonic()
+
+        # Keep half of the budget for the summary, the new prompt and the reply
+        turn_budget = token_budget // 2
+        while len(self.turns) > 1 and (
+            len(self.turns) > window_turns
+            or sum(estimate_tokens(u) + estimate_tokens(a) for u, a in self.turns) > turn_budget
+        ):
+            self.pending.append(self.turns.popleft())
+
+
+class ConversationStore:
+    def __init__(self, summarize, token_budget=None, window_turns=None, max_sessions=None, idle_ttl=None):
+        """
+        Per-(guild, user) conversation sessions with LRU eviction.
+        :param summarize: async callable(summary, turns) -> new summary
+        :param token_budget: Max estimated tokens per request
+        :param window_turns: Max recent turns kept verbatim
+        :param max_sessions: Max sessions kept in memory
+        :param idle_ttl: Seconds of inactivity before a session is dropped
+        """
+        self.summarize = summarize
+        self.token_budget = token_budget or CONV_TOKEN_BUDGET
+        self.window_turns = window_turns or CONV_WINDOW_TURNS
+        self.max_sessions = max_sessions or CONV_MAX_SESSIONS
+        self.idle_ttl = idle_ttl or CONV_IDLE_TTL
+        self.sessions = OrderedDict()
+
+    def get(self, guild_id, user_id):
+        """
+        Return the session for (guild_id, user_id), creating it if needed.
+        """
+        self._evict_idle()
+        key = (guild_id, user_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = ConversationSession(key)
+            self.sessions[key] = session
+            while len(self.sessions) > self.max_sessions:
+                _, evicted = self.sessions.popitem(last=False)
+                self._drop(evicted)
+        else:
+            self.sessions.move_to_end(key)
+        session.last_active = time.monotonic()
+        return session
+
+    def messages(self, session, system_prompt, user_content):
+        return session.messages(system_prompt, user_content, self.token_budget)
+
+    def add_turn(self, session, user_text, assistant_text):
+        """
+        Record a finished turn; older turns are summarized in the background.
+        """
+        session.add_turn(user_text, assistant_text, self.window_turns, self.token_budget)
+        if session.pending and (session.summary_task is None or session.summary_task.done()):
+            session.summary_task = asyncio.create_task(self._fold_pending(session))
+
+    def clear(self, guild_id=None, user_id=None):
+        """
+        Drop sessions. With no arguments every session is cleared.
+        """
+        for key in list(self.sessions):
+            if (guild_id is None or key[0] == guild_id) and (user_id is None or key[1] == user_id):
+                self._drop(self.sessions.pop(key))
+
+    async def _fold_pending(self, session):
+        # Fold turns that left the window into the rolling summary
+        while session.pending:
+            turns = session.pending
+            session.pending = []
+            try:
+                summary = await self.summarize(session.summary, turns)
+            except Exception as e:
+                # Keep the turns: the next fold (after the next turn) tries again
+                session.pending = turns + session.pending
+                logger.error(f"Conversation summarization failed: {e}")
+                return
+            if summary:
+                session.summary = summary
+                logger.debug(f"Summarized {len(turns)} turns for {session.key}")
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        # OrderedDict is kept in LRU order, so idle sessions are at the front
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if now - session.last_active < self.idle_ttl:
+                break
+            self.sessions.popitem(last=False)
+            self._drop(session)
+
+    def _drop(self, session):
+        if session.summary_task and not session.summary_task.done():
+            session.summary_task.cancel()
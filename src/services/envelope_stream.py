@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+from ..config import ENVELOPE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Binary message layout (little endian), sent on the "envelope" channel:
+#   header: version (uint8), kind (uint8), frame count (uint16), guild id (uint64)
+#   frames: play time (float64, unix seconds), level (uint8, 0-255), mouth (uint8)
+# One frame per 20ms of played audio. Mouth: 0 closed, 1 a, 2 i, 3 u, 4 e, 5 o.
+VERSION = 1
+KIND_ENVELOPE = 1
+HEADER = struct.Struct("<BBHQ")
+FRAME = struct.Struct("<dBB")
+CHANNEL = "envelope"
+
+
+class EnvelopeStream:
+    def __init__(self, ws_server, guild_id, interval=None):
+        """
+        Streams the level/mouth shape of the audio being played in a guild
+        to subscribed WebSocket clients, batched into small binary messages.
+        :param ws_server: WebSocketServer
+        :param guild_id: Guild whose playback this describes
+        :param interval: Seconds between flushes
+        """
+        self.ws_server = ws_server
+        self.guild_id = guild_id
+        self.interval = interval or ENVELOPE_INTERVAL
+        # Appended to by the voice player thread, drained on the event loop
+        self.frames = deque()
+        self.active = False  # Anyone subscribed (checked by the player thread)
+        self._task = None
+        self._owner = None
+
+    def push(self, level, mouth):
+        """
+        Record one played frame. Called from the player thread for every 20ms frame.
+        """
+        self.frames.append(FRAME.pack(time.time(), level, mouth))
+
+    def start(self, owner):
+        """
+        Start flushing while a reply plays.
+        :param owner: The reply's AudioSource; a newer reply takes over the stream
+        """
+        self._owner = owner
+        self.active = self.ws_server.has_subscribers(CHANNEL)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    def stop(self, owner):
+        """
+        Flush what is left, close the mouth and stop flushing
+        (unless a newer reply already took over).
+        """
+        if owner is not self._owner:
+            return
+        self._owner = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.active:
+            self.push(0, 0)
+        self.flush()
+        self.active = False
+
+    async def _flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.flush()
+                self.active = self.ws_server.has_subscribers(CHANNEL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Envelope stream stopped: {e}")
+
+    def flush(self):
+        count = len(self.frames)
+        if not count:
+            return
+        parts = [HEADER.pack(VERSION, KIND_ENVELOPE, count, self.guild_id)]
+        for _ in range(count):
+            parts.append(self.frames.popleft())
+        if self.active:
+            self.ws_server.broadcast_binary_nowait(b"".join(parts), CHANNEL)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import aiohttp
+from ..config import HTTP_RETRIES, HTTP_RETRY_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying (server busy / restarting)
+RETRY_STATUSES = {429, 502, 503, 504}
+# Failures before the request reached the backend. A read timeout is not one of them:
+# the backend may have spent the whole timeout generating, and resending doubles the load
+RETRY_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+class BackendPool:
+    def __init__(self, name, base_url, max_concurrency=4, connect_timeout=3.0, read_timeout=60.0,
+                 retries=None, backoff=None):
+        """
+        Keep-alive connection pool for one HTTP backend (Ollama, SBV2, ...).
+        :param name: Backend name (for logs)
+        :param base_url: e.g. http://localhost:11434
+        :param max_concurrency: Max requests in flight to this backend
+        :param connect_timeout: Seconds to establish a connection
+        :param read_timeout: Max seconds between two reads of the response
+        :param retries: Retries on failures to connect / busy statuses
+        :param backoff: Base delay (seconds) for exponential backoff
+        """
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.retries = HTTP_RETRIES if retries is None else retries
+        self.backoff = HTTP_RETRY_BACKOFF if backoff is None else backoff
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    def session(self):
+        """
+        Return the shared ClientSession (created on first use, inside the running loop).
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method, path, **kwargs):
+        """
+        Send a request and yield the response.
+        Failures to connect and busy statuses are retried with backoff until the
+        response is handed out. Read timeouts are not retried (the request may be
+        processing), and once the body is being read there is no retry.
+        """
+        url = f"{self.base_url}{path}"
+        async with self.semaphore:
+            attempt = 0
+            while True:
+                try:
+                    resp = await self.session().request(method, url, **kwargs)
+                except RETRY_ERRORS as e:
+                    if attempt >= self.retries:
+                        raise
+                    logger.warning(f"{self.name} request failed ({e!r}), retrying...")
+                else:
+                    if resp.status not in RETRY_STATUSES or attempt >= self.retries:
+                        break
+                    logger.warning(f"{self.name} returned {resp.status}, retrying...")
+                    resp.release()
+
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+            try:
+                yield resp
+            except BaseException:
+                # Cancelled or failed mid-body: drop the connection so the
+                # backend stops generating instead of finishing for nobody
+                resp.close()
+                raise
+            finally:
+                resp.release()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_backends = {}
+
+
+def get_backend(name, base_url, **kwargs):
+    """
+    Return the shared pool for a backend, creating it on first use.
+    Every client of the same backend shares one pool and one concurrency limit.
+    """
+    backend = _backends.get(name)
+    if backend is None:
+        backend = BackendPool(name, base_url, **kwargs)
+        _backends[name] = backend
+    return backend
+
+
+async def close_all():
+    for backend in _backends.values():
+        await backend.close()
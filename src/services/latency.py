@@ -0,0 +1,174 @@
+import contextvars
+import time
+from bisect import bisect_left
+from collections import deque
+from ..config import LATENCY_WINDOW
+
+# Histogram buckets (seconds), shared by every stage
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+METRIC = "myria_stage_latency_seconds"
+
+# Stages of a voice turn, in pipeline order (for display):
+#   endpointing      last voiced packet -> end of speech detected (VAD)
+#   stt_queue        utterance queued -> its decode started
+#   stt_decode       decode started -> text
+#   llm_queue        waiting for an Ollama slot
+#   llm_first_token  request sent -> first token
+#   llm_total        request sent -> done
+#   tts_first_byte   SBV2 request -> first byte of the WAV
+#   tts_total        SBV2 request -> whole WAV
+#   response         end of speech detected -> playback started
+#   end_to_end       last voiced packet -> playback started
+#   playback         playback started -> ended
+STAGES = (
+    "endpointing", "stt_queue", "stt_decode", "llm_queue", "llm_first_token", "llm_total",
+    "tts_first_byte", "tts_total", "response", "end_to_end", "playback"
+)
+
+# The trace of the turn being handled; asyncio tasks inherit it from the task that created them
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class LatencyHistogram:
+    def __init__(self, window=None):
+        """
+        Cumulative Prometheus-style buckets plus a window of recent values for percentiles.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last one is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window or LATENCY_WINDOW)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+
+class LatencyMetrics:
+    def __init__(self):
+        """
+        In-process latency histograms keyed by (stage, guild, backend).
+        """
+        self.histograms = {}  # {(stage, guild, backend): LatencyHistogram}
+
+    def observe(self, stage, seconds, guild=None, backend=None):
+        if seconds is None or seconds < 0:
+            return
+        key = (stage, "" if guild is None else str(guild), backend or "")
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[key] = histogram
+        histogram.observe(seconds)
+
+    def reset(self):
+        """
+        Forget every sample (e.g. between benchmark runs).
+        """
+        self.histograms.clear()
+
+    def summary(self, guild=None):
+        """
+        Recent p50/p95 per stage (all backends; all guilds unless one is given).
+        :return: {stage: {"count", "p50", "p95"}} in pipeline order
+        """
+        values = {}
+        for (stage, stage_guild, _), histogram in self.histograms.items():
+            if guild is not None and stage_guild != str(guild):
+                continue
+            values.setdefault(stage, []).extend(histogram.recent)
+
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        summary = {}
+        for stage in sorted(values, key=lambda s: order.get(s, len(order))):
+            recent = sorted(values[stage])
+            summary[stage] = {
+                "count": len(recent),
+                "p50": percentile(recent, 0.5),
+                "p95": percentile(recent, 0.95)
+            }
+        return summary
+
+    def render(self) -> str:
+        """
+        All histograms in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {METRIC} Latency of the voice pipeline stages.",
+            f"# TYPE {METRIC} histogram"
+        ]
+        for (stage, guild, backend), histogram in sorted(self.histograms.items()):
+            labels = f'stage="{stage}",guild="{guild}",backend="{backend}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{METRIC}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{METRIC}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{METRIC}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class TurnTrace:
+    def __init__(self, guild_id, user_id=None):
+        """
+        Timestamps (time.time()) of one voice turn as it moves through the pipeline.
+        Set it as current_trace so the STT/Ollama/SBV2/playback code can mark it.
+        """
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.marks = {}
+
+    def mark(self, event, at=None):
+        """
+        Record when an event happened. The first time counts (e.g. the first sentence's playback).
+        """
+        self.marks.setdefault(event, time.time() if at is None else at)
+
+    def span(self, start, end):
+        if start in self.marks and end in self.marks:
+            return self.marks[end] - self.marks[start]
+        return None
+
+    def observe(self, stage, start, end, backend=None):
+        """
+        Feed the time between two marks into the stage's histogram.
+        """
+        get_metrics().observe(stage, self.span(start, end), guild=self.guild_id, backend=backend)
+
+    def describe(self) -> str:
+        """
+        Marks as milliseconds since the first one, in the order they happened (for logs).
+        """
+        if not self.marks:
+            return ""
+        origin = min(self.marks.values())
+        events = sorted(self.marks.items(), key=lambda item: item[1])
+        return " ".join(f"{event}=+{(at - origin) * 1000:.0f}ms" for event, at in events)
+
+
+def percentile(sorted_values, q):
+    """
+    Linearly interpolated percentile (numpy's default), so p50 of two values is their mean.
+    """
+    if not sorted_values:
+        return 0.0
+    position = q * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+_metrics = None
+
+
+def get_metrics():
+    """
+    Return the process-wide LatencyMetrics.
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = LatencyMetrics()
+    return _metrics
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from ..config import OLLAMA_MAX_CONCURRENCY, LLM_VOICE_RESERVED
+from .latency import percentile
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+VOICE = 0
+TEXT = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {VOICE: "voice", TEXT: "text", BACKGROUND: "background"}
+
+
+class _PriorityStats:
+    def __init__(self):
+        self.requests = 0
+        self.queued = 0  # Waiting right now
+        self.waits = deque(maxlen=500)  # Recent wait times (seconds)
+
+    def snapshot(self):
+        waits = sorted(self.waits)
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "wait_p50": percentile(waits, 0.5),
+            "wait_p95": percentile(waits, 0.95),
+            "wait_max": waits[-1] if waits else 0.0
+        }
+
+
+class LLMScheduler:
+    def __init__(self, name, max_concurrency, voice_reserved=0):
+        """
+        Concurrency gate of one LLM backend with priorities and per-user fairness.
+        Free slots go to the highest priority first (voice > text > background);
+        within a priority, users take turns (round robin), so one user's burst
+        of messages cannot starve the others.
+        :param name: Backend name (for logs/metrics)
+        :param max_concurrency: Max requests in flight to the backend
+        :param voice_reserved: Slots that only voice turns may use
+        """
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        # Lower priorities never take the last reserved slot(s)
+        self.shared_limit = max(1, self.max_concurrency - voice_reserved)
+        self.active = 0
+        self._waiters = {p: OrderedDict() for p in PRIORITY_NAMES}  # {priority: {user_key: deque[future]}}
+        self.stats = {p: _PriorityStats() for p in PRIORITY_NAMES}
+
+    @asynccontextmanager
+    async def slot(self, priority=TEXT, user_key=None):
+        """
+        Hold one backend slot for the duration of the block (e.g. a whole stream).
+        :param priority: VOICE, TEXT or BACKGROUND
+        :param user_key: Fairness key (e.g. (guild_id, user_id))
+        """
+        await self._acquire(priority, user_key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _limit(self, priority):
+        return self.max_concurrency if priority == VOICE else self.shared_limit
+
+    async def _acquire(self, priority, user_key):
+        stats = self.stats[priority]
+        stats.requests += 1
+        if self.active < self._limit(priority) and not self._has_waiters(priority):
+            self.active += 1
+            stats.waits.append(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiters[priority].setdefault(user_key, deque())
+        queue.append(future)
+        stats.queued += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation: hand the slot on
+                self._release()
+            else:
+                self._discard(priority, user_key, future)
+            raise
+        finally:
+            stats.queued -= 1
+
+        waited = time.monotonic() - started
+        stats.waits.append(waited)
+        if waited > 1.0:
+            logger.info(f"{self.name}: {PRIORITY_NAMES[priority]} request waited {waited:.2f}s for a slot")
+
+    def _release(self):
+        self.active -= 1
+        self._wake()
+
+    def _has_waiters(self, priority):
+        # Anyone of the same or a higher priority already waiting goes first
+        return any(self._waiters[p] for p in PRIORITY_NAMES if p <= priority)
+
+    def _wake(self):
+        for priority in sorted(PRIORITY_NAMES):
+            users = self._waiters[priority]
+            while users and self.active < self._limit(priority):
+                user_key, queue = next(iter(users.items()))
+                future = queue.popleft()
+                # Round robin: this user goes to the back of the line
+                del users[user_key]
+                if queue:
+                    users[user_key] = queue
+                if future.done():
+                    continue
+                self.active += 1
+                future.set_result(None)
+            if users:
+                # Lower priorities wait until this one is served
+                return
+
+    def _discard(self, priority, user_key, future):
+        users = self._waiters[priority]
+        queue = users.get(user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del users[user_key]
+
+    def snapshot(self):
+        """
+        Queue depth and wait-time metrics per priority.
+        """
+        return {
+            "backend": self.name,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "priorities": {PRIORITY_NAMES[p]: s.snapshot() for p, s in self.stats.items()}
+        }
+
+
+_schedulers = {}
+
+
+def get_scheduler(name, max_concurrency=None, voice_reserved=None):
+    """
+    Return the shared scheduler of a backend, creating it on first use.
+    """
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        scheduler = LLMScheduler(
+            name,
+            max_concurrency if max_concurrency is not None else OLLAMA_MAX_CONCURRENCY,
+            voice_reserved if voice_reserved is not None else LLM_VOICE_RESERVED
+        )
+        _schedulers[name] = scheduler
+    return scheduler
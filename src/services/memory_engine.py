@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import logging
+import time
+from ..config import (
+    CHROMA_DB_PATH, OLLAMA_URL, OLLAMA_KEEP_ALIVE, OLLAMA_MAX_CONCURRENCY,
+    OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    MEMORY_ENABLED, MEMORY_COLLECTION, MEMORY_EMBED_MODEL, MEMORY_TOP_K, MEMORY_BUDGET,
+    MEMORY_BATCH, MEMORY_FLUSH_INTERVAL, MEMORY_SCORE_WEIGHT, MEMORY_MIN_SIMILARITY
+)
+from .http_pool import get_backend
+from .llm_scheduler import get_scheduler, TEXT, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Unscored memories count as a neutral reaction (scores are 1-5)
+NEUTRAL_SCORE = 3
+
+
+def memory_id(input_text, output_text) -> str:
+    """
+    Stable id of a dialogue pair, so scoring a logged turn updates the same memory.
+    Surrounding whitespace is ignored: the stream keeps the raw reply, the score log a stripped one.
+    """
+    return hashlib.sha1(f"{input_text.strip()}\x00{output_text.strip()}".encode("utf-8")).hexdigest()
+
+
+def memory_scope(user_id=None, guild_id=None):
+    """
+    Chroma `where` filter that keeps retrieval to one user's memories in one guild
+    (or in their DMs). None if the speaker is unknown: nothing may be searched then.
+    """
+    if user_id is None:
+        return None
+    conditions = [{"user_id": str(user_id)}]
+    if guild_id is not None:
+        conditions.append({"guild_id": str(guild_id)})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class MemoryEngine:
+    def __init__(self, db_path=None, collection=None, embed_model=None):
+        """
+        Long-term memory of past dialogue pairs in a persistent Chroma collection.
+        Writes are queued and embedded in batches in the background; retrieval
+        ranks by similarity and reaction score and gives up after a latency budget.
+        :param db_path: Directory of the persistent Chroma database
+        :param collection: Collection name
+        :param embed_model: Ollama embedding model (multilingual, e.g. bge-m3)
+        """
+        self.db_path = db_path or CHROMA_DB_PATH
+        self.collection_name = collection or MEMORY_COLLECTION
+        self.embed_model = embed_model or MEMORY_EMBED_MODEL
+        self.http = get_backend(
+            "ollama", OLLAMA_URL,
+            max_concurrency=OLLAMA_MAX_CONCURRENCY,
+            connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+            read_timeout=OLLAMA_READ_TIMEOUT
+        )
+        self.scheduler = get_scheduler("ollama")
+        self.collection = None
+        self.disabled = not MEMORY_ENABLED
+        self._opening = None
+        self._queue = None
+        self._writer = None
+        self.hits = 0
+        self.misses = 0  # Retrievals that missed the latency budget
+
+    async def warmup(self):
+        """
+        Open the collection at startup, so no turn pays for it.
+        """
+        await self._open()
+
+    async def _open(self):
+        """
+        Open (or create) the collection on first use. chromadb is imported lazily.
+        """
+        if self.collection is not None or self.disabled:
+            return self.collection
+        # Shielded: a cancelled caller must not abort (and later restart) the open
+        await asyncio.shield(self._start_open())
+        return self.collection
+
+    def _start_open(self):
+        """
+        The single task that opens the collection (started on first call).
+        """
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._open_in_executor())
+        return self._opening
+
+    async def _open_in_executor(self):
+        loop = asyncio.get_event_loop()
+        try:
+            self.collection = await loop.run_in_executor(None, self._open_collection)
+            logger.info(f"Memory collection '{self.collection_name}' opened ({self.db_path}).")
+        except Exception as e:
+            logger.warning(f"Long-term memory disabled: {e}")
+            self.disabled = True
+
+    def _open_collection(self):
+        import chromadb
+
+        client = chromadb.PersistentClient(path=self.db_path)
+        # Embeddings are always passed in, so no embedding function is needed
+        return client.get_or_create_collection(
+            self.collection_name, embedding_function=None, metadata={"hnsw:space": "cosine"}
+        )
+
+    async def embed(self, texts, priority=BACKGROUND):
+        """
+        Embed a batch of texts with one Ollama /api/embed call.
+        """
+        payload = {"model": self.embed_model, "input": list(texts), "keep_alive": OLLAMA_KEEP_ALIVE}
+        async with self.scheduler.slot(priority):
+            async with self.http.request("POST", "/api/embed", json=payload) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+        return data.get("embeddings", [])
+
+    def remember(self, input_text, output_text, score=None, user_id=None, guild_id=None):
+        """
+        Queue a dialogue pair for the background writer (never blocks the turn).
+        :param score: Reaction score 1-5 of the turn (mean over users), or None if not scored (yet)
+        """
+        input_text = (input_text or "").strip()
+        output_text = (output_text or "").strip()
+        if self.disabled or not input_text or not output_text:
+            return
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._write_loop())
+
+        metadata = {"input": input_text, "output": output_text, "created": time.time()}
+        if score is not None:
+            metadata["score"] = float(score)
+        if user_id is not None:
+            metadata["user_id"] = str(user_id)
+        if guild_id is not None:
+            metadata["guild_id"] = str(guild_id)
+        self._queue.put_nowait((memory_id(input_text, output_text), f"兄: {input_text}\nミリア: {output_text}", metadata))
+
+    async def _write_loop(self):
+        # None in the queue (from close) writes what was collected and stops
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Collect a batch: up to MEMORY_BATCH items or MEMORY_FLUSH_INTERVAL seconds
+            deadline = time.monotonic() + MEMORY_FLUSH_INTERVAL
+            while len(batch) < MEMORY_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+    async def _write(self, batch):
+        collection = await self._open()
+        if collection is None:
+            return
+
+        # The same pair may be queued twice (turn + reaction); the last one wins
+        latest = {}
+        for item in batch:
+            latest[item[0]] = item
+        ids = list(latest)
+        documents = [latest[i][1] for i in ids]
+        metadatas = [latest[i][2] for i in ids]
+
+        try:
+            embeddings = await self.embed(documents, priority=BACKGROUND)
+            if len(embeddings) != len(ids):
+                raise RuntimeError(f"expected {len(ids)} embeddings, got {len(embeddings)}")
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, lambda: collection.upsert(
+                ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
+            ))
+            logger.debug(f"Stored {len(ids)} memories.")
+        except Exception as e:
+            logger.error(f"Failed to store memories: {e}")
+
+    async def retrieve(self, query, priority=TEXT, budget=None, top_k=None, user_id=None, guild_id=None):
+        """
+        Memories relevant to the query, formatted for context_docs.
+        Returns None (and the turn goes on without memory) if the budget is exceeded.
+        Only the speaker's own memories (in the same guild) are searched.
+        :param budget: Seconds allowed for embedding + search
+        :param user_id: Speaker whose memories are searched
+        :param guild_id: Guild the conversation happens in (None for DMs)
+        """
+        where = memory_scope(user_id, guild_id)
+        if self.disabled or not query or where is None:
+            return None
+        if self.collection is None:
+            # Opening (chromadb import + load) is far over budget; the turn goes on without memory
+            self._start_open()
+            self.misses += 1
+            return None
+        budget = MEMORY_BUDGET if budget is None else budget
+        try:
+            docs = await asyncio.wait_for(self._retrieve(query, priority, top_k or MEMORY_TOP_K, where), budget)
+        except asyncio.TimeoutError:
+            self.misses += 1
+            logger.debug(f"Memory retrieval missed its {budget:.2f}s budget, continuing without it.")
+            return None
+        except Exception as e:
+            logger.warning(f"Memory retrieval failed: {e}")
+            return None
+
+        if not docs:
+            return None
+        self.hits += 1
+        return "\n\n".join(docs)
+
+    async def _retrieve(self, query, priority, top_k, where):
+        collection = self.collection
+        embeddings = await self.embed([query], priority=priority)
+        if not embeddings:
+            return []
+
+        loop = asyncio.get_event_loop()
+        # Over-fetch, then re-rank with the reaction scores
+        result = await loop.run_in_executor(None, lambda: collection.query(
+            query_embeddings=embeddings, n_results=top_k * 3, where=where,
+            include=["documents", "metadatas", "distances"]
+        ))
+        documents = (result.get("documents") or [[]])[0]
+        metadatas = (result.get("metadatas") or [[]])[0]
+        distances = (result.get("distances") or [[]])[0]
+
+        ranked = []
+        for document, metadata, distance in zip(documents, metadatas, distances):
+            similarity = 1.0 - distance  # cosine space
+            if similarity < MEMORY_MIN_SIMILARITY:
+                continue
+            score = (metadata or {}).get("score", NEUTRAL_SCORE)
+            rank = (1.0 - MEMORY_SCORE_WEIGHT) * similarity + MEMORY_SCORE_WEIGHT * (score - 1) / 4
+            ranked.append((rank, document))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [document for _, document in ranked[:top_k]]
+
+    async def close(self):
+        """
+        Write what is still queued (including a batch being collected), then stop the writer.
+        """
+        if self._writer is None:
+            return
+        if not self._writer.done():
+            self._queue.put_nowait(None)
+            await asyncio.gather(self._writer, return_exceptions=True)
+        self._writer = None
+
+
+_engine = None
+
+
+def get_memory_engine():
+    """
+    Return the shared MemoryEngine (one collection per process).
+    """
+    global _engine
+    if _engine is None:
+        _engine = MemoryEngine()
+    return _engine
+
+
+async def close_memory():
+    if _engine is not None:
+        await _engine.close()
@@ -1,57 +1,211 @@
-import requests
 import logging
 import json
-from ..config import OLLAMA_URL, OLLAMA_MODEL
+import time
+from ..config import (
+    OLLAMA_URL, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE,
+    OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_MAX_CONCURRENCY
+)
+from .http_pool import get_backend
+from .llm_scheduler import get_scheduler, TEXT, BACKGROUND
+from .conversation import ConversationStore
+from .memory_engine import get_memory_engine
+from .latency import get_metrics, current_trace
+from ..utils.sentence_splitter import iter_sentences
 
 logger = logging.getLogger(__name__)
 
+# Said instead of a reply when Ollama fails (VoiceChat keeps it in the TTS cache)
+FALLBACK_TEXT = "ごめんね、ちょっと頭が回らないみたい..."
+
 class OllamaClient:
     def __init__(self):
         self.base_url = OLLAMA_URL
         self.model = OLLAMA_MODEL
         self.system_prompt = "あなたは「ミリア」という名前の妹キャラクターです。兄（ユーザー）と仲良く会話してください。返答は短めに、感情豊かに。"
-        # Initialize history with system prompt
-        self.history = [{"role": "system", "content": self.system_prompt}]
+        self.summary_prompt = "以下はミリアと兄の会話の記録です。これまでの要約と合わせて、後で会話を続けるのに必要な事実・話題・感情を200文字以内の日本語で要約してください。"
+        # Shared keep-alive pool (one per backend, shared by every OllamaClient)
+        self.http = get_backend(
+            "ollama", self.base_url,
+            max_concurrency=OLLAMA_MAX_CONCURRENCY,
+            connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+            read_timeout=OLLAMA_READ_TIMEOUT
+        )
+        # Priorities (voice > text > background) and per-user fairness for the backend's slots
+        self.scheduler = get_scheduler("ollama", max_concurrency=OLLAMA_MAX_CONCURRENCY)
+        # Conversation history per (guild, user), bounded by a token budget
+        self.sessions = ConversationStore(summarize=self._summarize)
+        # Long-term memory shared by every client (retrieval feeds context_docs)
+        self.memory = get_memory_engine()
+
+    def _build_user_content(self, prompt, context_docs=None):
+        # Add context to the prompt if available
+        if context_docs:
+            return f"Context:\n{context_docs}\n\nUser: {prompt}"
+        return prompt
+
+    async def _chat(self, messages, priority=TEXT, user_key=None) -> str:
+        """
+        Single non-streaming /api/chat call. Does not touch any session.
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE
+        }
+        guild_id = user_key[0] if user_key else None
+        metrics = get_metrics()
+        queued = time.time()
+        async with self.scheduler.slot(priority, user_key):
+            sent = time.time()
+            metrics.observe("llm_queue", sent - queued, guild=guild_id, backend=self.scheduler.name)
+            async with self.http.request("POST", "/api/chat", json=payload) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+        metrics.observe("llm_total", time.time() - sent, guild=guild_id, backend=self.scheduler.name)
+
+        # Extract response
+        ai_message = data.get("message", {})
+        return ai_message.get("content", "")
 
-    def generate(self, prompt: str, user_id=None, context_docs=None) -> str:
+    async def warmup(self):
+        """
+        Preload the model into memory (an empty chat request only loads it).
+        """
+        payload = {"model": self.model, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE}
+        try:
+            async with self.scheduler.slot(BACKGROUND):
+                async with self.http.request("POST", "/api/chat", json=payload) as resp:
+                    resp.raise_for_status()
+            logger.info(f"Ollama model {self.model} preloaded.")
+        except Exception as e:
+            logger.warning(f"Ollama warmup failed: {e}")
+
+    async def generate(self, prompt: str, user_id=None, context_docs=None, guild_id=None, priority=TEXT) -> str:
         """
         Generate a response from Ollama (Chat API).
         :param prompt: User input text
-        :param user_id: Ideally maintain history per user (Currently simple global history for demo)
+        :param user_id: Conversation history is kept per (guild_id, user_id)
         :param context_docs: RAG context strings
+        :param guild_id: Guild the conversation happens in (None for DMs)
+        :param priority: llm_scheduler.VOICE / TEXT / BACKGROUND
         """
-        
-        # Add context to the prompt if available
-        user_content = prompt
-        if context_docs:
-            user_content = f"Context:\n{context_docs}\n\nUser: {prompt}"
+        if context_docs is None:
+            context_docs = await self.memory.retrieve(prompt, priority=priority, user_id=user_id, guild_id=guild_id)
+        session = self.sessions.get(guild_id, user_id)
+        messages = self.sessions.messages(session, self.system_prompt, self._build_user_content(prompt, context_docs))
 
-        # Append user message
-        self.history.append({"role": "user", "content": user_content})
+        try:
+            ai_text = await self._chat(messages, priority=priority, user_key=(guild_id, user_id))
+
+            # Append the turn to the user's history
+            if ai_text:
+                self.sessions.add_turn(session, prompt, ai_text)
+                self.memory.remember(prompt, ai_text, user_id=user_id, guild_id=guild_id)
+
+            return ai_text
+        except Exception as e:
+            logger.error(f"Ollama generation failed: {e}")
+            return FALLBACK_TEXT
+
+    async def stream(self, prompt: str, user_id=None, context_docs=None, guild_id=None, priority=TEXT):
+        """
+        Stream a response from Ollama (Chat API, NDJSON).
+        Async generator yielding tokens as they arrive.
+        The turn is added to the user's history once the stream ends.
+        Memories are retrieved first (within a latency budget) unless context_docs is given.
+        """
+        if context_docs is None:
+            context_docs = await self.memory.retrieve(prompt, priority=priority, user_id=user_id, guild_id=guild_id)
+        session = self.sessions.get(guild_id, user_id)
+        messages = self.sessions.messages(session, self.system_prompt, self._build_user_content(prompt, context_docs))
 
         payload = {
             "model": self.model,
-            "messages": self.history,
-            "stream": False
+            "messages": messages,
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE
         }
-        
+
+        parts = []
+        completed = False
+        trace = current_trace.get()
+        metrics = get_metrics()
+        backend = self.scheduler.name
+        queued = time.time()
         try:
-            resp = requests.post(f"{self.base_url}/api/chat", json=payload)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            # Extract response
-            ai_message = data.get("message", {})
-            ai_text = ai_message.get("content", "")
-            
-            # Append AI response to history
-            if ai_text:
-                self.history.append({"role": "assistant", "content": ai_text})
-                
-            return ai_text
+            # The slot is held for the whole stream (the backend is busy generating)
+            async with self.scheduler.slot(priority, (guild_id, user_id)):
+                sent = time.time()
+                metrics.observe("llm_queue", sent - queued, guild=guild_id, backend=backend)
+                if trace:
+                    trace.mark("llm_sent", sent)
+                async with self.http.request("POST", "/api/chat", json=payload) as resp:
+                    resp.raise_for_status()
+                    # Each line is one JSON chunk: {"message": {"content": "..."}, "done": false}
+                    async for line in resp.content:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise RuntimeError(chunk["error"])
+
+                        token = chunk.get("message", {}).get("content", "")
+                        if token:
+                            if not parts:
+                                metrics.observe("llm_first_token", time.time() - sent, guild=guild_id, backend=backend)
+                                if trace:
+                                    trace.mark("llm_first_token")
+                            parts.append(token)
+                            yield token
+
+                        if chunk.get("done"):
+                            break
+            completed = True
+            metrics.observe("llm_total", time.time() - sent, guild=guild_id, backend=backend)
+            if trace:
+                trace.mark("llm_done")
         except Exception as e:
-            logger.error(f"Ollama generation failed: {e}")
-            return "ごめんね、ちょっと頭が回らないみたい..."
+            logger.error(f"Ollama streaming failed: {e}")
+            if not parts:
+                yield FALLBACK_TEXT
+        finally:
+            # Keep whatever was generated, even if the consumer stopped early
+            if parts:
+                self.sessions.add_turn(session, prompt, "".join(parts))
+                # Only complete replies become long-term memories
+                if completed:
+                    self.memory.remember(prompt, "".join(parts), user_id=user_id, guild_id=guild_id)
+
+    def stream_sentences(self, prompt: str, user_id=None, context_docs=None, guild_id=None, priority=TEXT, text=None):
+        """
+        Stream a response from Ollama grouped into complete sentences.
+        Each sentence can be handed to TTS as soon as it is yielded.
+        :param text: Optional list that receives the raw tokens (see iter_sentences)
+        """
+        return iter_sentences(self.stream(
+            prompt, user_id=user_id, context_docs=context_docs, guild_id=guild_id, priority=priority
+        ), text=text)
+
+    async def _summarize(self, summary, turns) -> str:
+        """
+        Fold old turns into the rolling summary (runs in the background).
+        """
+        lines = []
+        if summary:
+            lines.append(f"これまでの要約: {summary}")
+        for user_text, assistant_text in turns:
+            lines.append(f"兄: {user_text}")
+            lines.append(f"ミリア: {assistant_text}")
+
+        messages = [
+            {"role": "system", "content": self.summary_prompt},
+            {"role": "user", "content": "\n".join(lines)}
+        ]
+        new_summary = (await self._chat(messages, priority=BACKGROUND)).strip()
+        # Guard the budget even if the model ignores the length instruction
+        return new_summary[:400] if new_summary else summary
 
-    def clear_history(self):
-        self.history = [{"role": "system", "content": self.system_prompt}]
+    def clear_history(self, guild_id=None, user_id=None):
+        self.sessions.clear(guild_id=guild_id, user_id=user_id)
@@ -1,8 +1,10 @@
-import requests
 import logging
 import os
+import time
 import uuid
-from ..config import SBV2_URL
+from ..config import SBV2_URL, SBV2_CONNECT_TIMEOUT, SBV2_READ_TIMEOUT, SBV2_MAX_CONCURRENCY
+from .http_pool import get_backend
+from .latency import get_metrics, current_trace
 
 logger = logging.getLogger(__name__)
 
@@ -11,18 +13,18 @@ class SBV2Client:
         self.base_url = SBV2_URL
         # Model ID or Style ID might be needed depending on SBV2 setup.
         # Assuming defaults or a specific model loaded in the server.
-        self.model_id = 0 
+        self.model_id = 0
         self.speaker_id = 0
-    
-    def tts(self, text: str, save_dir="./data/temp") -> str:
-        """
-        Convert text to speech.
-        Returns path to saved .wav file.
-        """
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir, exist_ok=True)
+        # Shared keep-alive pool (one per backend, shared by every SBV2Client)
+        self.http = get_backend(
+            "sbv2", self.base_url,
+            max_concurrency=SBV2_MAX_CONCURRENCY,
+            connect_timeout=SBV2_CONNECT_TIMEOUT,
+            read_timeout=SBV2_READ_TIMEOUT
+        )
 
-        params = {
+    def _params(self, text: str) -> dict:
+        return {
             "text": text,
             "model_id": self.model_id,
             "speaker_id": self.speaker_id,
@@ -38,19 +40,79 @@ class SBV2Client:
             "style_weight": 5.0
         }
 
+    def cache_key(self, text: str) -> tuple:
+        """
+        Everything that changes the synthesized audio for a given text.
+        """
+        params = self._params(text)
+        return (
+            params["text"], params["model_id"], params["speaker_id"], params["style"],
+            params["style_weight"], params["sdp_ratio"], params["noise"], params["noise_w"], params["length"]
+        )
+
+    async def tts_bytes(self, text: str):
+        """
+        Convert text to speech.
+        Returns the WAV file content as bytes (None on failure).
+        """
+        trace = current_trace.get()
+        guild_id = trace.guild_id if trace else None
+        metrics = get_metrics()
+        try:
             # Note: The endpoint depends on the implementation of Style-Bert-VITS2 API.
             # Common one is /voice
-            resp = requests.get(f"{self.base_url}/voice", params=params)
-             # If it returns audio bytes directly
-            if resp.status_code == 200:
-                filename = f"tts_{uuid.uuid4().hex}.wav"
-                path = os.path.join(save_dir, filename)
-                with open(path, "wb") as f:
-                    f.write(resp.content)
-                return path
-            else:
-                logger.error(f"SBV2 TTS failed: {resp.status_code} {resp.text}")
-                return None
+            sent = time.time()
+            # The trace follows the turn's first SBV2 request (the first sentence)
+            traced = trace is not None and "tts_sent" not in trace.marks
+            if traced:
+                trace.mark("tts_sent", sent)
+            async with self.http.request("GET", "/voice", params=self._params(text)) as resp:
+                # If it returns audio bytes directly
+                if resp.status == 200:
+                    # Read in chunks to time the first byte
+                    chunks = []
+                    async for chunk in resp.content.iter_any():
+                        if not chunks:
+                            first_byte = time.time()
+                            metrics.observe("tts_first_byte", first_byte - sent, guild=guild_id, backend="sbv2")
+                        chunks.append(chunk)
+                    done = time.time()
+                    metrics.observe("tts_total", done - sent, guild=guild_id, backend="sbv2")
+                    if traced and chunks:
+                        trace.mark("tts_first_byte", first_byte)
+                        trace.mark("tts_done", done)
+                    return b"".join(chunks)
+                else:
+                    logger.error(f"SBV2 TTS failed: {resp.status} {await resp.text()}")
+                    return None
         except Exception as e:
             logger.error(f"SBV2 connection failed: {e}")
             return None
+
+    async def warmup(self):
+        """
+        Send a throwaway request so the server loads its model and BERT before the first reply.
+        """
+        if await self.tts_bytes("あ"):
+            logger.info("SBV2 warmup done.")
+        else:
+            logger.warning("SBV2 warmup failed.")
+
+    async def tts(self, text: str, save_dir="./data/temp") -> str:
+        """
+        Convert text to speech.
+        Returns path to saved .wav file.
+        (Playback uses tts_bytes directly; this is kept for scripts/debugging)
+        """
+        wav_bytes = await self.tts_bytes(text)
+        if not wav_bytes:
+            return None
+
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+
+        filename = f"tts_{uuid.uuid4().hex}.wav"
+        path = os.path.join(save_dir, filename)
+        with open(path, "wb") as f:
+            f.write(wav_bytes)
+        return path
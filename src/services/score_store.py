@@ -0,0 +1,191 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from ..config import SCORE_STORE_DIR, SCORE_SEGMENT_BYTES, SCORE_COMPACT_SEGMENTS
+
+logger = logging.getLogger(__name__)
+
+# Record layout (one JSON object per line):
+#   {"type": "turn", "message_id", "input", "output", "user_id", "guild_id", "source", "time", "scores": {...}}
+#   {"type": "score", "message_id", "user_id", "score", "time"}
+# Appends go to the newest "segment-*.jsonl"; compaction folds every segment
+# into one "compact-*.jsonl" of turn records carrying their latest scores.
+
+
+class ScoreStore:
+    def __init__(self, root=None, segment_bytes=None, compact_segments=None):
+        """
+        Append-only store of logged dialogue turns and their reaction scores,
+        with an in-memory index from score-log message ID to turn.
+        :param root: Directory of the JSONL segments
+        :param segment_bytes: Size after which a new segment is started
+        :param compact_segments: Number of segments that triggers a compaction
+        """
+        self.root = root or SCORE_STORE_DIR
+        self.segment_bytes = segment_bytes or SCORE_SEGMENT_BYTES
+        self.compact_segments = compact_segments or SCORE_COMPACT_SEGMENTS
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()  # Appends/compaction run on executor threads
+        self._segment = None
+        self._compacting = False
+        self.index = {}  # {message_id: turn record}
+        for record in _read_records(self._files()):
+            _apply(self.index, record)
+        logger.info(f"Score store loaded: {len(self.index)} logged turns.")
+
+    def get(self, message_id):
+        """
+        Turn logged under a score-log message ID (no Discord API call), or None.
+        """
+        return self.index.get(message_id)
+
+    async def log_turn(self, message_id, input_text, output_text, user_id=None, guild_id=None, source=None):
+        """
+        Index a posted score log and append it to disk.
+        """
+        record = {
+            "type": "turn",
+            "message_id": message_id,
+            "input": input_text,
+            "output": output_text,
+            "user_id": user_id,
+            "guild_id": guild_id,
+            "source": source,
+            "time": time.time(),
+            "scores": {}
+        }
+        _apply(self.index, record)
+        await self._append(record)
+        return record
+
+    async def add_score(self, message_id, user_id, score):
+        """
+        Record a reaction score. Each user's latest score counts.
+        :return: The scored turn, or None if the message is not a logged turn
+        """
+        turn = self.index.get(message_id)
+        if turn is None:
+            return None
+        record = {"type": "score", "message_id": message_id, "user_id": user_id, "score": score, "time": time.time()}
+        _apply(self.index, record)
+        await self._append(record)
+        return turn
+
+    async def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        loop = asyncio.get_event_loop()
+        compact = await loop.run_in_executor(None, self._write_line, line)
+        if compact:
+            loop.run_in_executor(None, self.compact)
+
+    def _write_line(self, line):
+        with self._lock:
+            if self._segment is None or os.path.getsize(self._segment) >= self.segment_bytes:
+                self._segment = os.path.join(self.root, f"segment-{time.time_ns()}.jsonl")
+            with open(self._segment, "a", encoding="utf-8") as f:
+                f.write(line)
+            segments = len(glob.glob(os.path.join(self.root, "segment-*.jsonl")))
+            if segments >= self.compact_segments and not self._compacting:
+                self._compacting = True
+                return True
+            return False
+
+    def compact(self):
+        """
+        Fold every segment into one file of turn records with their latest scores.
+        """
+        try:
+            with self._lock:
+                files = self._files()
+                index = {}
+                for record in _read_records(files):
+                    _apply(index, record)
+
+                path = os.path.join(self.root, f"compact-{time.time_ns()}.jsonl")
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for turn in index.values():
+                        f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, path)
+                for old in files:
+                    os.remove(old)
+                self._segment = None
+            logger.info(f"Compacted {len(files)} score files into {os.path.basename(path)} ({len(index)} turns).")
+        except Exception as e:
+            logger.error(f"Score store compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def _files(self):
+        return _store_files(self.root)
+
+
+def _store_files(root):
+    # Compacted snapshots first, then segments, each in creation order
+    compacted = sorted(glob.glob(os.path.join(root, "compact-*.jsonl")), key=_file_stamp)
+    segments = sorted(glob.glob(os.path.join(root, "segment-*.jsonl")), key=_file_stamp)
+    return compacted + segments
+
+
+def _file_stamp(path):
+    name = os.path.basename(path)
+    return int(name.split("-", 1)[1].split(".", 1)[0])
+
+
+def _read_records(files):
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line after a crash
+                    logger.warning(f"Skipping unreadable score record in {path}")
+
+
+def _apply(index, record):
+    if record.get("type") == "turn":
+        turn = dict(record)
+        turn["scores"] = dict(turn.get("scores") or {})
+        index[turn["message_id"]] = turn
+    elif record.get("type") == "score":
+        turn = index.get(record["message_id"])
+        if turn is not None:
+            # JSON object keys are strings; keep them that way in memory too
+            turn["scores"][str(record["user_id"])] = record["score"]
+
+
+def turn_score(turn):
+    """
+    Mean of the users' latest scores of a turn, or None if nobody reacted.
+    """
+    scores = list(turn["scores"].values())
+    return sum(scores) / len(scores) if scores else None
+
+
+def load_dataset(root=None, scored_only=True):
+    """
+    Bulk-load logged turns for evaluation / fine-tuning (no bot needed).
+    :param scored_only: Skip turns nobody reacted to
+    :return: List of turn dicts with an added "score" (mean of the users' scores)
+    """
+    index = {}
+    for record in _read_records(_store_files(root or SCORE_STORE_DIR)):
+        _apply(index, record)
+
+    turns = []
+    for turn in index.values():
+        score = turn_score(turn)
+        if scored_only and score is None:
+            continue
+        turn["score"] = score
+        turns.append(turn)
+    return turns
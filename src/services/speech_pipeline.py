@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from ..config import TTS_MAX_INFLIGHT
+from ..utils.audio_sources import SegmentQueueSource, wav_to_opus
+from .envelope_stream import EnvelopeStream
+from .latency import current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class SpeechPipeline:
+    def __init__(self, guild, sbv2_client, ws_server=None, max_inflight=None, cache=None):
+        """
+        Per-guild playback pipeline.
+        Sentences of a reply are synthesized concurrently (bounded) and queued,
+        in order, behind one continuous AudioSource.
+        :param guild: discord.Guild whose voice client plays the audio
+        :param sbv2_client: SBV2Client used for synthesis
+        :param ws_server: Optional WebSocketServer to notify the frontend
+                          (and stream the audio envelope to subscribers)
+        :param max_inflight: Max concurrent SBV2 requests for this guild
+        :param cache: Optional TTSCache of pre-encoded Opus packets
+        """
+        self.guild = guild
+        self.sbv2 = sbv2_client
+        self.ws_server = ws_server
+        self.max_inflight = max_inflight or TTS_MAX_INFLIGHT
+        self.semaphore = asyncio.Semaphore(self.max_inflight)
+        self.cache = cache
+        self.audio = None
+        self.envelope = EnvelopeStream(ws_server, guild.id) if ws_server else None
+
+    async def speak(self, sentences, source="voice_chat"):
+        """
+        Synthesize and play a reply.
+        :param sentences: Async iterable of sentences (may still be generating)
+        :param source: Origin of the reply (for the frontend)
+        :return: The sentences that were received (TTS text, not the formatted reply)
+        """
+        voice_client = self.guild.voice_client
+        if not voice_client:
+            logger.warning("No voice client found in SpeechPipeline.speak")
+            return []
+
+        loop = asyncio.get_event_loop()
+        trace = current_trace.get()
+        audio = SegmentQueueSource(envelope=self.envelope)
+        finished = asyncio.Event()
+        ordered = asyncio.Queue()
+        received = []
+
+        # A new reply replaces whatever is playing
+        self.stop()
+        self.audio = audio
+
+        async def produce():
+            # Start synthesis as soon as each sentence arrives; keep the order
+            try:
+                async for sentence in sentences:
+                    received.append(sentence)
+                    await ordered.put((sentence, asyncio.create_task(self.synthesize(sentence))))
+            finally:
+                await ordered.put(None)
+
+        def after_play(error):
+            if error:
+                logger.error(f"Player error: {error}")
+            loop.call_soon_threadsafe(finished.set)
+
+        producer = asyncio.create_task(produce())
+        playing = False
+        # The outer finally also runs when the turn is cancelled mid-stream (barge-in / replacement)
+        try:
+            try:
+                while True:
+                    item = await ordered.get()
+                    if item is None:
+                        break
+                    sentence, task = item
+
+                    try:
+                        frames = await task
+                    except Exception as e:
+                        logger.error(f"TTS error: {e}")
+                        continue
+
+                    if not frames:
+                        logger.warning(f"Failed to generate voice audio for: {sentence}")
+                        continue
+
+                    if self.audio is not audio:
+                        # Replaced by a newer reply
+                        break
+
+                    if self.ws_server:
+                        await self.ws_server.broadcast({
+                            "type": "speaking",
+                            "text": sentence,
+                            "source": source
+                        })
+
+                    audio.push(frames)
+
+                    if not playing:
+                        voice_client = self.guild.voice_client
+                        if not voice_client:
+                            break
+                        if voice_client.is_playing():
+                            voice_client.stop()
+                        if self.envelope:
+                            self.envelope.start(audio)
+                        voice_client.play(audio, after=after_play)
+                        playing = True
+                        if trace:
+                            trace.mark("playback_start")
+                            trace.observe("response", "speech_end", "playback_start", backend="pipeline")
+                            trace.observe("end_to_end", "last_voice", "playback_start", backend="pipeline")
+            finally:
+                if not producer.done():
+                    producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+                # Drop synthesis that is no longer needed
+                while not ordered.empty():
+                    item = ordered.get_nowait()
+                    if item is not None:
+                        item[1].cancel()
+                audio.finish()
+
+            if playing:
+                await finished.wait()
+                if trace:
+                    trace.mark("playback_end")
+                    trace.observe("playback", "playback_start", "playback_end", backend="discord")
+                    logger.debug(f"Turn trace (guild {trace.guild_id}): {trace.describe()}")
+        finally:
+            if playing and self.envelope:
+                self.envelope.stop(audio)
+            if self.audio is audio:
+                self.audio = None
+
+        return received
+
+    async def synthesize(self, sentence):
+        """
+        Return the EncodedSpeech for one sentence (None on failure).
+        Cache hits skip both SBV2 and encoding.
+        """
+        return await synthesize_opus(self.sbv2, sentence, cache=self.cache, semaphore=self.semaphore)
+
+    def fade_out(self, duration=0.2):
+        """
+        Fade the current reply out instead of cutting it (barge-in).
+        """
+        if self.audio is not None:
+            self.audio.fade_out(duration)
+            self.audio = None
+
+    def stop(self):
+        """
+        Stop the current reply (if any).
+        """
+        if self.audio is not None:
+            self.audio.finish()
+            self.audio = None
+        voice_client = self.guild.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.stop()
+
+
+async def synthesize_opus(sbv2_client, text, cache=None, semaphore=None):
+    """
+    SBV2 -> WAV -> Opus packets and envelope, going through the TTS cache when given.
+    :param semaphore: Optional limit on concurrent SBV2 requests
+    """
+    key = sbv2_client.cache_key(text) if cache else None
+    if cache:
+        frames = await cache.get(key)
+        if frames is not None:
+            return frames
+
+    if semaphore:
+        async with semaphore:
+            wav_bytes = await sbv2_client.tts_bytes(text)
+    else:
+        wav_bytes = await sbv2_client.tts_bytes(text)
+    if not wav_bytes:
+        return None
+
+    # WAV decode/resample/encode is CPU work, keep it off the event loop
+    loop = asyncio.get_event_loop()
+    frames = await loop.run_in_executor(None, wav_to_opus, wav_bytes)
+    if cache:
+        cache.put(key, frames)
+    return frames
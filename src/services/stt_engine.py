@@ -1,60 +1,199 @@
-from faster_whisper import WhisperModel
 import os
 import logging
-from ..config import WHISPER_MODEL_SIZE
+import threading
+import bisect
+import numpy as np
+from ..config import (
+    WHISPER_MODEL_SIZE, WHISPER_DEVICE, WHISPER_COMPUTE_TYPE, WHISPER_LITE_MODEL_SIZE,
+    STT_BUSY_BACKLOG, STT_OVERLOAD_BACKLOG, STT_LONG_UTTERANCE, STT_DEADLINE
+)
 
 logger = logging.getLogger(__name__)
 
+BASE_PROMPT = "これは、妹のミリアと兄の会話です。"
+SAMPLE_RATE = 16000
+
+class STTTier:
+    def __init__(self, name, beam_size, lite=False):
+        """
+        One quality level of the decoder.
+        :param name: Label for logs/metrics
+        :param beam_size: Beam size of the decode
+        :param lite: Decode with the lite model (falls back to the main model if it is not loaded)
+        """
+        self.name = name
+        self.beam_size = beam_size
+        self.lite = lite
+
+    def __repr__(self):
+        return f"STTTier({self.name})"
+
+TIERS = [
+    STTTier("full", beam_size=5),
+    STTTier("fast", beam_size=1),
+    STTTier("lite", beam_size=1, lite=True),
+]
+
 class STTEngine:
-    def __init__(self, model_size=None, device="cuda", compute_type="float16"):
+    def __init__(self, model_size=None, device=None, compute_type=None, lite_model_size=None, cpu_threads=0):
         """
-        Initialize the faster-whisper model.
+        faster-whisper wrapper. The model is not loaded here; call load()
+        (blocking) or load_in_background() and check is_ready.
         :param model_size: Size of the model (tiny, base, small, medium, large-v2, etc.)
-        :param device: 'cuda' or 'cpu'
-        :param compute_type: 'float16' for GPU, 'int8' for CPU usually
+        :param device: 'cuda', 'cpu' or 'auto' (pick CUDA only if a GPU is present)
+        :param compute_type: 'float16' for GPU, 'int8' for CPU usually ('auto' picks one)
+        :param lite_model_size: Smaller model used by the 'lite' tier under load ('' = none)
+        :param cpu_threads: CTranslate2 threads on CPU (0 = library default)
         """
         self.model_size = model_size if model_size else WHISPER_MODEL_SIZE
-        self.device = device
-        self.compute_type = compute_type
-        
-        logger.info(f"Loading Whisper model: {self.model_size} on {self.device}...")
+        self.lite_model_size = lite_model_size if lite_model_size is not None else WHISPER_LITE_MODEL_SIZE
+        self.cpu_threads = cpu_threads
+        self.device = device if device else WHISPER_DEVICE
+        self.compute_type = compute_type if compute_type else WHISPER_COMPUTE_TYPE
+        self.model = None
+        self.lite_model = None  # Loaded after the main model, only used under load
+        self.batched = {}  # {id(model): BatchedInferencePipeline} (created on first batch)
+        self.load_error = None
+        self._ready = threading.Event()
+        self._load_done = threading.Event()  # Set once loading succeeded or failed
+        self._load_thread = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        self._load_done.wait(timeout)
+        return self.is_ready
+
+    def load_in_background(self):
+        """
+        Load (and warm up) the model in a daemon thread so the event loop is not blocked.
+        """
+        if self._load_thread is None:
+            self._load_thread = threading.Thread(target=self._load_and_warmup, name="stt-loader", daemon=True)
+            self._load_thread.start()
+        return self._load_thread
+
+    def _load_and_warmup(self):
+        try:
+            self.load()
+            self.warmup()
+        except Exception as e:
+            self.load_error = e
+            logger.error(f"Whisper model could not be loaded: {e}")
+            return
+        self.load_lite()
+
+    def load(self):
+        """
+        Load the faster-whisper model (blocking).
+        """
+        if self.device == "auto":
+            self.device = "cuda" if _cuda_available() else "cpu"
+        if self.compute_type == "auto":
+            self.compute_type = "float16" if self.device == "cuda" else "int8"
+
+        logger.info(f"Loading Whisper model: {self.model_size} on {self.device} ({self.compute_type})...")
         try:
-            self.model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type)
+            self._load_model()
+        finally:
+            self._load_done.set()
+
+    def _load_model(self):
+        # Heavy import (ctranslate2, onnxruntime, ...) only when actually needed
+        from faster_whisper import WhisperModel
+
+        try:
+            self.model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type, cpu_threads=self.cpu_threads)
             logger.info("Whisper model loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load Whisper model: {e}")
-            # Fallback to CPU if CUDA fails? Or just raise.
-            # For now, let's try to fallback to CPU int8 if CUDA fails
-            if device == "cuda":
+            # Fallback to CPU int8 if CUDA fails
+            if self.device == "cuda":
                 logger.warning("Attempting fallback to CPU (int8)...")
                 self.device = "cpu"
                 self.compute_type = "int8"
-                self.model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type)
+                self.model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type, cpu_threads=self.cpu_threads)
                 logger.info("Whisper model loaded on CPU.")
             else:
                 raise e
 
-    def transcribe(self, audio_path: str, language="ja"):
+        self._ready.set()
+
+    def load_lite(self):
+        """
+        Load the lite tier's model (blocking). Without it the lite tier uses the main model.
+        """
+        if not self.lite_model_size or self.lite_model_size == self.model_size:
+            return
+        from faster_whisper import WhisperModel
+
+        try:
+            self.lite_model = WhisperModel(
+                self.lite_model_size, device=self.device, compute_type=self.compute_type, cpu_threads=self.cpu_threads
+            )
+            logger.info(f"Lite Whisper model loaded: {self.lite_model_size}")
+        except Exception as e:
+            logger.warning(f"Lite Whisper model could not be loaded, 'lite' tier uses {self.model_size}: {e}")
+
+    def choose_tier(self, duration, backlog=0, waited=0.0, deadline=None):
+        """
+        Pick the quality tier of a decode from the load.
+        :param duration: Seconds of audio (longest utterance of the batch)
+        :param backlog: Utterances waiting for a decode, including this one
+        :param waited: Seconds the oldest utterance has already waited
+        :param deadline: Seconds after which utterances are dropped (default STT_DEADLINE)
+        :return: STTTier
+        """
+        level = 0
+        if backlog > STT_OVERLOAD_BACKLOG:
+            level = 2
+        elif backlog > STT_BUSY_BACKLOG:
+            level = 1
+        # Long utterances hold the decoder the longest; step them down as soon as others wait
+        if duration > STT_LONG_UTTERANCE and backlog > 1:
+            level += 1
+        # Close to the deadline: answer quickly or not at all
+        deadline = deadline if deadline is not None else STT_DEADLINE
+        if deadline and waited > deadline / 2:
+            level = 2
+        return TIERS[min(level, len(TIERS) - 1)]
+
+    def _model_for(self, tier):
+        if tier is not None and tier.lite and self.lite_model is not None:
+            return self.lite_model
+        return self.model
+
+    def warmup(self):
+        """
+        Run one throwaway decode so the first real utterance does not pay
+        for lazy initialization inside CTranslate2.
+        """
+        segments, _ = self.model.transcribe(
+            np.zeros(16000, dtype=np.float32),
+            beam_size=1,
+            language="ja",
+            vad_filter=False
+        )
+        for _ in segments:
+            pass
+        logger.info("Whisper warmup done.")
+
+    def transcribe(self, audio, language="ja", beam_size=5, initial_prompt=None, tier=None):
         """
-        Transcribe the audio file.
-        :param audio_path: Path to the .wav file
+        Transcribe an utterance.
+        :param audio: float32 16kHz mono numpy array, or path to an audio file
         :param language: Language code (default 'ja')
+        :param beam_size: Beam size (1 = greedy, fastest)
+        :param initial_prompt: Extra context appended to the default prompt
+        :param tier: STTTier; overrides beam_size and may pick the lite model
         :return: Transcribed text
         """
-        if not os.path.exists(audio_path):
-            logger.error(f"Audio file not found: {audio_path}")
+        segments = self._segments(audio, language, beam_size, initial_prompt, tier=tier)
+        if segments is None:
             return ""
 
-        # vad_filter=True prevents hallucinations on silence
-        # initial_prompt guides the context
-        segments, info = self.model.transcribe(
-            audio_path, 
-            beam_size=5, 
-            language=language,
-            vad_filter=True,
-            initial_prompt="これは、妹のミリアと兄の会話です。"
-        )
-        
         # segments is a generator, so we need to iterate to get results
         text = ""
         for segment in segments:
@@ -62,11 +201,134 @@ class STTEngine:
         
         return text.strip()
 
+    def transcribe_words(self, audio, language="ja", beam_size=1, initial_prompt=None):
+        """
+        Transcribe with word timestamps (used for streaming partial results).
+        :return: List of (start_sec, end_sec, word)
+        """
+        segments = self._segments(audio, language, beam_size, initial_prompt, word_timestamps=True)
+        if segments is None:
+            return []
+
+        words = []
+        for segment in segments:
+            for word in segment.words or []:
+                words.append((word.start, word.end, word.word))
+        return words
+
+    def transcribe_batch(self, audios, language="ja", beam_size=5, initial_prompt=None, tier=None):
+        """
+        Transcribe several utterances in one batched decode.
+        The speech part of each utterance becomes one clip of a single concatenated
+        signal, and faster-whisper's batched pipeline decodes the clips together.
+        :param audios: List of float32 16kHz mono numpy arrays
+        :param initial_prompt: Extra context appended to the default prompt, shared by the whole batch
+        :param tier: STTTier; overrides beam_size and may pick the lite model
+        :return: List of transcribed texts, in the same order
+        """
+        texts = [""] * len(audios)
+        if not self.is_ready:
+            logger.warning("Whisper model is not loaded yet, dropping utterances.")
+            return texts
+
+        from faster_whisper import BatchedInferencePipeline
+        from faster_whisper.vad import get_speech_timestamps
+
+        model = self._model_for(tier)
+        if tier is not None:
+            beam_size = tier.beam_size
+        batched = self.batched.get(id(model))
+        if batched is None:
+            batched = self.batched[id(model)] = BatchedInferencePipeline(model=model)
+
+        # clip_timestamps disables the pipeline's own VAD, so trim silence here
+        # (it prevents hallucinations on silence like vad_filter=True does)
+        pieces = []
+        clips = []
+        owners = []  # Index into audios of each clip
+        offset = 0
+        for i, audio in enumerate(audios):
+            if audio is None or audio.size == 0:
+                continue
+            audio = audio.astype(np.float32, copy=False)
+            speech = get_speech_timestamps(audio)
+            if not speech:
+                continue
+            piece = audio[speech[0]["start"]:speech[-1]["end"]]
+            pieces.append(piece)
+            clips.append({"start": offset / SAMPLE_RATE, "end": (offset + len(piece)) / SAMPLE_RATE})
+            owners.append(i)
+            offset += len(piece)
+
+        if not clips:
+            return texts
+
+        segments, info = batched.transcribe(
+            np.concatenate(pieces),
+            language=language,
+            beam_size=beam_size,
+            initial_prompt=f"{BASE_PROMPT}{initial_prompt}" if initial_prompt else BASE_PROMPT,
+            clip_timestamps=clips,
+            batch_size=len(clips),
+            without_timestamps=True
+        )
+
+        # Segment times are absolute in the concatenated signal: map them back to clips
+        starts = [clip["start"] for clip in clips]
+        for segment in segments:
+            clip = max(bisect.bisect_right(starts, segment.start + 1e-3) - 1, 0)
+            texts[owners[clip]] += segment.text
+
+        return [text.strip() for text in texts]
+
+    def _segments(self, audio, language, beam_size, initial_prompt, word_timestamps=False, tier=None):
+        if not self.is_ready:
+            logger.warning("Whisper model is not loaded yet, dropping utterance.")
+            return None
+
+        if isinstance(audio, np.ndarray):
+            if audio.size == 0:
+                return None
+            # faster-whisper expects float32 samples at 16kHz
+            if audio.dtype != np.float32:
+                audio = audio.astype(np.float32)
+        elif not os.path.exists(audio):
+            logger.error(f"Audio file not found: {audio}")
+            return None
+
+        prompt = BASE_PROMPT
+        if initial_prompt:
+            prompt = f"{BASE_PROMPT}{initial_prompt}"
+
+        if tier is not None:
+            beam_size = tier.beam_size
+
+        # vad_filter=True prevents hallucinations on silence
+        # initial_prompt guides the context
+        segments, info = self._model_for(tier).transcribe(
+            audio,
+            beam_size=beam_size,
+            language=language,
+            vad_filter=True,
+            initial_prompt=prompt,
+            word_timestamps=word_timestamps
+        )
+        return segments
+
+def _cuda_available() -> bool:
+    try:
+        import ctranslate2
+        return ctranslate2.get_cuda_device_count() > 0
+    except Exception:
+        return False
+
 if __name__ == "__main__":
     # Simple test
     logging.basicConfig(level=logging.INFO)
     try:
         engine = STTEngine(model_size="tiny", device="cpu", compute_type="int8")
+        engine.load()
         print("Model initialized. Ready to transcribe.")
     except Exception as e:
         print(f"Error: {e}")
+
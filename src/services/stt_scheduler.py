@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from ..config import STT_MAX_BATCH, STT_MAX_WAIT, STT_DEADLINE
+from .latency import current_trace
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class STTJob:
+    def __init__(self, audio, initial_prompt, future, trace=None):
+        self.audio = audio
+        self.initial_prompt = initial_prompt
+        self.future = future
+        self.trace = trace
+        self.enqueued = time.monotonic()
+        if trace:
+            trace.mark("stt_queued")
+
+
+class STTScheduler:
+    def __init__(self, engine, executor=None, max_batch=None, max_wait=None, deadline=None):
+        """
+        Queue of final transcriptions shared by every user and guild.
+        Utterances that arrive close together are decoded in one batch; the
+        engine picks the quality tier of each batch from the backlog, and
+        utterances that waited past the deadline are dropped.
+        :param engine: STTEngine
+        :param executor: Executor the decodes run in (None = loop default)
+        :param max_batch: Max utterances per decode
+        :param max_wait: Max seconds an utterance waits for others to join its batch
+        :param deadline: Seconds after which a queued utterance is not worth answering
+        """
+        self.engine = engine
+        self.executor = executor
+        self.max_batch = max(1, max_batch or STT_MAX_BATCH)
+        self.max_wait = max_wait if max_wait is not None else STT_MAX_WAIT
+        self.deadline = deadline if deadline is not None else STT_DEADLINE
+        self.queue = None
+        self.worker = None
+        self.inflight = 0  # Utterances in the batch being decoded
+        self.batches = 0
+        self.utterances = 0
+        self.shed = 0
+        self.tier_counts = {}  # {tier name: utterances}
+
+    def start(self):
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+        while self.queue and not self.queue.empty():
+            job = self.queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    @property
+    def backlog(self) -> int:
+        """
+        Utterances queued or being decoded.
+        """
+        return self.pending + self.inflight
+
+    async def transcribe(self, audio, initial_prompt=None):
+        """
+        Queue one utterance and wait for its text.
+        :param audio: float32 16kHz mono numpy array
+        :param initial_prompt: Extra context; dropped if the utterance is batched with others that do not share it
+        :return: Transcribed text, or None if the utterance was dropped as stale
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(STTJob(audio, initial_prompt, future, trace=current_trace.get()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+
+            # Wait for more utterances, but never longer than max_wait after the first one
+            # was queued (jobs that piled up during the previous decode go out immediately)
+            deadline = batch[0].enqueued + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._shed_stale([job for job in batch if not job.future.done()])
+            if not batch:
+                continue
+
+            now = time.monotonic()
+            tier = self.engine.choose_tier(
+                duration=max(len(job.audio) for job in batch) / SAMPLE_RATE,
+                backlog=len(batch) + self.pending,
+                waited=max(now - job.enqueued for job in batch),
+                deadline=self.deadline
+            )
+            if tier.name != "full":
+                logger.info(f"STT backlog {len(batch) + self.pending}: decoding {len(batch)} utterance(s) with tier '{tier.name}'")
+
+            self.inflight = len(batch)
+            started = time.time()
+            try:
+                texts = await loop.run_in_executor(self.executor, self._decode, batch, tier)
+            except Exception as e:
+                logger.error(f"Batched transcription failed: {e}")
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+            finally:
+                self.inflight = 0
+
+            self.batches += 1
+            self.utterances += len(batch)
+            self.tier_counts[tier.name] = self.tier_counts.get(tier.name, 0) + len(batch)
+            done = time.time()
+            for job in batch:
+                if job.trace:
+                    job.trace.mark("stt_started", started)
+                    job.trace.mark("stt_done", done)
+                    job.trace.observe("stt_queue", "stt_queued", "stt_started", backend="whisper")
+                    job.trace.observe("stt_decode", "stt_started", "stt_done", backend="whisper")
+            for job, text in zip(batch, texts):
+                if not job.future.done():
+                    job.future.set_result(text)
+
+    def _shed_stale(self, batch):
+        """
+        Drop utterances that waited longer than the deadline; answering a
+        sentence from many seconds ago is worse than skipping it.
+        """
+        now = time.monotonic()
+        fresh = []
+        for job in batch:
+            waited = now - job.enqueued
+            if self.deadline and waited > self.deadline:
+                self.shed += 1
+                logger.warning(f"Dropping utterance that waited {waited:.1f}s for transcription")
+                job.future.set_result(None)
+            else:
+                fresh.append(job)
+        return fresh
+
+    def _decode(self, batch, tier):
+        # A batched decode shares one prompt, so group the utterances by prompt
+        groups = {}  # {initial_prompt: [index into batch]}
+        for i, job in enumerate(batch):
+            groups.setdefault(job.initial_prompt, []).append(i)
+        # With streaming, every tail's prompt is its own committed text, so most groups hold one
+        # utterance. Those are decoded together without their prompt instead: the tail loses some
+        # context, but one batched decode is much faster than one decode per user.
+        lone = [indices[0] for indices in groups.values() if len(indices) == 1]
+        if len(lone) > 1:
+            groups = {prompt: indices for prompt, indices in groups.items() if len(indices) > 1}
+            groups.setdefault(None, []).extend(lone)
+
+        texts = [None] * len(batch)
+        for prompt, indices in groups.items():
+            if len(indices) == 1:
+                # A lone utterance takes the regular (VAD-filtered) path
+                i = indices[0]
+                texts[i] = self.engine.transcribe(batch[i].audio, initial_prompt=prompt, tier=tier)
+                continue
+            logger.debug(f"Decoding {len(indices)} utterances in one batch")
+            results = self.engine.transcribe_batch([batch[i].audio for i in indices], initial_prompt=prompt, tier=tier)
+            for i, text in zip(indices, results):
+                texts[i] = text
+        return texts
@@ -0,0 +1,115 @@
+import logging
+import threading
+from ..config import STT_PARTIAL_BEAM
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class StreamingTranscriber:
+    def __init__(self, engine, beam_size=None, min_audio=0.8, guard=0.3, max_window=12.0):
+        """
+        Incremental transcription of one utterance while it is still being spoken.
+        Each pass re-decodes the audio after the committed point; words that two
+        consecutive passes agree on (local agreement) are committed and never
+        decoded again, so only the unstable tail is re-decoded.
+        :param engine: STTEngine
+        :param beam_size: Beam size of partial passes
+        :param min_audio: Seconds of uncommitted audio needed for a pass
+        :param guard: Words ending closer than this to the end of audio are never committed
+        :param max_window: Max seconds of uncommitted audio; older words are force-committed
+        """
+        self.engine = engine
+        self.beam_size = beam_size or STT_PARTIAL_BEAM
+        self.min_audio = min_audio
+        self.guard = guard
+        self.max_window = max_window
+        # Partial passes and the final pass of one utterance never overlap
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.committed_text = ""
+        self.committed_samples = 0
+        self.hypothesis = []  # Unstable words of the last pass: (start, end, word), absolute seconds
+
+    @property
+    def unstable_text(self) -> str:
+        return "".join(word for _, _, word in self.hypothesis)
+
+    def update(self, audio):
+        """
+        Run one partial pass on the utterance so far.
+        :param audio: float32 16kHz mono audio of the whole utterance so far
+        :return: (committed_text, unstable_text)
+        """
+        with self.lock:
+            offset = self.committed_samples
+            tail = audio[offset:]
+            if len(tail) < self.min_audio * SAMPLE_RATE:
+                return self.committed_text, self.unstable_text
+
+            words = self.engine.transcribe_words(
+                tail, beam_size=self.beam_size, initial_prompt=self.committed_text or None
+            )
+            base = offset / SAMPLE_RATE
+            words = [(start + base, end + base, word) for start, end, word in words]
+
+            # Longest common prefix with the previous pass
+            agreed = 0
+            for new, old in zip(words, self.hypothesis):
+                if _normalize(new[2]) != _normalize(old[2]):
+                    break
+                agreed += 1
+
+            audio_end = len(audio) / SAMPLE_RATE
+            limit = audio_end - self.guard
+            commit = 0
+            for i in range(agreed):
+                if words[i][1] > limit:
+                    break
+                commit = i + 1
+
+            # Don't let the uncommitted window grow without bound
+            if commit == 0 and audio_end - base > self.max_window:
+                while commit < len(words) and words[commit][1] <= audio_end - self.max_window / 2:
+                    commit += 1
+
+            if commit:
+                self.committed_text += "".join(word for _, _, word in words[:commit])
+                self.committed_samples = int(words[commit - 1][1] * SAMPLE_RATE)
+            self.hypothesis = words[commit:]
+
+            return self.committed_text, self.unstable_text
+
+    def take_tail(self, audio):
+        """
+        Split a finished utterance into the committed text and the audio that
+        still has to be decoded, and reset for the next utterance.
+        :return: (committed_text, tail audio or None if nothing is left to decode)
+        """
+        with self.lock:
+            try:
+                if self.committed_samples == 0:
+                    return "", audio
+                tail = audio[self.committed_samples:]
+                if len(tail) < 0.2 * SAMPLE_RATE:
+                    tail = None
+                return self.committed_text, tail
+            finally:
+                self.reset()
+
+    def finalize(self, audio, beam_size=5):
+        """
+        Final transcript of a finished utterance.
+        Only the audio after the committed point is decoded again.
+        """
+        committed, tail = self.take_tail(audio)
+        tail_text = ""
+        if tail is not None:
+            tail_text = self.engine.transcribe(tail, beam_size=beam_size, initial_prompt=committed or None)
+        return (committed + tail_text).strip()
+
+def _normalize(word: str) -> str:
+    return word.strip().strip("、。！？!?,.").lower()
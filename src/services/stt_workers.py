@@ -0,0 +1,389 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from ..config import STT_WORKERS, STT_WORKER_THREADS, STT_WORKER_TIMEOUT, STT_WORKER_TIMEOUT_FACTOR
+from .stt_engine import STTEngine, TIERS
+
+logger = logging.getLogger(__name__)
+
+_TIERS = {tier.name: tier for tier in TIERS}
+
+
+class _Request:
+    def __init__(self, request_id, worker):
+        self.id = request_id
+        self.worker = worker
+        self.generation = worker.generation
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Worker:
+    def __init__(self, index, cores, cpu_threads):
+        self.index = index
+        self.cores = cores
+        self.cpu_threads = cpu_threads
+        self.generation = 0
+        self.process = None
+        self.requests = None
+        self.ready = False
+        self.load_failed = False
+        self.restart_delay = 1.0
+        self.restart_at = None
+        self.outstanding = {}  # {request_id: _Request}
+
+
+class STTWorkerPool:
+    def __init__(self, num_workers=None, cpu_threads=None, engine_class=None, **engine_kwargs):
+        """
+        STTEngine instances in separate processes, so decoding does not compete
+        with the voice thread, the WebSocket server and the event loop for the GIL.
+        Same interface as STTEngine (transcribe / transcribe_batch / transcribe_words);
+        calls block the calling thread until a worker answers.
+        Audio goes through shared memory; only small messages are pickled.
+        :param num_workers: Number of worker processes
+        :param cpu_threads: CTranslate2 threads per worker (0 = its share of the cores)
+        :param engine_class: Engine created in each worker (default STTEngine; must be importable by the workers)
+        :param engine_kwargs: Passed to the engine in each worker
+        """
+        self.num_workers = max(1, num_workers or STT_WORKERS or 1)
+        cpu_threads = cpu_threads if cpu_threads is not None else STT_WORKER_THREADS
+        self.engine_class = engine_class or STTEngine
+        self.engine_kwargs = engine_kwargs
+        # Tier choice only needs the configuration, not a loaded model
+        self._tiers = self.engine_class(**engine_kwargs)
+
+        self._ctx = mp.get_context("spawn")
+        self._results = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._ready = threading.Event()
+        self._load_done = threading.Event()
+        self._closed = False
+        self._monitor = None
+        self.load_error = None
+        self.restarts = 0
+        self.timeouts = 0
+
+        # Pin each worker to its own slice of the cores
+        cores = _available_cores()
+        slices = [list(part) for part in np.array_split(cores, self.num_workers)] if cores else []
+        self.workers = []
+        for i in range(self.num_workers):
+            slice_ = [int(c) for c in slices[i]] if slices and len(slices[i]) else None
+            threads = cpu_threads or (len(slice_) if slice_ else 0)
+            self.workers.append(_Worker(i, slice_, threads))
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        self._load_done.wait(timeout)
+        return self.is_ready
+
+    def load_in_background(self):
+        """
+        Start the worker processes; each loads and warms up its model.
+        """
+        if self._monitor is None:
+            self._results = self._ctx.Queue()
+            for worker in self.workers:
+                self._start(worker)
+            self._monitor = threading.Thread(target=self._monitor_loop, name="stt-workers", daemon=True)
+            self._monitor.start()
+        return self._monitor
+
+    def load(self):
+        self.load_in_background()
+        self.wait_ready()
+
+    def close(self):
+        self._closed = True
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.requests.put(None)
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            self._fail(worker, "STT worker pool closed")
+
+    def choose_tier(self, *args, **kwargs):
+        return self._tiers.choose_tier(*args, **kwargs)
+
+    def transcribe(self, audio, language="ja", beam_size=5, initial_prompt=None, tier=None):
+        return self._call("transcribe", [audio], language=language, beam_size=beam_size,
+                          initial_prompt=initial_prompt, tier=tier.name if tier else None)
+
+    def transcribe_words(self, audio, language="ja", beam_size=1, initial_prompt=None):
+        return self._call("words", [audio], language=language, beam_size=beam_size, initial_prompt=initial_prompt)
+
+    def transcribe_batch(self, audios, language="ja", beam_size=5, initial_prompt=None, tier=None):
+        return self._call("batch", audios, language=language, beam_size=beam_size,
+                          initial_prompt=initial_prompt, tier=tier.name if tier else None)
+
+    def _call(self, kind, audios, **kwargs):
+        if not self.is_ready:
+            logger.warning("No STT worker is ready, dropping utterance.")
+            return [""] * len(audios) if kind == "batch" else ("" if kind == "transcribe" else [])
+
+        shm, lengths = _pack(audios)
+        timeout = STT_WORKER_TIMEOUT + STT_WORKER_TIMEOUT_FACTOR * sum(lengths) / 16000
+        try:
+            with self._lock:
+                worker = self._pick_worker()
+                if worker is None:
+                    raise RuntimeError("No STT worker is running")
+                request = _Request(next(self._ids), worker)
+                worker.outstanding[request.id] = request
+                worker.requests.put((request.id, kind, shm.name, lengths, kwargs))
+            if not request.event.wait(timeout):
+                self._expire(request, timeout)
+            if request.error:
+                raise RuntimeError(request.error)
+            return request.result
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _expire(self, request, timeout):
+        """
+        A request got no answer in time: fail it and kill its (wedged) worker.
+        The monitor then fails the worker's other requests and restarts it.
+        """
+        with self._lock:
+            expired = request.worker.outstanding.pop(request.id, None) is not None
+        if not expired:
+            # Answered (or failed) just now; the event is about to be set
+            request.event.wait()
+            return
+        self.timeouts += 1
+        request.error = f"STT worker {request.worker.index} did not answer within {timeout:.1f}s"
+        worker = request.worker
+        if worker.generation == request.generation and worker.process and worker.process.is_alive():
+            logger.error(f"{request.error}; restarting it")
+            worker.process.terminate()
+
+    def _pick_worker(self):
+        ready = [w for w in self.workers if w.ready and w.process and w.process.is_alive()]
+        if not ready:
+            return None
+        return min(ready, key=lambda w: len(w.outstanding))
+
+    def _start(self, worker):
+        worker.generation += 1
+        worker.ready = False
+        worker.restart_at = None
+        worker.requests = self._ctx.Queue()
+        engine_kwargs = dict(self.engine_kwargs, cpu_threads=worker.cpu_threads)
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.index, worker.generation, worker.requests, self._results,
+                  self.engine_class, engine_kwargs, worker.cores),
+            name=f"stt-worker-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+        logger.info(f"Started STT worker {worker.index} (cores {worker.cores}, {worker.cpu_threads or 'default'} threads)")
+
+    def _fail(self, worker, error):
+        with self._lock:
+            requests = list(worker.outstanding.values())
+            worker.outstanding.clear()
+        for request in requests:
+            request.error = error
+            request.event.set()
+
+    def _monitor_loop(self):
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+
+            if message is not None:
+                self._handle(message)
+            self._check_workers()
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == "result":
+            _, request_id, ok, payload = message
+            with self._lock:
+                request = None
+                for worker in self.workers:
+                    request = worker.outstanding.pop(request_id, None)
+                    if request is not None:
+                        break
+            if request is None:
+                return
+            if ok:
+                request.result = payload
+            else:
+                request.error = payload
+            request.event.set()
+        elif kind == "ready":
+            _, index, generation = message
+            worker = self.workers[index]
+            if generation == worker.generation:
+                worker.ready = True
+                worker.load_failed = False
+                worker.restart_delay = 1.0
+                self._ready.set()
+                self._load_done.set()
+                logger.info(f"STT worker {index} is ready.")
+        elif kind == "failed":
+            _, index, generation, error = message
+            logger.error(f"STT worker {index} could not load its model: {error}")
+            self.load_error = error
+            self.workers[index].load_failed = True
+            # Every worker failed to load: stop waiting for them (restarts continue)
+            if all(w.load_failed for w in self.workers):
+                self._load_done.set()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None or self._closed:
+                continue
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self.restarts += 1
+                    self._start(worker)
+                continue
+            if worker.process.is_alive():
+                continue
+
+            # Crashed (or failed to load): fail its requests and restart it with backoff
+            logger.error(f"STT worker {worker.index} exited (code {worker.process.exitcode}); restarting in {worker.restart_delay:.0f}s")
+            if not worker.ready:
+                worker.load_failed = True
+                self.load_error = self.load_error or f"STT worker {worker.index} exited during startup"
+            worker.ready = False
+            self._fail(worker, f"STT worker {worker.index} died")
+            worker.restart_at = now + worker.restart_delay
+            worker.restart_delay = min(worker.restart_delay * 2, 60.0)
+
+        if not any(w.ready for w in self.workers):
+            self._ready.clear()
+            if all(w.load_failed for w in self.workers):
+                self._load_done.set()
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _pack(audios):
+    """
+    Copy utterances into one shared memory block.
+    :return: (SharedMemory, lengths)
+    """
+    lengths = [0 if audio is None else len(audio) for audio in audios]
+    total = sum(lengths)
+    shm = shared_memory.SharedMemory(create=True, size=max(total, 1) * 4)
+    view = np.ndarray((total,), dtype=np.float32, buffer=shm.buf)
+    pos = 0
+    for audio, length in zip(audios, lengths):
+        if length:
+            view[pos:pos + length] = audio
+        pos += length
+    del view
+    return shm, lengths
+
+
+def _attach(name):
+    """
+    Open the parent's shared memory block in a worker, without registering it with
+    the resource tracker: only the parent owns (and unlinks) it. A registration from
+    the worker is reported as a leak, or unlinks the block a second time.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None if rtype == "shared_memory" else register(name, rtype)
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _unpack(shm, lengths):
+    # Views on the shared block, no copy
+    view = np.ndarray((sum(lengths),), dtype=np.float32, buffer=shm.buf)
+    audios = []
+    pos = 0
+    for length in lengths:
+        audios.append(view[pos:pos + length])
+        pos += length
+    return audios
+
+
+def _worker_main(index, generation, requests, results, engine_class, engine_kwargs, cores):
+    """
+    Entry point of a worker process.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+    logging.basicConfig(level=logging.INFO)
+
+    engine = engine_class(**engine_kwargs)
+    try:
+        engine.load()
+    except Exception as e:
+        results.put(("failed", index, generation, str(e)))
+        return
+    # Ready with the main model, like the in-process engine; warmup and the lite model follow
+    results.put(("ready", index, generation))
+    try:
+        engine.warmup()
+    except Exception as e:
+        logger.warning(f"STT worker {index} warmup failed: {e}")
+    # The lite tier falls back to the main model until this is done
+    threading.Thread(target=engine.load_lite, name="stt-lite-loader", daemon=True).start()
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, kind, shm_name, lengths, kwargs = message
+        tier = _TIERS.get(kwargs.pop("tier", None))
+        audios = None
+        shm = None
+        try:
+            shm = _attach(shm_name)
+            audios = _unpack(shm, lengths)
+            if kind == "batch":
+                payload = engine.transcribe_batch(audios, tier=tier, **kwargs)
+            elif kind == "words":
+                payload = engine.transcribe_words(audios[0], **kwargs)
+            else:
+                payload = engine.transcribe(audios[0], tier=tier, **kwargs)
+            results.put(("result", request_id, True, payload))
+        except Exception as e:
+            results.put(("result", request_id, False, str(e)))
+        finally:
+            audios = None
+            if shm is not None:
+                try:
+                    shm.close()
+                except BufferError:
+                    pass  # A view is still referenced; released with it
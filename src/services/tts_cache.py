@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from ..config import TTS_CACHE_DIR, TTS_CACHE_MEMORY_MB, TTS_CACHE_DISK_MB
+from ..utils.audio_sources import EncodedSpeech
+
+logger = logging.getLogger(__name__)
+
+# File layout: magic, packet count, (uint16 length + packet) per packet,
+# then the envelope (2 bytes per packet)
+_MAGIC = b"MOPS2"
+_COUNT = struct.Struct("<I")
+_LENGTH = struct.Struct("<H")
+
+
+class TTSCache:
+    def __init__(self, cache_dir=None, memory_bytes=None, disk_bytes=None):
+        """
+        Two-level cache of ready-to-send Opus packets (and their envelope) for synthesized sentences.
+        L1: in-memory LRU bounded by bytes. L2: one file per entry on disk.
+        :param cache_dir: Directory of the on-disk store
+        :param memory_bytes: Byte budget of the in-memory LRU
+        :param disk_bytes: Byte budget of the on-disk store
+        """
+        self.cache_dir = cache_dir or TTS_CACHE_DIR
+        self.memory_bytes = memory_bytes if memory_bytes is not None else int(TTS_CACHE_MEMORY_MB * 1024 * 1024)
+        self.disk_bytes = disk_bytes if disk_bytes is not None else int(TTS_CACHE_DISK_MB * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._memory = OrderedDict()  # digest -> EncodedSpeech
+        self._memory_used = 0
+        self._disk_used = None  # Computed lazily (directory scan)
+        self._disk_lock = threading.Lock()  # Writes run on executor threads
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(key) -> str:
+        """
+        Stable file name for a cache key tuple.
+        """
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    async def get(self, key):
+        """
+        Return the cached EncodedSpeech for key, or None.
+        """
+        digest = self.digest(key)
+        frames = self._memory.get(digest)
+        if frames is not None:
+            self._memory.move_to_end(digest)
+            self.hits += 1
+            return frames
+
+        loop = asyncio.get_event_loop()
+        frames = await loop.run_in_executor(None, self._read_file, digest)
+        if frames is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(digest, frames)
+        return frames
+
+    def put(self, key, frames):
+        """
+        Store an EncodedSpeech for key. The disk write happens in the background.
+        """
+        if not frames:
+            return
+        digest = self.digest(key)
+        self._remember(digest, frames)
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, self._write_file, digest, frames)
+
+    def _remember(self, digest, frames):
+        size = _frames_size(frames)
+        if size > self.memory_bytes:
+            return
+        old = self._memory.pop(digest, None)
+        if old is not None:
+            self._memory_used -= _frames_size(old)
+        self._memory[digest] = frames
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= _frames_size(evicted)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.opus")
+
+    def _read_file(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if data[:len(_MAGIC)] != _MAGIC:
+                raise ValueError("bad magic")
+            pos = len(_MAGIC)
+            (count,) = _COUNT.unpack_from(data, pos)
+            pos += _COUNT.size
+            packets = []
+            for _ in range(count):
+                (length,) = _LENGTH.unpack_from(data, pos)
+                pos += _LENGTH.size
+                packets.append(data[pos:pos + length])
+                pos += length
+            envelope = data[pos:pos + 2 * count]
+            pos += 2 * count
+            if pos != len(data):
+                raise ValueError("trailing data")
+            frames = EncodedSpeech(packets, envelope)
+        except Exception as e:
+            logger.warning(f"Dropping corrupt TTS cache entry {path}: {e}")
+            _remove(path)
+            return None
+
+        # Touch so disk eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return frames
+
+    def _write_file(self, digest, frames):
+        path = self._path(digest)
+        if os.path.exists(path):
+            return
+        parts = [_MAGIC, _COUNT.pack(len(frames))]
+        for packet in frames.packets:
+            parts.append(_LENGTH.pack(len(packet)))
+            parts.append(packet)
+        parts.append(frames.envelope)
+        data = b"".join(parts)
+
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to write TTS cache entry: {e}")
+            _remove(tmp_path)
+            return
+
+        with self._disk_lock:
+            if self._disk_used is None:
+                self._disk_used = self._scan_disk()
+            else:
+                self._disk_used += len(data)
+            if self._disk_used > self.disk_bytes:
+                self._prune_disk()
+
+    def _scan_disk(self):
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".opus"):
+                total += entry.stat().st_size
+        return total
+
+    def _prune_disk(self):
+        # Remove least recently used entries until we are at 90% of the budget
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".opus")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        target = self.disk_bytes * 0.9
+        for entry in entries:
+            if total <= target:
+                break
+            total -= entry.stat().st_size
+            _remove(entry.path)
+        self._disk_used = total
+
+
+def _frames_size(frames):
+    # Packet and envelope bytes plus rough per-object overhead
+    return sum(len(packet) for packet in frames.packets) + 40 * len(frames) + len(frames.envelope)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from ..config import BARGE_IN_FADE
+
+logger = logging.getLogger(__name__)
+
+
+class TurnController:
+    def __init__(self, pipeline):
+        """
+        Per-guild owner of the bot's current turn (LLM stream + TTS + playback).
+        A barge-in cancels the turn's task, which closes the Ollama stream and
+        aborts pending SBV2 requests, and fades the playback out.
+        :param pipeline: The guild's SpeechPipeline
+        """
+        self.pipeline = pipeline
+        self.task = None
+        # Tasks cancelled by us (not by their caller); several can be waiting to resume
+        self._interrupted = set()
+        self.barge_ins = 0
+
+    @property
+    def busy(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def run(self, coro):
+        """
+        Run one turn; a newer turn replaces (cancels) the current one.
+        :return: The coroutine's result, or None if the turn was interrupted
+        """
+        self.cancel()
+        task = asyncio.ensure_future(coro)
+        self.task = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task in self._interrupted:
+                return None
+            task.cancel()
+            raise
+        finally:
+            if self.task is task:
+                self.task = None
+            self._interrupted.discard(task)
+
+    def cancel(self):
+        """
+        Cancel the current turn without fading (it is being replaced).
+        """
+        if self.busy:
+            self._interrupted.add(self.task)
+            self.task.cancel()
+
+    def barge_in(self, fade=None) -> bool:
+        """
+        The user started talking: drop the current turn and fade its audio out.
+        :return: True if there was something to interrupt
+        """
+        if not self.busy:
+            return False
+        self.barge_ins += 1
+        self.pipeline.fade_out(BARGE_IN_FADE if fade is None else fade)
+        self.cancel()
+        return True
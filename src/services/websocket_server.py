@@ -1,42 +1,190 @@
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import PlainTextResponse
 import asyncio
+import json
 import logging
-from ..config import WS_HOST, WS_PORT
+from collections import deque
+from ..config import WS_HOST, WS_PORT, WS_SEND_QUEUE, WS_SEND_TIMEOUT
+from .latency import get_metrics
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
-active_connections = []
+active_connections = {}  # {WebSocket: ClientConnection}
+
+# High-rate message types: only the newest pending message per key is kept
+# (e.g. one partial transcript per speaker). Other types are dropped
+# oldest-first when a client's queue is full.
+COALESCE_KEYS = {"partial_transcript": "user_id"}
+
+# Opt-in channels: only sent to clients that subscribed, e.g.
+#   {"type": "subscribe", "channel": "envelope"}
+CHANNELS = {"envelope"}
+
+
+class ClientConnection:
+    def __init__(self, websocket, max_queue=None, send_timeout=None):
+        """
+        One frontend connection with its own bounded send queue and writer task,
+        so a slow client only delays itself.
+        :param websocket: Accepted WebSocket
+        :param max_queue: Max pending messages
+        :param send_timeout: Seconds a single send may take before the client is dropped
+        """
+        self.websocket = websocket
+        self.max_queue = max_queue or WS_SEND_QUEUE
+        self.send_timeout = send_timeout or WS_SEND_TIMEOUT
+        self.queue = deque()  # [key, text or bytes] entries, oldest first
+        self.pending_keys = {}  # {coalesce key: entry in queue}
+        self.subscriptions = set()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def offer(self, text, key=None):
+        """
+        Queue an encoded message (str: text frame, bytes: binary frame) without waiting.
+        :param key: Coalescing key; replaces a pending message with the same key
+        """
+        if self.closed:
+            return
+        if key is not None:
+            entry = self.pending_keys.get(key)
+            if entry is not None:
+                entry[1] = text
+                return
+
+        if len(self.queue) >= self.max_queue:
+            old_key, _ = self.queue.popleft()
+            if old_key is not None:
+                self.pending_keys.pop(old_key, None)
+            self.dropped += 1
+
+        entry = [key, text]
+        self.queue.append(entry)
+        if key is not None:
+            self.pending_keys[key] = entry
+        self.wakeup.set()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue:
+                    key, data = self.queue.popleft()
+                    if key is not None:
+                        self.pending_keys.pop(key, None)
+                    if isinstance(data, bytes):
+                        send = self.websocket.send_bytes(data)
+                    else:
+                        send = self.websocket.send_text(data)
+                    await asyncio.wait_for(send, self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping WebSocket client: {e!r}")
+            self.close()
+
+    def handle_command(self, data) -> bool:
+        """
+        Apply a subscribe/unsubscribe command from the frontend.
+        :return: False if the message is not a command
+        """
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return False
+        if not isinstance(message, dict) or message.get("type") not in ("subscribe", "unsubscribe"):
+            return False
+        channel = message.get("channel")
+        if channel not in CHANNELS:
+            self.offer(json.dumps({"type": "error", "message": f"unknown channel: {channel}"}))
+        elif message["type"] == "subscribe":
+            self.subscriptions.add(channel)
+        else:
+            self.subscriptions.discard(channel)
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        active_connections.pop(self.websocket, None)
+        self.queue.clear()
+        self.pending_keys.clear()
+        if not self.writer.done() and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        # Unblocks the endpoint's receive loop if the client stopped reading
+        asyncio.create_task(_close_quietly(self.websocket))
+
+
+async def _close_quietly(websocket):
+    try:
+        await websocket.close()
+    except Exception:
+        pass
+
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
+    client = ClientConnection(websocket)
+    active_connections[websocket] = client
     try:
         while True:
             # Keep alive / listen for client messages
             data = await websocket.receive_text()
-            # Echo or process commands from frontend
-            await websocket.send_text(f"Message received: {data}")
+            # Process commands from frontend, echo anything else
+            if not client.handle_command(data):
+                client.offer(f"Message received: {data}")
     except Exception:
-        active_connections.remove(websocket)
+        pass
+    finally:
+        client.close()
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Stage latency histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
 
 class WebSocketServer:
     def __init__(self):
         pass
-    
+
     async def broadcast(self, message: dict):
         """
         Broadcast a JSON message to all connected clients.
+        Never waits for a client: the message is encoded once and queued per client.
         """
+        self.broadcast_nowait(message)
+
+    def broadcast_nowait(self, message: dict):
         if not active_connections:
             return
-            
-        for connection in active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                pass
+
+        text = json.dumps(message, ensure_ascii=False)
+        key = None
+        field = COALESCE_KEYS.get(message.get("type"))
+        if field is not None:
+            key = (message["type"], message.get(field))
+
+        for client in list(active_connections.values()):
+            client.offer(text, key)
+
+    def has_subscribers(self, channel) -> bool:
+        return any(channel in client.subscriptions for client in active_connections.values())
+
+    def broadcast_binary_nowait(self, data: bytes, channel):
+        """
+        Queue a binary frame to the clients subscribed to a channel.
+        """
+        for client in list(active_connections.values()):
+            if channel in client.subscriptions:
+                client.offer(data)
 
 def run_server():
     import uvicorn
@@ -1,91 +1,209 @@
 import time
-import wave
-import audioop
-import os
-import uuid
 import logging
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin
+from .vad import VoiceActivityDetector
 
 logger = logging.getLogger(__name__)
 
+# VAD settings are shared; each recorder keeps its own VADState
+DEFAULT_VAD = VoiceActivityDetector(rate=48000, frame_ms=20)
+
+# 48kHz -> 16kHz anti-aliasing low-pass (passband up to ~7kHz, below the 8kHz Nyquist)
+DECIMATION_TAPS = firwin(63, 7200, fs=48000).astype(np.float32)
+
+
+class Decimator:
+    def __init__(self, taps=None, factor=3):
+        """
+        Streaming FIR decimator: filters and keeps every `factor`-th sample,
+        carrying the filter history (and phase) from one packet to the next,
+        so packet-by-packet output equals filtering the whole signal at once.
+        """
+        taps = DECIMATION_TAPS if taps is None else np.asarray(taps, dtype=np.float32)
+        self.taps = taps[::-1].copy()  # Windows are dotted with the reversed taps (convolution)
+        self.factor = factor
+        self.history = np.zeros(len(taps) - 1, dtype=np.float32)
+        self.phase = 0  # Index of the next output among this block's input samples
+
+    def process(self, samples):
+        """
+        :param samples: float32 mono block at the input rate
+        :return: float32 block at the output rate (only the outputs this block completes)
+        """
+        block = np.concatenate((self.history, samples))
+        # One window per input sample; only every factor-th one is computed
+        windows = sliding_window_view(block, len(self.taps))[self.phase::self.factor]
+        out = windows @ self.taps
+        self.phase = (self.phase - len(samples)) % self.factor
+        self.history = block[len(block) - len(self.history):]
+        return out
+
+
 class AudioRecorder:
-    def __init__(self, user_id, save_dir="./data/temp"):
+    def __init__(self, user_id, vad=None, clock=None):
+        """
+        :param user_id: Speaker
+        :param vad: Shared VoiceActivityDetector (settings only)
+        :param clock: Time source (default time.time; replay passes the capture's clock)
+        """
         self.user_id = user_id
-        self.save_dir = save_dir
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir, exist_ok=True)
-            
-        self.buffer = bytearray()
-        self.last_packet_time = time.time()
-        self.silence_start_time = None
+        self.clock = clock or time.time
+        # write() runs in the voice thread, poll() where the end-of-speech timer fires
+        self.lock = threading.RLock()
+        self.timer_armed = False # An end-of-speech timer is pending for this recorder (VoiceChat)
+        self.last_packet_time = self.clock()
+        self.last_voice_time = None # Last frame the VAD classified as voiced
         self.is_speaking = False
+        self.speech_started = None # When the VAD detected the onset of the current utterance
+        self.utterances = 0 # Incremented every time the buffer is flushed or discarded
+        self.utterance_times = None # (speech start, last voiced packet, flushed) of the last flushed utterance
+
+        # Adaptive VAD (noise floor / pause length are learned per user)
+        self.vad = vad if vad else DEFAULT_VAD
+        self.vad_state = self.vad.new_state()
         
         # Audio params
         self.CHANNELS = 2
         self.SAMPLE_WIDTH = 2 # 16-bit
         self.RATE = 48000
         self.BYTES_PER_SEC = self.RATE * self.CHANNELS * self.SAMPLE_WIDTH
+        # Whisper input format
+        self.TARGET_RATE = 16000
         
-        # VAD Config
-        # RMS threshold is tricky. 300-500 is usually background noise.
-        # This might need tuning.
-        self.SILENCE_THRESHOLD = 500 
-        self.SILENCE_DURATION = 1.0 # Seconds of silence to trigger 'End of Sentence'
+        # Utterance limits
+        # (End-of-speech silence is decided per user by the VAD, at most 1.0s)
         self.MIN_DURATION = 1.0 # Minimum seconds to consider valid speech
         self.MAX_DURATION = 20.0 # Force flush if too long (20s)
+        self.PRE_ROLL = 0.3 # Audio kept from before the detected onset, so it is not clipped
+
+        # Packets are down-mixed and decimated to 16kHz mono as they arrive and stored
+        # as int16 in a preallocated ring (12x smaller than the raw 48kHz stereo, never grows)
+        self.decimator = Decimator(factor=self.RATE // self.TARGET_RATE)
+        self.pre_roll_samples = int(self.PRE_ROLL * self.TARGET_RATE)
+        # One extra second: a packet may push an utterance just past MAX_DURATION before the flush
+        capacity = int((self.MAX_DURATION + self.PRE_ROLL + 1.0) * self.TARGET_RATE)
+        self.ring = np.zeros(capacity, dtype=np.int16)
+        self.written = 0 # Samples written since the recorder was created
+        self.start = 0 # First sample of the current utterance (pre-roll included)
 
     def write(self, pcm_data):
         """
         Write raw PCM data to buffer.
-        Returns a file path if a complete utterance is detected and saved.
+        Returns a float32 16kHz mono array if a complete utterance is detected.
+        """
+        with self.lock:
+            return self._write(pcm_data)
+
+    def poll(self):
         """
-        self.buffer.extend(pcm_data)
-        self.last_packet_time = time.time()
+        Check for the end of speech without a packet (Discord sends none during silence).
+        Returns the utterance audio if the silence window is over, None otherwise.
+        """
+        with self.lock:
+            return self.check_flush()
+
+    def end_of_speech_deadline(self):
+        """
+        When (clock time) the current utterance ends if no more voice arrives, or None if not speaking.
+        """
+        with self.lock:
+            if not self.is_speaking or self.last_voice_time is None:
+                return None
+            return self.last_voice_time + self.vad.end_of_speech_timeout(self.vad_state)
+
+    def _write(self, pcm_data):
+        self.last_packet_time = self.clock()
+        mono = self.downmix(pcm_data)
+
+        # Between utterances only the pre-roll is kept
+        if not self.is_speaking:
+            self.start = max(self.start, self.written - self.pre_roll_samples)
+        self._append(self.decimator.process(mono))
         
-        # Calculate RMS for VAD
+        # Energy + ZCR VAD with adaptive noise floor
         try:
-            rms = audioop.rms(pcm_data, self.SAMPLE_WIDTH)
+            is_voice = self.vad.process_frame(mono, self.vad_state)
         except Exception:
-            rms = 0
+            is_voice = False
         
-        if rms > self.SILENCE_THRESHOLD:
+        if is_voice:
             if not self.is_speaking:
                 # Speech started
                 self.is_speaking = True
+                self.speech_started = self.last_packet_time
                 # logger.debug(f"User {self.user_id} started speaking.")
-            self.silence_start_time = None
-        else:
-            if self.is_speaking:
-                if self.silence_start_time is None:
-                    self.silence_start_time = time.time()
+            if self.vad_state.silence_frames == 0:
+                self.last_voice_time = self.last_packet_time
         
         return self.check_flush()
 
+    def downmix(self, pcm_data):
+        """
+        48kHz stereo s16le -> float32 mono in [-1, 1].
+        """
+        frame_bytes = self.CHANNELS * self.SAMPLE_WIDTH
+        usable = len(pcm_data) - len(pcm_data) % frame_bytes
+        samples = np.frombuffer(memoryview(pcm_data)[:usable], dtype="<i2").reshape(-1, self.CHANNELS)
+        return samples.mean(axis=1, dtype=np.float32) / 32768.0
+
+    def _append(self, samples):
+        """
+        Store 16kHz float samples in the ring as int16.
+        """
+        samples = np.clip(samples * 32768.0, -32768, 32767).astype(np.int16)
+        capacity = len(self.ring)
+        pos = self.written % capacity
+        first = min(len(samples), capacity - pos)
+        self.ring[pos:pos + first] = samples[:first]
+        self.ring[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def _read(self, start, end) -> np.ndarray:
+        """
+        Copy of ring samples [start, end) (int16).
+        """
+        capacity = len(self.ring)
+        pos = start % capacity
+        count = end - start
+        if pos + count <= capacity:
+            return self.ring[pos:pos + count].copy()
+        return np.concatenate((self.ring[pos:], self.ring[:pos + count - capacity]))
+
+    @property
+    def buffered_samples(self) -> int:
+        return self.written - self.start
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self.buffered_samples * self.ring.itemsize
+
     def check_flush(self):
         """
-        Check if we should flush the buffer to a file.
-        Returns path if flushed, None otherwise.
+        Check if we should flush the buffer.
+        Returns the utterance audio if flushed, None otherwise.
         """
-        current_time = time.time()
+        current_time = self.clock()
         
         # Check max duration
-        buffer_duration = len(self.buffer) / self.BYTES_PER_SEC
+        buffer_duration = self.buffered_samples / self.TARGET_RATE
         if buffer_duration > self.MAX_DURATION:
             return self._flush()
 
         if not self.is_speaking:
-             # Cleanup old buffer if valid timeout
-             if len(self.buffer) > 0 and (current_time - self.last_packet_time > 5.0):
-                 self.buffer.clear()
-             return None
+            # Nothing but the pre-roll is buffered
+            return None
 
         # Logic: Speaking started, checking for silence closure
-        if self.silence_start_time and (current_time - self.silence_start_time > self.SILENCE_DURATION):
+        silence_duration = self.vad.end_of_speech_timeout(self.vad_state)
+        # Same expression as end_of_speech_deadline(), so a timer firing at the deadline flushes
+        if self.last_voice_time and current_time >= self.last_voice_time + silence_duration:
             # Silence detected long enough
             if buffer_duration < self.MIN_DURATION:
                 # Too short, discard (probably cough or click)
-                self.buffer.clear()
-                self.is_speaking = False
-                self.silence_start_time = None
+                self.cleanup()
                 return None
             
             # Valid utterance
@@ -94,33 +212,38 @@ class AudioRecorder:
         return None
 
     def _flush(self):
-        filename = f"{self.user_id}_{int(time.time()*1000)}_{str(uuid.uuid4())[:4]}.wav"
-        path = os.path.join(self.save_dir, filename)
-        
+        duration = self.buffered_samples / self.TARGET_RATE
+        self.utterance_times = (self.speech_started, self.last_voice_time, self.clock())
         try:
-            # Create a mono version for Whisper if possible, but for raw PCM dump we might just dump stereo.
-            # Audioop.tomono requires width, left_factor, right_factor.
-            # Simple averaging: 0.5, 0.5
-            mono_data = audioop.tomono(self.buffer, self.SAMPLE_WIDTH, 0.5, 0.5)
-
-            with wave.open(path, 'wb') as wf:
-                wf.setnchannels(1) # Saving as Mono
-                wf.setsampwidth(self.SAMPLE_WIDTH)
-                wf.setframerate(self.RATE)
-                wf.writeframes(mono_data)
-            
-            logger.info(f"Saved audio: {path} (Duration: {len(self.buffer)/self.BYTES_PER_SEC:.2f}s, Mono)")
+            audio = self.to_whisper_audio(self._read(self.start, self.written))
+            logger.info(f"Captured utterance from {self.user_id} (Duration: {duration:.2f}s, 16kHz mono)")
         except Exception as e:
-            logger.error(f"Failed to save audio: {e}")
-            path = None
+            logger.error(f"Failed to convert audio: {e}")
+            audio = None
 
         self.cleanup()
-        return path
+        return audio
+
+    def to_whisper_audio(self, samples):
+        """
+        Convert stored 16kHz mono int16 samples to float32 in [-1, 1] (what Whisper expects).
+        """
+        return samples.astype(np.float32) / 32768.0
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Copy of the ongoing utterance, 16kHz mono int16 (for partial transcription).
+        Convert it with to_whisper_audio() outside the voice thread.
+        """
+        with self.lock:
+            return self._read(self.start, self.written)
 
     def cleanup(self):
         """
         Release resources/reset state.
         """
-        self.buffer.clear()
+        self.utterances += 1
+        self.start = self.written
         self.is_speaking = False
-        self.silence_start_time = None
+        self.speech_started = None
+        self.last_voice_time = None
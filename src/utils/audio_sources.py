@@ -0,0 +1,314 @@
+import threading
+import logging
+import struct
+from collections import deque
+from math import gcd
+import numpy as np
+from scipy.signal import resample_poly
+import discord
+
+logger = logging.getLogger(__name__)
+
+# 20ms of 48kHz stereo 16-bit PCM
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+# Opus packet for one frame of silence
+OPUS_SILENCE = discord.opus.OPUS_SILENCE
+
+# Mouth shapes of the envelope (Japanese vowels), one byte per frame
+MOUTH_CLOSED, MOUTH_A, MOUTH_I, MOUTH_U, MOUTH_E, MOUTH_O = range(6)
+
+
+class EncodedSpeech:
+    __slots__ = ("packets", "envelope")
+
+    def __init__(self, packets, envelope=None):
+        """
+        One synthesized sentence, ready to play.
+        :param packets: 20ms Opus packets
+        :param envelope: Per packet, level (0-255) and mouth shape: 2 bytes each
+        """
+        self.packets = packets
+        self.envelope = envelope if envelope is not None else bytes(2 * len(packets))
+
+    def __len__(self):
+        return len(self.packets)
+
+
+class SegmentQueueSource(discord.AudioSource):
+    def __init__(self, envelope=None):
+        """
+        One continuous Opus AudioSource that plays queued segments back to back.
+        A segment is a list of pre-encoded 20ms Opus packets, so the player
+        thread only hands packets over (no PCM encoding at playback time).
+        Segments are pushed from the event loop while the audio thread reads.
+        Plays silence while the next segment is not ready yet, and ends once
+        finish() was called and every segment has been played.
+        :param envelope: Optional EnvelopeStream; gets the level/mouth shape of
+                         every frame as it is handed to the player
+        """
+        self._lock = threading.Lock()
+        self._segments = deque()
+        self._current = None
+        self._current_envelope = None
+        self._pos = 0
+        self.envelope = envelope
+        self._finished = False
+        # Fade-out state (barge-in): frames left / total, codec created on demand
+        self._fade_left = None
+        self._fade_total = 0
+        self._fade_decoder = None
+        self._fade_encoder = None
+
+    def push(self, frames):
+        """
+        Queue a segment (EncodedSpeech or list of Opus packets) to be played after the current ones.
+        """
+        with self._lock:
+            if self._finished or not frames:
+                return
+            if not isinstance(frames, EncodedSpeech):
+                frames = EncodedSpeech(frames)
+            self._segments.append(frames)
+
+    def finish(self):
+        """
+        No more segments will be pushed; end playback after the queue drains.
+        """
+        with self._lock:
+            self._finished = True
+
+    def fade_out(self, duration=0.2):
+        """
+        Fade the current segment out over `duration` seconds and end playback,
+        dropping every queued segment.
+        """
+        with self._lock:
+            self._segments.clear()
+            self._finished = True
+            if self._fade_left is None:
+                self._fade_total = max(1, int(duration * 1000 / 20))
+                self._fade_left = self._fade_total
+
+    def read(self) -> bytes:
+        with self._lock:
+            if self._fade_left is not None:
+                return self._read_fading()
+            packet = self._next_packet()
+            if self.envelope is not None and self.envelope.active and packet:
+                self._emit_envelope(1.0)
+            return packet
+
+    def _next_packet(self) -> bytes:
+        while True:
+            if self._current is None:
+                if self._segments:
+                    segment = self._segments.popleft()
+                    self._current = segment.packets
+                    self._current_envelope = segment.envelope
+                    self._pos = 0
+                elif self._finished:
+                    return b""
+                else:
+                    # Next sentence is still being synthesized
+                    return OPUS_SILENCE
+
+            if self._pos < len(self._current):
+                packet = self._current[self._pos]
+                self._pos += 1
+                return packet
+
+            # Segment exhausted
+            self._current = None
+            self._current_envelope = None
+
+    def _emit_envelope(self, gain):
+        # Precomputed at encode time: just two bytes to look up and one struct to pack
+        if self._current is None:
+            self.envelope.push(0, MOUTH_CLOSED)
+            return
+        i = 2 * (self._pos - 1)
+        self.envelope.push(int(self._current_envelope[i] * gain), self._current_envelope[i + 1])
+
+    def _read_fading(self) -> bytes:
+        # Decode, ramp the gain down, re-encode (only for the few frames of the fade)
+        if self._fade_left <= 0 or self._current is None:
+            return b""
+        packet = self._next_packet()
+        if not packet:
+            return b""
+
+        if self._fade_decoder is None:
+            self._fade_decoder = discord.opus.Decoder()
+            self._fade_encoder = discord.opus.Encoder()
+        pcm = self._fade_decoder.decode(packet)
+        samples = np.frombuffer(pcm, dtype="<i2").reshape(-1, 2).astype(np.float32)
+
+        start = self._fade_left / self._fade_total
+        end = (self._fade_left - 1) / self._fade_total
+        samples *= np.linspace(start, end, len(samples), dtype=np.float32)[:, None]
+        self._fade_left -= 1
+        if self.envelope is not None and self.envelope.active:
+            self._emit_envelope(end)
+
+        faded = samples.astype("<i2").tobytes()
+        if len(faded) != FRAME_SIZE:
+            faded = faded[:FRAME_SIZE].ljust(FRAME_SIZE, b"\x00")
+        return self._fade_encoder.encode(faded, SAMPLES_PER_FRAME)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        with self._lock:
+            self._segments.clear()
+            self._current = None
+            self._current_envelope = None
+            self._finished = True
+
+
+def encode_opus(pcm: bytes) -> list:
+    """
+    Encode 48kHz stereo 16-bit PCM into a list of 20ms Opus packets.
+    The last partial frame is padded with silence.
+    """
+    remainder = len(pcm) % FRAME_SIZE
+    if remainder:
+        pcm = pcm + b"\x00" * (FRAME_SIZE - remainder)
+
+    encoder = discord.opus.Encoder()
+    view = memoryview(pcm)
+    return [
+        encoder.encode(view[pos:pos + FRAME_SIZE].tobytes(), SAMPLES_PER_FRAME)
+        for pos in range(0, len(pcm), FRAME_SIZE)
+    ]
+
+
+def frame_envelope(pcm: bytes) -> bytes:
+    """
+    Level and mouth shape of every 20ms frame of 48kHz stereo 16-bit PCM
+    (2 bytes per frame, same framing as encode_opus). Vectorized over all frames.
+    Level: RMS mapped from -60..0 dBFS to 0..255.
+    Mouth: spectral-centroid bands as a rough vowel estimate (u < o < a < e < i).
+    """
+    remainder = len(pcm) % FRAME_SIZE
+    if remainder:
+        pcm = pcm + b"\x00" * (FRAME_SIZE - remainder)
+    if not pcm:
+        return b""
+
+    mono = np.frombuffer(pcm, dtype="<i2").reshape(-1, SAMPLES_PER_FRAME, 2).mean(axis=2, dtype=np.float32) / 32768.0
+
+    rms = np.sqrt(np.mean(mono * mono, axis=1))
+    db = 20.0 * np.log10(rms + 1e-9)
+    level = np.clip((db + 60.0) / 60.0 * 255.0, 0, 255).astype(np.uint8)
+
+    spectrum = np.abs(np.fft.rfft(mono * np.hanning(SAMPLES_PER_FRAME).astype(np.float32), axis=1))
+    freqs = np.fft.rfftfreq(SAMPLES_PER_FRAME, 1.0 / 48000)
+    centroid = (spectrum * freqs).sum(axis=1) / (spectrum.sum(axis=1) + 1e-9)
+    mouth = np.select(
+        [level < 40, centroid < 700, centroid < 1000, centroid < 1600, centroid < 2300],
+        [MOUTH_CLOSED, MOUTH_U, MOUTH_O, MOUTH_A, MOUTH_E],
+        default=MOUTH_I
+    ).astype(np.uint8)
+
+    return np.stack([level, mouth], axis=1).tobytes()
+
+
+def encode_speech(pcm: bytes) -> EncodedSpeech:
+    """
+    Opus packets plus the per-frame envelope of 48kHz stereo 16-bit PCM.
+    """
+    return EncodedSpeech(encode_opus(pcm), frame_envelope(pcm))
+
+
+def wav_to_opus(wav_bytes: bytes) -> EncodedSpeech:
+    """
+    Decode a WAV (e.g. an SBV2 response) straight into Opus packets
+    (with their envelope), in memory.
+    """
+    return encode_speech(wav_to_pcm48k(wav_bytes))
+
+
+def wav_to_pcm48k(wav_bytes: bytes) -> bytes:
+    """
+    Decode a PCM WAV (8/16/32-bit int or 32-bit float) and convert it to
+    48kHz stereo 16-bit PCM, which is what discord.py expects.
+    """
+    samples, rate, channels = _parse_wav(wav_bytes)
+
+    if samples.size == 0:
+        return b""
+
+    # (frames, channels) float32 in [-1, 1]
+    samples = samples.reshape(-1, channels)
+    if channels == 1:
+        samples = np.repeat(samples, 2, axis=1)
+    elif channels > 2:
+        samples = samples[:, :2]
+
+    if rate != 48000:
+        g = gcd(48000, rate)
+        samples = resample_poly(samples, 48000 // g, rate // g, axis=0)
+
+    samples = np.clip(samples * 32767.0, -32768, 32767).astype("<i2")
+    return samples.tobytes()
+
+
+def _parse_wav(wav_bytes: bytes):
+    """
+    Minimal RIFF/WAVE parser.
+    Returns (float32 samples interleaved, sample_rate, channels).
+    """
+    if len(wav_bytes) < 12 or wav_bytes[:4] != b"RIFF" or wav_bytes[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+
+    fmt = None
+    data = None
+    pos = 12
+    while pos + 8 <= len(wav_bytes):
+        chunk_id = wav_bytes[pos:pos + 4]
+        chunk_size = struct.unpack_from("<I", wav_bytes, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", wav_bytes, body)
+        elif chunk_id == b"data":
+            # Some servers write 0 or a bogus size for streamed WAVs
+            end = body + chunk_size if chunk_size else len(wav_bytes)
+            data = memoryview(wav_bytes)[body:min(end, len(wav_bytes))]
+            break
+        # Chunks are padded to an even size
+        pos = body + chunk_size + (chunk_size & 1)
+
+    if fmt is None or data is None:
+        raise ValueError("WAV is missing fmt or data chunk")
+
+    format_tag, channels, rate, _, block_align, bits = fmt
+    # WAVE_FORMAT_EXTENSIBLE carries the real format in the sub-format GUID;
+    # treat it like PCM/float depending on the bit depth.
+    if format_tag == 0xFFFE:
+        format_tag = 3 if bits == 32 and _is_float_extensible(wav_bytes) else 1
+
+    usable = len(data) - len(data) % block_align
+    data = data[:usable]
+
+    if format_tag == 3 and bits == 32:
+        samples = np.frombuffer(data, dtype="<f4").astype(np.float32)
+    elif format_tag == 1 and bits == 16:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif format_tag == 1 and bits == 32:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    elif format_tag == 1 and bits == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    else:
+        raise ValueError(f"Unsupported WAV format (tag={format_tag}, bits={bits})")
+
+    return samples, rate, channels
+
+
+def _is_float_extensible(wav_bytes: bytes) -> bool:
+    # KSDATAFORMAT_SUBTYPE_IEEE_FLOAT starts with 0x0003
+    idx = wav_bytes.find(b"fmt ")
+    if idx < 0:
+        return False
+    return struct.unpack_from("<H", wav_bytes, idx + 8 + 24)[0] == 3
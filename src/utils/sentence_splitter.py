@@ -0,0 +1,105 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Characters that end a sentence (full-width and ASCII) plus newlines
+SENTENCE_DELIMITERS = "。！？!?\n"
+# Characters that may trail a delimiter and still belong to the same sentence
+# e.g. 「おはよう！」 or 「えっ！？」
+SENTENCE_CLOSERS = "」』）)】〉》\"'…〜~"
+
+
+class SentenceSplitter:
+    def __init__(self, delimiters=SENTENCE_DELIMITERS, closers=SENTENCE_CLOSERS):
+        """
+        Incrementally groups streamed tokens into complete sentences.
+        :param delimiters: Characters that end a sentence
+        :param closers: Characters that are kept with the preceding sentence
+        """
+        self.delimiters = delimiters
+        self.closers = closers
+        self.buffer = ""
+
+    def feed(self, token: str) -> list:
+        """
+        Add a token to the buffer.
+        Returns a list of sentences completed by this token (may be empty).
+        """
+        self.buffer += token
+        sentences = []
+
+        start = 0
+        i = 0
+        length = len(self.buffer)
+        while i < length:
+            if self.buffer[i] in self.delimiters:
+                # Absorb runs like "！？" or "。」" into the same sentence
+                end = i + 1
+                while end < length and (self.buffer[end] in self.delimiters or self.buffer[end] in self.closers):
+                    end += 1
+                sentence = self._clean(self.buffer[start:end])
+                if sentence:
+                    sentences.append(sentence)
+                start = end
+                i = end
+            else:
+                i += 1
+
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """
+        Return whatever is left in the buffer as a final sentence (or None).
+        """
+        sentence = self._clean(self.buffer)
+        self.buffer = ""
+        return sentence
+
+    def _clean(self, text: str):
+        # A closer left over from the previous sentence is not worth speaking
+        text = text.strip().lstrip(self.closers).strip()
+        # Skip fragments that are only punctuation ("…", "！")
+        if not any(ch.isalnum() for ch in text):
+            return None
+        return text
+
+
+def split_sentences(text: str) -> list:
+    """
+    Split a complete text into sentences.
+    """
+    splitter = SentenceSplitter()
+    sentences = splitter.feed(text)
+    last = splitter.flush()
+    if last:
+        sentences.append(last)
+    return sentences
+
+
+async def iter_sentences(tokens, text=None):
+    """
+    Group an async iterable of tokens into an async iterable of sentences.
+    :param text: Optional list every token is appended to. The sentences are cleaned up
+                 for TTS (no newlines, spacing or punctuation-only lines); "".join(text)
+                 is the reply as generated.
+    """
+    splitter = SentenceSplitter()
+    async for token in tokens:
+        if text is not None:
+            text.append(token)
+        for sentence in splitter.feed(token):
+            yield sentence
+
+    last = splitter.flush()
+    if last:
+        yield last
+
+
+async def iter_text_sentences(text: str):
+    """
+    Async iterable over the sentences of a complete text.
+    Lets fixed replies go through the same path as streamed ones.
+    """
+    for sentence in split_sentences(text):
+        yield sentence
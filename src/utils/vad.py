@@ -0,0 +1,130 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of the silence counter ("no speech heard recently")
+_SILENCE_CAP = 1_000_000
+
+
+class VADState:
+    def __init__(self, initial_floor_db=-60.0):
+        """
+        Per-speaker VAD state.
+        :param initial_floor_db: Starting noise floor estimate (dBFS)
+        """
+        self.noise_floor = initial_floor_db
+        self.speaking = False
+        self.onset_count = 0  # Consecutive speech-like frames before onset
+        self.hangover = 0  # Frames left before a speech segment is closed
+        self.silence_frames = _SILENCE_CAP  # Non-speech frames since the last speech frame
+        self.pause_ema = None  # Typical pause inside this speaker's utterances (frames)
+
+
+class VoiceActivityDetector:
+    def __init__(self, rate=48000, frame_ms=20, on_margin_db=12.0, off_margin_db=6.0,
+                 strong_margin_db=24.0, zcr_max=0.25, onset_frames=2, hangover_frames=8,
+                 floor_alpha_down=0.2, floor_alpha_up=0.02, floor_alpha_speech=0.001,
+                 min_floor_db=-75.0, eos_factor=2.5, min_eos=0.4, max_eos=1.0):
+        """
+        Energy + zero-crossing-rate VAD with an adaptive per-speaker noise floor,
+        onset/offset hysteresis and hangover.
+        :param rate: Sample rate of the mono frames
+        :param frame_ms: Frame length in milliseconds
+        :param on_margin_db: Energy above the noise floor needed to start speech
+        :param off_margin_db: Energy above the noise floor needed to stay in speech
+        :param strong_margin_db: Above this, speech is assumed whatever the ZCR is
+        :param zcr_max: Max zero-crossing rate of a speech frame (noise/hiss is higher)
+        :param onset_frames: Consecutive speech-like frames needed for onset (ignores clicks)
+        :param hangover_frames: Non-speech frames still counted as speech after a segment
+        :param floor_alpha_down/up/speech: Noise floor adaptation rates
+        :param min_floor_db: Lower bound of the noise floor (digital silence)
+        :param eos_factor: End-of-speech timeout as a multiple of the speaker's typical pause
+        :param min_eos/max_eos: Bounds (seconds) of the end-of-speech timeout
+        """
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_samples = rate * frame_ms // 1000
+        self.on_margin_db = on_margin_db
+        self.off_margin_db = off_margin_db
+        self.strong_margin_db = strong_margin_db
+        self.zcr_max = zcr_max
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+        self.floor_alpha_down = floor_alpha_down
+        self.floor_alpha_up = floor_alpha_up
+        self.floor_alpha_speech = floor_alpha_speech
+        self.min_floor_db = min_floor_db
+        self.eos_factor = eos_factor
+        self.min_eos = min_eos
+        self.max_eos = max_eos
+
+    def new_state(self):
+        return VADState()
+
+    def features(self, frames):
+        """
+        Frame energy (dBFS) and zero-crossing rate, vectorized over the samples.
+        :param frames: int16 or float array (..., samples)
+        :return: (energy_db, zcr), each shaped like frames without the last axis
+        """
+        x = np.asarray(frames, dtype=np.float32)
+        if np.issubdtype(np.asarray(frames).dtype, np.integer):
+            x = x / 32768.0
+
+        power = np.mean(x * x, axis=-1)
+        energy_db = 10.0 * np.log10(power + 1e-10)
+
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[..., 1:] != signs[..., :-1], axis=-1) / max(x.shape[-1] - 1, 1)
+        return energy_db, zcr
+
+    def process_frame(self, frame, state) -> bool:
+        """
+        Run the VAD on one mono frame of one speaker.
+        :param frame: int16 or float mono samples
+        :param state: The speaker's VADState (updated in place)
+        :return: True if the frame is speech (hangover included)
+        """
+        energy_db, zcr = self.features(frame)
+        e = float(energy_db)
+        above = e - state.noise_floor
+
+        candidate = above > self.on_margin_db and (zcr < self.zcr_max or above > self.strong_margin_db)
+        sustain = state.speaking and above > self.off_margin_db
+        state.onset_count = state.onset_count + 1 if candidate else 0
+
+        voiced = sustain or state.onset_count >= self.onset_frames
+
+        if voiced:
+            # A pause inside an utterance just ended: learn this speaker's pause length
+            max_pause_frames = int(self.max_eos * 1000 / self.frame_ms)
+            if 0 < state.silence_frames <= max_pause_frames:
+                observed = float(state.silence_frames)
+                state.pause_ema = observed if state.pause_ema is None else 0.8 * state.pause_ema + 0.2 * observed
+            state.hangover = self.hangover_frames
+            state.silence_frames = 0
+        else:
+            state.hangover = max(state.hangover - 1, 0)
+            state.silence_frames = min(state.silence_frames + 1, _SILENCE_CAP)
+        state.speaking = voiced or (state.speaking and state.hangover > 0)
+
+        # Noise floor: track quickly downwards, slowly upwards, barely during speech
+        if state.speaking:
+            alpha = self.floor_alpha_speech
+        elif e < state.noise_floor:
+            alpha = self.floor_alpha_down
+        else:
+            alpha = self.floor_alpha_up
+        state.noise_floor = max(state.noise_floor + alpha * (e - state.noise_floor), self.min_floor_db)
+        return state.speaking
+
+    def end_of_speech_timeout(self, state) -> float:
+        """
+        Seconds of silence after which this speaker's utterance is considered over.
+        Speakers who pause briefly get a short timeout, slow speakers a longer one.
+        """
+        if state.pause_ema is None:
+            return self.max_eos
+        timeout = self.eos_factor * state.pause_ema * self.frame_ms / 1000.0
+        return float(min(max(timeout, self.min_eos), self.max_eos))
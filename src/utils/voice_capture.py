@@ -0,0 +1,83 @@
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# File layout: magic, then one record per received packet:
+#   timestamp (float64, unix seconds), user id (uint64), payload kind (uint8),
+#   payload length (uint16), payload (Opus packet or 20ms of 48kHz stereo s16le PCM)
+MAGIC = b"MVCAP1"
+RECORD = struct.Struct("<dQBH")
+KIND_PCM = 0
+KIND_OPUS = 1
+
+
+class VoiceCaptureWriter:
+    def __init__(self, path, payload="opus"):
+        """
+        Append-only log of received voice packets, for offline replay.
+        Written from the voice thread; the file is buffered, so a write is a memcpy.
+        :param path: Capture file (created, or appended to)
+        :param payload: "opus" (compact, decoded again on replay) or "pcm"
+        """
+        self.path = path
+        self.kind = KIND_PCM if payload == "pcm" else KIND_OPUS
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab", buffering=256 * 1024)
+        if new:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()  # close() comes from the event loop
+        self.packets = 0
+
+    def write(self, user_id, data, at=None):
+        """
+        Record one packet of a user.
+        :param data: VoiceData from voice_recv (.opus and .pcm)
+        """
+        kind = self.kind
+        payload = data.opus if kind == KIND_OPUS else data.pcm
+        if not payload:
+            # No Opus payload for this packet (e.g. generated silence): keep the PCM
+            kind, payload = KIND_PCM, data.pcm
+        if not payload:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(time.time() if at is None else at, user_id, kind, len(payload)))
+            self._file.write(payload)
+            self.packets += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """
+    Records of a capture file, in order: (timestamp, user_id, kind, payload).
+    A record torn by a crash at the end of the file is ignored.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a voice capture")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, user_id, kind, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                logger.warning(f"Ignoring torn record at the end of {path}")
+                return
+            yield timestamp, user_id, kind, payload
+
+
+def capture_path(directory, guild_id):
+    return os.path.join(directory, f"{guild_id}-{time.strftime('%Y%m%d-%H%M%S')}.mvcap")
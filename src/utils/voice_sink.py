@@ -0,0 +1,102 @@
+import logging
+import threading
+import discord
+from discord.ext import voice_recv
+
+logger = logging.getLogger(__name__)
+
+# Opus packets this small carry no audio: the 3-byte silence frame clients send
+# when they stop talking (voice_recv.rtp.OPUS_SILENCE) and DTX / comfort-noise updates
+SILENT_OPUS_MAX_BYTES = 3
+# 20ms of 48kHz stereo s16le silence, stands in for a gated frame where audio must stay contiguous
+SILENT_FRAME = bytes(discord.opus.Decoder.FRAME_SIZE)
+
+
+def is_silent_opus(payload) -> bool:
+    # Empty means lost (voice_recv's FakePacket has b"" as its data), not silent
+    return bool(payload) and len(payload) <= SILENT_OPUS_MAX_BYTES
+
+
+class OpusGate:
+    def __init__(self):
+        """
+        Per-user Opus decoders that only decode frames which may contain speech.
+        Used by SpeechGateSink and by the offline replay (bench/voice_replay.py).
+        """
+        self.decoders = {} # {user_id: discord.opus.Decoder}
+        self.lock = threading.Lock() # decode() runs in the voice thread, drop() in the event loop
+        self.decoded = 0
+        self.gated = 0 # Silent frames passed on without decoding
+        self.concealed = 0 # Lost packets filled in by the decoder (packet loss concealment)
+
+    def decode(self, user_id, payload):
+        """
+        :param payload: Opus packet, or b"" / None for a lost packet
+        :return: 20ms of 48kHz stereo s16le PCM, or b"" if the frame is silent
+        """
+        if is_silent_opus(payload):
+            self.gated += 1
+            return b""
+        with self.lock:
+            decoder = self.decoders.get(user_id)
+            if not payload:
+                # Conceal the gap only for someone we are already decoding
+                if decoder is None:
+                    self.gated += 1
+                    return b""
+                self.concealed += 1
+                return decoder.decode(None, fec=False)
+            if decoder is None:
+                decoder = self.decoders[user_id] = discord.opus.Decoder()
+            self.decoded += 1
+            return decoder.decode(payload, fec=False)
+
+    def drop(self, user_id):
+        with self.lock:
+            self.decoders.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.decoders.clear()
+
+
+class SpeechGateSink(voice_recv.AudioSink):
+    def __init__(self, callback, ignore=None):
+        """
+        Receives Opus instead of PCM, so voice_recv does not decode every packet of every member.
+        Ignored users are dropped before decoding and silent frames are passed on with empty .pcm,
+        so decoding scales with the number of people actually talking.
+        :param callback: Called as callback(user, data) with data.pcm set (b"" for silence)
+        :param ignore: Predicate(user) -> True to drop the user's packets (bots etc.)
+        """
+        super().__init__()
+        self.callback = callback
+        self.ignore = ignore
+        self.gate = OpusGate()
+        self.dropped = 0
+
+    def wants_opus(self) -> bool:
+        return True
+
+    def write(self, user, data):
+        if user is None or (self.ignore and self.ignore(user)):
+            self.dropped += 1
+            return
+        try:
+            data.pcm = self.gate.decode(user.id, data.opus)
+        except discord.opus.OpusError as e:
+            logger.warning(f"Failed to decode Opus from {user.id}: {e}")
+            return
+        self.callback(user, data)
+
+    @voice_recv.AudioSink.listener()
+    def on_voice_member_disconnect(self, member, ssrc):
+        if member is not None:
+            self.gate.drop(member.id)
+
+    def cleanup(self):
+        logger.info(
+            f"Voice gate: {self.gate.decoded} decoded, {self.gate.gated} silent, "
+            f"{self.gate.concealed} concealed, {self.dropped} ignored"
+        )
+        self.gate.clear()
@@ -1,6 +1,7 @@
 import sys
 import os
 import time
+import asyncio
 
 # Add the project root to sys.path
 sys.path.append(os.path.abspath("F:/aisisterprogram.1/aito"))
@@ -15,7 +16,7 @@ try:
     print(f"Generating audio for text: {text}")
     
     start_time = time.time()
-    audio_path = client.tts(text)
+    audio_path = asyncio.run(client.tts(text))
     end_time = time.time()
     
     if audio_path and os.path.exists(audio_path):
@@ -0,0 +1,117 @@
+import numpy as np
+from src.utils.audio_recorder import AudioRecorder, Decimator, DECIMATION_TAPS
+
+PACKET_FRAMES = 960  # 20ms at 48kHz
+rng = np.random.default_rng(0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def packet(amplitude=0.001, freq=None):
+    t = np.arange(PACKET_FRAMES) / 48000
+    if freq:
+        mono = amplitude * np.sin(2 * np.pi * freq * t)
+    else:
+        mono = rng.standard_normal(PACKET_FRAMES) * amplitude
+    mono = (mono * 32767).astype("<i2")
+    return np.repeat(mono, 2).tobytes()  # Interleaved stereo
+
+
+def feed(recorder, clock, packets):
+    flushed = []
+    for pcm in packets:
+        clock.now += 0.02
+        audio = recorder.write(pcm)
+        if audio is not None:
+            flushed.append(audio)
+    return flushed
+
+
+def test_decimator_blocks_match_whole_signal_filtering():
+    x = rng.standard_normal(48000).astype(np.float32)
+    expected = np.convolve(x, DECIMATION_TAPS)[:len(x)][::3]
+
+    decimator = Decimator()
+    out = []
+    i = 0
+    for size in [960, 1, 2, 961, 500, 7, 3]:
+        out.append(decimator.process(x[i:i + size]))
+        i += size
+    while i < len(x):
+        out.append(decimator.process(x[i:i + 960]))
+        i += 960
+    out = np.concatenate(out)
+
+    assert len(out) == len(expected)
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+
+
+def test_ring_reads_across_the_wrap():
+    recorder = AudioRecorder(1, clock=FakeClock())
+    capacity = len(recorder.ring)
+    recorder.written = recorder.start = capacity - 100
+    samples = (np.arange(300, dtype=np.float32) - 150) / 32768.0
+    recorder._append(samples)
+
+    assert recorder.buffered_samples == 300
+    np.testing.assert_array_equal(recorder.snapshot(), np.arange(300, dtype=np.int16) - 150)
+
+
+def test_only_pre_roll_is_kept_between_utterances():
+    clock = FakeClock()
+    recorder = AudioRecorder(1, clock=clock)
+    # Longer than the ring: silence must not grow the buffer or wrap into itself
+    assert feed(recorder, clock, [packet() for _ in range(1500)]) == []
+    assert not recorder.is_speaking
+    assert recorder.written > len(recorder.ring)
+    assert recorder.buffered_samples == recorder.pre_roll_samples + PACKET_FRAMES // 3
+
+
+def test_utterance_is_flushed_as_float32_16khz_with_pre_roll():
+    clock = FakeClock()
+    recorder = AudioRecorder(1, clock=clock)
+    feed(recorder, clock, [packet() for _ in range(50)])
+    assert feed(recorder, clock, [packet(0.3, freq=220) for _ in range(75)]) == []
+    assert recorder.is_speaking
+    deadline = recorder.end_of_speech_deadline()
+
+    assert feed(recorder, clock, [packet() for _ in range(5)]) == []
+    clock.now = deadline
+    audio = recorder.poll()
+
+    assert audio.dtype == np.float32
+    # Onset is detected on the second voiced packet; 0.3s from before it is kept
+    voiced_since_onset = 74 + 5
+    assert len(audio) == recorder.pre_roll_samples + voiced_since_onset * PACKET_FRAMES // 3
+    assert np.abs(audio).max() <= 1.0
+    lead = audio[:recorder.pre_roll_samples - PACKET_FRAMES // 3]
+    assert np.sqrt(np.mean(lead ** 2)) < 0.01  # Pre-roll is the quiet lead-in
+    assert np.sqrt(np.mean(audio[recorder.pre_roll_samples:] ** 2)) > 0.1
+    assert recorder.utterances == 1
+    assert recorder.buffered_samples == 0
+    assert recorder.poll() is None
+
+
+def test_short_blip_is_discarded():
+    clock = FakeClock()
+    recorder = AudioRecorder(1, clock=clock)
+    feed(recorder, clock, [packet() for _ in range(50)] + [packet(0.3, freq=220) for _ in range(10)])
+    clock.now = recorder.end_of_speech_deadline()
+    assert recorder.poll() is None
+    assert recorder.utterances == 1
+    assert not recorder.is_speaking
+
+
+def test_long_speech_is_flushed_at_max_duration():
+    clock = FakeClock()
+    recorder = AudioRecorder(1, clock=clock)
+    feed(recorder, clock, [packet() for _ in range(50)])
+    flushed = feed(recorder, clock, [packet(0.3, freq=220) for _ in range(1100)])
+    assert len(flushed) == 1
+    assert recorder.MAX_DURATION * 16000 < len(flushed[0]) <= len(recorder.ring)
@@ -0,0 +1,113 @@
+import asyncio
+from src.services import conversation
+from src.services.conversation import ConversationSession, ConversationStore, estimate_tokens
+
+
+async def _no_summary(summary, turns):
+    return summary
+
+
+def _store(**kwargs):
+    options = dict(token_budget=10_000, window_turns=10, max_sessions=10, idle_ttl=3600)
+    options.update(kwargs)
+    return ConversationStore(_no_summary, **options)
+
+
+def test_token_estimate_counts_japanese_per_character():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("こんにちは") == 5 + 4
+    assert estimate_tokens("hello world!") == 3 + 4
+
+
+def test_window_keeps_recent_turns_and_queues_the_rest():
+    session = ConversationSession((1, 1))
+    for i in range(5):
+        session.add_turn(f"q{i}", f"a{i}", window_turns=3, token_budget=10_000)
+    assert list(session.turns) == [("q2", "a2"), ("q3", "a3"), ("q4", "a4")]
+    assert session.pending == [("q0", "a0"), ("q1", "a1")]
+
+
+def test_long_turns_are_pushed_out_by_the_token_budget():
+    session = ConversationSession((1, 1))
+    long_text = "あ" * 100  # 104 tokens
+    for i in range(3):
+        session.add_turn(long_text, long_text, window_turns=10, token_budget=600)
+    # Turns get half of the budget: only one 208-token turn fits in 300
+    assert len(session.turns) == 1
+    assert len(session.pending) == 2
+    # The newest turn is kept even if it alone is over the budget
+    session.add_turn("い" * 1000, "う", window_turns=10, token_budget=600)
+    assert list(session.turns) == [("い" * 1000, "う")]
+
+
+def test_messages_include_newest_turns_within_budget():
+    session = ConversationSession((1, 1))
+    session.summary = "要約"
+    for i in range(4):
+        session.turns.append((f"q{i}", f"a{i}"))
+    system = "sys"
+    # system (5) + summary (~16) + prompt (5) leave room for two turns (10 each)
+    budget = estimate_tokens(system) + estimate_tokens("これまでの会話の要約:\n要約") + estimate_tokens("now") + 20
+    messages = session.messages(system, "now", budget)
+    assert [m["content"] for m in messages] == ["sys", "これまでの会話の要約:\n要約", "q2", "a2", "q3", "a3", "now"]
+    assert [m["role"] for m in messages[2:]] == ["user", "assistant", "user", "assistant", "user"]
+
+
+def test_sessions_are_per_guild_and_user_with_lru_eviction():
+    store = _store(max_sessions=2)
+    a = store.get(1, 10)
+    assert store.get(2, 10) is not a
+    assert store.get(1, 10) is a  # Now most recently used
+    store.get(1, 11)
+    assert set(store.sessions) == {(1, 10), (1, 11)}
+
+
+def test_idle_sessions_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversation.time, "monotonic", lambda: now[0])
+    store = _store(idle_ttl=60)
+    old = store.get(1, 10)
+    now[0] += 30
+    store.get(1, 11)
+    now[0] += 40
+    assert store.get(1, 11) is not None
+    assert set(store.sessions) == {(1, 11)}
+    assert store.get(1, 10) is not old
+
+
+def test_clear_by_guild_or_user():
+    store = _store()
+    for key in [(1, 10), (1, 11), (2, 10)]:
+        store.get(*key)
+    store.clear(user_id=10)
+    assert set(store.sessions) == {(1, 11)}
+    store.clear()
+    assert not store.sessions
+
+
+def test_failed_summary_keeps_the_turns_for_the_next_fold():
+    calls = []
+
+    async def summarize(summary, turns):
+        calls.append(list(turns))
+        if len(calls) == 1:
+            raise RuntimeError("ollama is down")
+        return f"{len(turns)} turns"
+
+    async def run():
+        store = ConversationStore(summarize, token_budget=10_000, window_turns=2, max_sessions=10, idle_ttl=3600)
+        session = store.get(1, 1)
+        for i in range(3):
+            store.add_turn(session, f"q{i}", f"a{i}")
+        await session.summary_task
+        assert session.pending == [("q0", "a0")]
+        assert session.summary == ""
+
+        store.add_turn(session, "q3", "a3")
+        await session.summary_task
+        return session, calls
+
+    session, calls = asyncio.run(run())
+    assert calls == [[("q0", "a0")], [("q0", "a0"), ("q1", "a1")]]
+    assert session.pending == []
+    assert session.summary == "2 turns"
@@ -0,0 +1,163 @@
+import asyncio
+import numpy as np
+from src.services.envelope_stream import EnvelopeStream, HEADER, FRAME, VERSION, KIND_ENVELOPE, CHANNEL
+from src.services.speech_pipeline import SpeechPipeline
+from src.utils.audio_sources import (
+    EncodedSpeech, SegmentQueueSource, frame_envelope, FRAME_SIZE, SAMPLES_PER_FRAME,
+    MOUTH_CLOSED, MOUTH_U, MOUTH_A, MOUTH_I
+)
+
+
+class FakeServer:
+    def __init__(self, subscribed=True):
+        self.subscribed = subscribed
+        self.binary = []
+        self.messages = []
+
+    def has_subscribers(self, channel):
+        return self.subscribed and channel == CHANNEL
+
+    def broadcast_binary_nowait(self, data, channel):
+        self.binary.append(data)
+
+    async def broadcast(self, message):
+        self.messages.append(message)
+
+
+def unpack(message):
+    version, kind, count, guild_id = HEADER.unpack_from(message)
+    frames = [FRAME.unpack_from(message, HEADER.size + i * FRAME.size) for i in range(count)]
+    assert len(message) == HEADER.size + count * FRAME.size
+    return version, kind, guild_id, [(level, mouth) for _, level, mouth in frames]
+
+
+def tone(freq, frames=3, amplitude=0.5):
+    t = np.arange(frames * SAMPLES_PER_FRAME) / 48000
+    mono = (amplitude * np.sin(2 * np.pi * freq * t) * 32767).astype("<i2")
+    return np.repeat(mono, 2).tobytes()
+
+
+def test_frames_are_batched_into_one_binary_message():
+    async def run():
+        server = FakeServer()
+        stream = EnvelopeStream(server, guild_id=1234, interval=60)
+        owner = object()
+        stream.start(owner)
+        stream.push(200, MOUTH_A)
+        stream.push(100, MOUTH_I)
+        stream.flush()
+        stream.flush()  # Nothing new: nothing sent
+        stream.stop(owner)
+        return server.binary, stream
+
+    binary, stream = asyncio.run(run())
+    assert [unpack(message) for message in binary] == [
+        (VERSION, KIND_ENVELOPE, 1234, [(200, MOUTH_A), (100, MOUTH_I)]),
+        # Stopping closes the mouth
+        (VERSION, KIND_ENVELOPE, 1234, [(0, MOUTH_CLOSED)]),
+    ]
+    assert not stream.active
+
+
+def test_nothing_is_sent_without_subscribers_and_only_the_owner_stops():
+    async def run():
+        server = FakeServer(subscribed=False)
+        stream = EnvelopeStream(server, guild_id=1, interval=60)
+        old, new = object(), object()
+        stream.start(old)
+        stream.start(new)  # A newer reply took over
+        stream.push(10, MOUTH_A)
+        stream.stop(old)
+        still_running = stream._task is not None
+        stream.stop(new)
+        return server.binary, still_running, stream
+
+    binary, still_running, stream = asyncio.run(run())
+    assert binary == []
+    assert still_running
+    assert stream._task is None
+    assert not stream.frames
+
+
+def test_frame_envelope_levels_and_mouth_shapes():
+    envelope = frame_envelope(bytes(FRAME_SIZE * 2) + tone(300) + tone(1200) + tone(3000))
+    pairs = list(zip(envelope[0::2], envelope[1::2]))
+    assert len(pairs) == 11
+    assert pairs[:2] == [(0, MOUTH_CLOSED)] * 2
+    assert all(level > 200 for level, _ in pairs[2:])
+    assert [mouth for _, mouth in pairs[2:5]] == [MOUTH_U] * 3
+    assert [mouth for _, mouth in pairs[5:8]] == [MOUTH_A] * 3
+    assert [mouth for _, mouth in pairs[8:]] == [MOUTH_I] * 3
+    # A partial last frame is padded like the Opus encoder pads it
+    assert len(frame_envelope(bytes(FRAME_SIZE + 10))) == 4
+    assert frame_envelope(b"") == b""
+
+
+def test_source_emits_the_envelope_of_each_packet_played():
+    class Recorder:
+        active = True
+
+        def __init__(self):
+            self.pushed = []
+
+        def push(self, level, mouth):
+            self.pushed.append((level, mouth))
+
+    envelope = Recorder()
+    source = SegmentQueueSource(envelope=envelope)
+    source.push(EncodedSpeech([b"a", b"b"], bytes([10, MOUTH_A, 20, MOUTH_I])))
+    source.push(EncodedSpeech([b"c"]))
+    source.finish()
+    assert [source.read() for _ in range(4)] == [b"a", b"b", b"c", b""]
+    assert envelope.pushed == [(10, MOUTH_A), (20, MOUTH_I), (0, MOUTH_CLOSED)]
+
+
+def test_cancelled_reply_closes_the_mouth_and_releases_the_audio():
+    class VoiceClient:
+        def __init__(self):
+            self.source = None
+
+        def is_playing(self):
+            return self.source is not None
+
+        def play(self, source, after=None):
+            self.source = source
+
+        def stop(self):
+            self.source = None
+
+    class Guild:
+        id = 99
+        voice_client = VoiceClient()
+
+    async def run():
+        server = FakeServer()
+        pipeline = SpeechPipeline(Guild(), sbv2_client=None, ws_server=server)
+
+        async def synthesize(sentence):
+            return EncodedSpeech([b"x"], bytes([128, MOUTH_A]))
+
+        pipeline.synthesize = synthesize
+        more = asyncio.Event()
+
+        async def sentences():
+            yield "こんにちは。"
+            await more.wait()  # The LLM is still generating when the user barges in
+            yield "unreachable"
+
+        turn = asyncio.create_task(pipeline.speak(sentences()))
+        while Guild.voice_client.source is None:
+            await asyncio.sleep(0)
+        assert pipeline.envelope._task is not None
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            pass
+        return server, pipeline
+
+    server, pipeline = asyncio.run(run())
+    assert pipeline.audio is None
+    assert pipeline.envelope._task is None
+    assert unpack(server.binary[-1])[3] == [(0, MOUTH_CLOSED)]
+    assert server.messages == [{"type": "speaking", "text": "こんにちは。", "source": "voice_chat"}]
@@ -0,0 +1,87 @@
+import asyncio
+import socket
+import aiohttp
+import pytest
+from aiohttp import web
+from src.services.http_pool import BackendPool
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_busy_statuses_are_retried():
+    async def run():
+        calls = []
+
+        async def handler(request):
+            calls.append(request.path)
+            return web.Response(status=503 if len(calls) < 3 else 200, text="ok")
+
+        runner, url = await _serve(handler)
+        pool = BackendPool("test", url, retries=3, backoff=0.01)
+        try:
+            async with pool.request("POST", "/api/chat", json={}) as resp:
+                return resp.status, await resp.text(), len(calls)
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == (200, "ok", 3)
+
+
+def test_read_timeout_is_not_resent():
+    async def run():
+        calls = []
+
+        async def handler(request):
+            calls.append(request.path)
+            await asyncio.sleep(1)
+            return web.Response(text="late")
+
+        runner, url = await _serve(handler)
+        pool = BackendPool("test", url, read_timeout=0.1, retries=3, backoff=0.01)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                async with pool.request("POST", "/api/generate", json={}):
+                    pass
+            return len(calls)
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == 1
+
+
+def test_refused_connections_are_retried_then_raised(monkeypatch):
+    async def run():
+        pool = BackendPool("test", f"http://127.0.0.1:{_free_port()}", retries=2, backoff=0.01)
+        sleeps = []
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay):
+            sleeps.append(delay)
+            await real_sleep(0)
+
+        monkeypatch.setattr(asyncio, "sleep", sleep)
+        try:
+            with pytest.raises(aiohttp.ClientConnectorError):
+                async with pool.request("POST", "/api/chat", json={}):
+                    pass
+        finally:
+            await pool.close()
+        return sleeps
+
+    assert asyncio.run(run()) == [0.01, 0.02]
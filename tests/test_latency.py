@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from src.services import latency
+from src.services.latency import LatencyMetrics, TurnTrace, METRIC, percentile
+
+
+def _samples(text, name):
+    lines = [line for line in text.splitlines() if line.startswith(f"{METRIC}_{name}")]
+    return {line.split("{", 1)[1].split("}", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in lines}
+
+
+def test_render_writes_cumulative_prometheus_buckets():
+    metrics = LatencyMetrics()
+    for seconds in (0.005, 0.01, 0.2, 0.2, 45.0):
+        metrics.observe("stt_decode", seconds, guild=1, backend="whisper")
+    metrics.observe("stt_decode", -1.0, guild=1, backend="whisper")  # Clock skew: ignored
+    metrics.observe("stt_decode", None, guild=1, backend="whisper")
+
+    text = metrics.render()
+    assert text.startswith(f"# HELP {METRIC} ")
+    assert f"# TYPE {METRIC} histogram" in text
+    labels = 'stage="stt_decode",guild="1",backend="whisper"'
+    buckets = _samples(text, "bucket")
+    assert buckets[f'{labels},le="0.01"'] == 2  # Bounds are inclusive
+    assert buckets[f'{labels},le="0.1"'] == 2
+    assert buckets[f'{labels},le="0.25"'] == 4
+    assert buckets[f'{labels},le="30.0"'] == 4
+    assert buckets[f'{labels},le="+Inf"'] == 5
+    counts = [value for key, value in buckets.items() if key.startswith(labels)]
+    assert counts == sorted(counts)
+    assert _samples(text, "count")[labels] == 5
+    assert _samples(text, "sum")[labels] == pytest.approx(45.415)
+
+
+def test_series_are_kept_per_stage_guild_and_backend():
+    metrics = LatencyMetrics()
+    metrics.observe("tts_total", 0.3, guild=1, backend="sbv2")
+    metrics.observe("tts_total", 0.3, guild=2, backend="sbv2")
+    metrics.observe("llm_total", 1.0, backend="ollama")
+    counts = _samples(metrics.render(), "count")
+    assert set(counts) == {
+        'stage="llm_total",guild="",backend="ollama"',
+        'stage="tts_total",guild="1",backend="sbv2"',
+        'stage="tts_total",guild="2",backend="sbv2"',
+    }
+    metrics.reset()
+    assert _samples(metrics.render(), "count") == {}
+
+
+def test_summary_is_in_pipeline_order_and_filters_by_guild():
+    metrics = LatencyMetrics()
+    for i in range(1, 11):
+        metrics.observe("playback", i / 10, guild=1)
+        metrics.observe("endpointing", i / 100, guild=1, backend="vad")
+    metrics.observe("endpointing", 5.0, guild=2, backend="vad")
+
+    summary = metrics.summary(guild=1)
+    assert list(summary) == ["endpointing", "playback"]
+    assert summary["playback"] == {
+        "count": 10,
+        "p50": pytest.approx(np.percentile(np.arange(1, 11) / 10, 50)),
+        "p95": pytest.approx(np.percentile(np.arange(1, 11) / 10, 95)),
+    }
+    assert metrics.summary()["endpointing"]["count"] == 11
+
+
+def test_percentile_interpolates_like_numpy():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([3.0], 0.95) == 3.0
+    values = sorted(np.random.default_rng(0).random(37))
+    for q in (0.0, 0.5, 0.9, 0.95, 1.0):
+        assert percentile(values, q) == pytest.approx(np.percentile(values, q * 100))
+
+
+def test_trace_marks_feed_the_stage_histograms(monkeypatch):
+    metrics = LatencyMetrics()
+    monkeypatch.setattr(latency, "get_metrics", lambda: metrics)
+    trace = TurnTrace(guild_id=7, user_id=1)
+    trace.mark("last_voice", 100.0)
+    trace.mark("speech_end", 100.4)
+    trace.mark("speech_end", 101.0)  # The first mark counts
+    trace.mark("playback_start", 101.2)
+    trace.observe("endpointing", "last_voice", "speech_end", backend="vad")
+    trace.observe("response", "speech_end", "missing")  # Incomplete span: nothing recorded
+
+    assert trace.span("last_voice", "playback_start") == pytest.approx(1.2)
+    assert trace.describe() == "last_voice=+0ms speech_end=+400ms playback_start=+1200ms"
+    assert list(metrics.histograms) == [("endpointing", "7", "vad")]
+    assert metrics.histograms[("endpointing", "7", "vad")].total == pytest.approx(0.4)
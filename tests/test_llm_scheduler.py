@@ -0,0 +1,104 @@
+import asyncio
+from src.services.llm_scheduler import LLMScheduler, VOICE, TEXT, BACKGROUND
+
+
+async def _use(scheduler, order, label, priority, user_key=None):
+    async with scheduler.slot(priority, user_key):
+        order.append(label)
+        await asyncio.sleep(0)
+
+
+def _queue_behind_busy_slot(scheduler, requests):
+    async def run():
+        order = []
+        hold = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(TEXT, "holder"):
+                await hold.wait()
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        tasks = []
+        for label, priority, user_key in requests:
+            tasks.append(asyncio.create_task(_use(scheduler, order, label, priority, user_key)))
+            await asyncio.sleep(0)
+        hold.set()
+        await asyncio.gather(holding, *tasks)
+        return order
+
+    return asyncio.run(run())
+
+
+def test_higher_priorities_are_served_first():
+    scheduler = LLMScheduler("test", max_concurrency=1)
+    order = _queue_behind_busy_slot(scheduler, [
+        ("background", BACKGROUND, "a"),
+        ("text", TEXT, "a"),
+        ("voice", VOICE, "a"),
+    ])
+    assert order == ["voice", "text", "background"]
+    assert scheduler.active == 0
+
+
+def test_users_take_turns_within_a_priority():
+    scheduler = LLMScheduler("test", max_concurrency=1)
+    order = _queue_behind_busy_slot(scheduler, [
+        ("a1", TEXT, "a"),
+        ("a2", TEXT, "a"),
+        ("a3", TEXT, "a"),
+        ("b1", TEXT, "b"),
+        ("c1", TEXT, "c"),
+    ])
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_reserved_slot_is_only_used_by_voice():
+    async def run():
+        scheduler = LLMScheduler("test", max_concurrency=2, voice_reserved=1)
+        order = []
+        hold = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(TEXT, "a"):
+                await hold.wait()
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        text = asyncio.create_task(_use(scheduler, order, "text", TEXT, "b"))
+        await asyncio.sleep(0)
+        await _use(scheduler, order, "voice", VOICE, "c")
+        assert order == ["voice"]
+        hold.set()
+        await asyncio.gather(holding, text)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(run())
+    assert order == ["voice", "text"]
+    assert scheduler.snapshot()["priorities"]["text"]["requests"] == 2
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    async def run():
+        scheduler = LLMScheduler("test", max_concurrency=1)
+        order = []
+        hold = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot(TEXT, "a"):
+                await hold.wait()
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(_use(scheduler, order, "cancelled", TEXT, "b"))
+        waiting = asyncio.create_task(_use(scheduler, order, "waiting", TEXT, "c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        hold.set()
+        await asyncio.gather(holding, waiting)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(run())
+    assert order == ["waiting"]
+    assert scheduler.active == 0
@@ -0,0 +1,114 @@
+import asyncio
+from src.services import memory_engine
+from src.services.memory_engine import MemoryEngine, memory_id, memory_scope
+
+
+class FakeCollection:
+    def __init__(self, results=()):
+        self.results = list(results)  # (document, metadata, distance)
+        self.queries = []
+        self.upserts = []
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        self.queries.append({"n_results": n_results, "where": where})
+        hits = self.results[:n_results]
+        return {
+            "documents": [[doc for doc, _, _ in hits]],
+            "metadatas": [[meta for _, meta, _ in hits]],
+            "distances": [[dist for _, _, dist in hits]]
+        }
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.upserts.append((ids, documents, metadatas))
+
+
+def _engine(collection, embed_delay=0.0):
+    engine = MemoryEngine(db_path="unused")
+    engine.disabled = False
+    engine.collection = collection
+
+    async def embed(texts, priority=None):
+        await asyncio.sleep(embed_delay)
+        return [[0.0] * 4 for _ in texts]
+
+    engine.embed = embed
+    return engine
+
+
+def test_memory_id_ignores_surrounding_whitespace():
+    assert memory_id("やあ", "\nこんにちは ") == memory_id(" やあ", "こんにちは")
+    assert memory_id("やあ", "こんにちは") != memory_id("やあ", "こんばんは")
+
+
+def test_retrieval_is_scoped_to_the_speaker():
+    assert memory_scope() is None
+    assert memory_scope(user_id=1) == {"user_id": "1"}
+    assert memory_scope(user_id=1, guild_id=2) == {"$and": [{"user_id": "1"}, {"guild_id": "2"}]}
+
+    collection = FakeCollection([("兄: a\nミリア: b", {}, 0.1)])
+    engine = _engine(collection)
+    assert asyncio.run(engine.retrieve("a", user_id=1, guild_id=2)) == "兄: a\nミリア: b"
+    assert collection.queries[0]["where"] == {"$and": [{"user_id": "1"}, {"guild_id": "2"}]}
+    # Unknown speaker: nothing is searched
+    assert asyncio.run(engine.retrieve("a")) is None
+    assert len(collection.queries) == 1
+
+
+def test_ranking_mixes_similarity_and_score(monkeypatch):
+    monkeypatch.setattr(memory_engine, "MEMORY_SCORE_WEIGHT", 0.3)
+    monkeypatch.setattr(memory_engine, "MEMORY_MIN_SIMILARITY", 0.35)
+    collection = FakeCollection([
+        ("close, unscored", {}, 0.10),          # 0.7 * 0.9 + 0.3 * 0.5 = 0.78
+        ("close, disliked", {"score": 1}, 0.05),  # 0.7 * 0.95 + 0 = 0.665
+        ("further, loved", {"score": 5}, 0.20),   # 0.7 * 0.8 + 0.3 = 0.86
+        ("unrelated", {"score": 5}, 0.70),        # below the similarity floor
+    ])
+    engine = _engine(collection)
+    docs = asyncio.run(engine.retrieve("q", user_id=1, top_k=3))
+    assert docs.split("\n\n") == ["further, loved", "close, unscored", "close, disliked"]
+    assert collection.queries[0]["n_results"] == 9  # Over-fetched for re-ranking
+    assert engine.hits == 1
+
+
+def test_retrieval_gives_up_after_its_budget():
+    engine = _engine(FakeCollection([("slow", {}, 0.1)]), embed_delay=0.5)
+    assert asyncio.run(engine.retrieve("q", user_id=1, budget=0.05)) is None
+    assert engine.misses == 1
+    assert engine.hits == 0
+
+
+def test_unopened_collection_is_a_miss_not_a_wait(monkeypatch):
+    engine = _engine(None)
+    opened = []
+
+    async def run():
+        monkeypatch.setattr(engine, "_open_collection", lambda: opened.append(True) or FakeCollection())
+        assert await engine.retrieve("q", user_id=1) is None
+        await engine._opening
+        return engine.collection
+
+    assert asyncio.run(run()) is not None
+    assert engine.misses == 1
+    assert opened == [True]
+
+
+def test_writes_keep_the_latest_version_of_a_pair():
+    collection = FakeCollection()
+    engine = _engine(collection)
+
+    async def run():
+        engine.remember(" hi", "hello\n", user_id=1, guild_id=2)
+        await asyncio.sleep(0.01)  # The writer is now collecting a batch
+        engine.remember("hi", "hello", score=4.5, user_id=1, guild_id=2)
+        engine.remember("", "ignored", user_id=1)
+        engine.remember("bye", "またね", user_id=1)
+        await engine.close()
+
+    asyncio.run(run())
+    assert len(collection.upserts) == 1
+    ids, documents, metadatas = collection.upserts[0]
+    assert ids == [memory_id("hi", "hello"), memory_id("bye", "またね")]
+    assert documents == ["兄: hi\nミリア: hello", "兄: bye\nミリア: またね"]
+    assert metadatas[0]["score"] == 4.5
+    assert (metadatas[0]["user_id"], metadatas[0]["guild_id"]) == ("1", "2")
+    assert "guild_id" not in metadatas[1]
@@ -0,0 +1,73 @@
+import asyncio
+import glob
+import os
+from src.services.score_store import ScoreStore, load_dataset, turn_score
+
+
+def _files(root, pattern):
+    return glob.glob(os.path.join(root, pattern))
+
+
+async def _log_and_score(store):
+    await store.log_turn(1, "hi", "hello", user_id=10, guild_id=100, source="text_chat")
+    await store.log_turn(2, "bye", "see you", user_id=11, guild_id=100, source="voice_chat")
+    await store.add_score(1, 10, 1)
+    await store.add_score(1, 11, -1)
+    await store.add_score(1, 10, 3)  # Latest score of a user wins
+    assert await store.add_score(999, 10, 1) is None
+
+
+def test_scores_survive_a_reload(tmp_path):
+    root = str(tmp_path)
+    store = ScoreStore(root, segment_bytes=1 << 20, compact_segments=100)
+    asyncio.run(_log_and_score(store))
+    assert store.get(1)["scores"] == {"10": 3, "11": -1}
+
+    reloaded = ScoreStore(root, segment_bytes=1 << 20, compact_segments=100)
+    assert reloaded.get(1)["scores"] == {"10": 3, "11": -1}
+    assert reloaded.get(2)["output"] == "see you"
+    assert reloaded.get(999) is None
+
+
+def test_compaction_folds_segments_into_turns(tmp_path):
+    root = str(tmp_path)
+    # Every append after the first starts a new segment
+    store = ScoreStore(root, segment_bytes=1, compact_segments=100)
+    asyncio.run(_log_and_score(store))
+    assert len(_files(root, "segment-*.jsonl")) == 5
+
+    store.compact()
+    assert _files(root, "segment-*.jsonl") == []
+    assert len(_files(root, "compact-*.jsonl")) == 1
+
+    asyncio.run(store.add_score(2, 10, 2))
+    reloaded = ScoreStore(root)
+    assert reloaded.get(1)["scores"] == {"10": 3, "11": -1}
+    assert reloaded.get(2)["scores"] == {"10": 2}
+
+
+def test_compaction_starts_after_enough_segments(tmp_path):
+    root = str(tmp_path)
+    store = ScoreStore(root, segment_bytes=1, compact_segments=3)
+    asyncio.run(_log_and_score(store))  # The executor finishes the compaction before run() returns
+    assert len(_files(root, "compact-*.jsonl")) >= 1
+    assert len(_files(root, "segment-*.jsonl")) < 3
+    assert ScoreStore(root).get(1)["scores"] == {"10": 3, "11": -1}
+
+
+def test_load_dataset_averages_scores(tmp_path):
+    root = str(tmp_path)
+    store = ScoreStore(root, segment_bytes=1 << 20, compact_segments=100)
+    asyncio.run(_log_and_score(store))
+
+    scored = load_dataset(root)
+    assert [(turn["message_id"], turn["score"]) for turn in scored] == [(1, 1.0)]
+    everything = load_dataset(root, scored_only=False)
+    assert {turn["message_id"]: turn["score"] for turn in everything} == {1: 1.0, 2: None}
+
+
+def test_turn_score_is_the_mean_of_each_users_latest_score(tmp_path):
+    store = ScoreStore(str(tmp_path), segment_bytes=1 << 20, compact_segments=100)
+    asyncio.run(_log_and_score(store))
+    assert turn_score(store.get(1)) == 1.0  # (3 + -1) / 2
+    assert turn_score(store.get(2)) is None
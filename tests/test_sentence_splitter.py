@@ -0,0 +1,54 @@
+import asyncio
+from src.utils.sentence_splitter import SentenceSplitter, iter_sentences, split_sentences
+
+
+async def _tokens(text, size=1):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def _stream(text, size=1):
+    async def run():
+        raw = []
+        sentences = [s async for s in iter_sentences(_tokens(text, size), text=raw)]
+        return sentences, "".join(raw)
+    return asyncio.run(run())
+
+
+def test_splits_on_japanese_and_ascii_delimiters():
+    assert split_sentences("おはよう。元気？うん!") == ["おはよう。", "元気？", "うん!"]
+
+
+def test_closers_and_delimiter_runs_stay_with_the_sentence():
+    assert split_sentences("「おはよう！」えっ！？本当…") == ["「おはよう！」", "えっ！？", "本当…"]
+
+
+def test_newlines_end_sentences():
+    assert split_sentences("1. りんご\n2. みかん\n3. ぶどう") == ["1. りんご", "2. みかん", "3. ぶどう"]
+
+
+def test_punctuation_only_fragments_are_skipped():
+    assert split_sentences("うん\n「…」\n😊") == ["うん"]
+
+
+def test_sentences_complete_as_tokens_arrive():
+    splitter = SentenceSplitter()
+    assert splitter.feed("こんに") == []
+    assert splitter.feed("ちは。元") == ["こんにちは。"]
+    assert splitter.feed("気") == []
+    assert splitter.flush() == "元気"
+    assert splitter.flush() is None
+
+
+def test_streamed_sentences_match_whole_text_split():
+    text = "Sure! Here you go.\nLine two?\n今日はいい天気だね。散歩しよう"
+    for size in (1, 3, 7, len(text)):
+        sentences, _ = _stream(text, size)
+        assert sentences == split_sentences(text)
+
+
+def test_raw_text_keeps_formatting_the_sentences_drop():
+    for text in ("1. りんご\n2. みかん\n3. ぶどう", "Sure! Here you go.\nLine two?\n😊"):
+        sentences, raw = _stream(text, size=2)
+        assert raw == text
+        assert "".join(sentences) != text
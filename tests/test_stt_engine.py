@@ -0,0 +1,43 @@
+from src.services import stt_engine
+from src.services.stt_engine import STTEngine, TIERS
+
+BUSY = stt_engine.STT_BUSY_BACKLOG
+OVERLOAD = stt_engine.STT_OVERLOAD_BACKLOG
+LONG = stt_engine.STT_LONG_UTTERANCE
+
+
+def tier(**kwargs):
+    return STTEngine().choose_tier(**kwargs).name
+
+
+def test_idle_decoder_uses_the_full_tier():
+    assert tier(duration=3.0, backlog=1) == "full"
+    assert tier(duration=LONG + 1, backlog=1) == "full"
+
+
+def test_tier_steps_down_with_the_backlog():
+    assert tier(duration=3.0, backlog=BUSY) == "full"
+    assert tier(duration=3.0, backlog=BUSY + 1) == "fast"
+    assert tier(duration=3.0, backlog=OVERLOAD + 1) == "lite"
+
+
+def test_long_utterance_steps_down_once_others_wait():
+    assert tier(duration=LONG + 1, backlog=2) == "fast"
+    assert tier(duration=LONG + 1, backlog=OVERLOAD + 1) == "lite"
+
+
+def test_utterances_close_to_the_deadline_take_the_lite_tier():
+    assert tier(duration=3.0, backlog=1, waited=4.1, deadline=8.0) == "lite"
+    assert tier(duration=3.0, backlog=1, waited=3.9, deadline=8.0) == "full"
+    assert tier(duration=3.0, backlog=1, waited=100.0, deadline=0) == "full"
+
+
+def test_lite_tier_falls_back_to_the_main_model():
+    engine = STTEngine()
+    engine.model = "main"
+    lite = TIERS[2]
+    assert engine._model_for(lite) == "main"
+    engine.lite_model = "lite"
+    assert engine._model_for(lite) == "lite"
+    assert engine._model_for(TIERS[1]) == "main"
+    assert engine._model_for(None) == "main"
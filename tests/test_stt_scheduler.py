@@ -0,0 +1,99 @@
+import asyncio
+import numpy as np
+from src.services.stt_scheduler import STTJob, STTScheduler
+
+
+class Tier:
+    def __init__(self, name="full"):
+        self.name = name
+
+
+class FakeEngine:
+    def __init__(self, tier="full"):
+        self.calls = []
+        self.tier = tier
+        self.backlogs = []
+
+    def choose_tier(self, duration, backlog=0, waited=0.0, deadline=None):
+        self.backlogs.append(backlog)
+        return Tier(self.tier)
+
+    def transcribe(self, audio, initial_prompt=None, tier=None):
+        self.calls.append(("single", initial_prompt, 1))
+        return f"{initial_prompt}:{int(audio[0])}"
+
+    def transcribe_batch(self, audios, initial_prompt=None, tier=None):
+        self.calls.append(("batch", initial_prompt, len(audios)))
+        return [f"{initial_prompt}:{int(audio[0])}" for audio in audios]
+
+
+def _transcribe_all(engine, prompts):
+    async def run():
+        scheduler = STTScheduler(engine, max_batch=8, max_wait=0.05, deadline=10)
+        try:
+            return await asyncio.gather(*(
+                scheduler.transcribe(np.full(160, i, dtype=np.float32), initial_prompt=prompt)
+                for i, prompt in enumerate(prompts)
+            ))
+        finally:
+            scheduler.stop()
+
+    return asyncio.run(run())
+
+
+def test_batched_utterances_never_get_another_users_prompt():
+    engine = FakeEngine()
+    texts = _transcribe_all(engine, ["alice", "bob", "alice", None])
+    assert texts == ["alice:0", "None:1", "alice:2", "None:3"]
+    assert sorted(engine.calls, key=str) == [("batch", "alice", 2), ("batch", None, 2)]
+
+
+def test_streaming_tails_with_their_own_prompts_still_batch():
+    engine = FakeEngine()
+    # Each tail is prompted with its own committed text
+    texts = _transcribe_all(engine, ["おはよう", "今日は", "あのね"])
+    assert texts == ["None:0", "None:1", "None:2"]
+    assert engine.calls == [("batch", None, 3)]
+
+
+def test_lone_utterance_keeps_its_prompt():
+    engine = FakeEngine()
+    assert _transcribe_all(engine, ["おはよう"]) == ["おはよう:0"]
+    assert engine.calls == [("single", "おはよう", 1)]
+
+
+def test_stale_utterances_are_dropped_before_decoding():
+    async def run():
+        loop = asyncio.get_running_loop()
+        scheduler = STTScheduler(FakeEngine(), deadline=2.0)
+        jobs = [STTJob(np.zeros(160, dtype=np.float32), None, loop.create_future()) for _ in range(3)]
+        jobs[0].enqueued -= 5.0
+        jobs[2].enqueued -= 2.5
+        fresh = scheduler._shed_stale(jobs)
+        return jobs, fresh, scheduler
+
+    jobs, fresh, scheduler = asyncio.run(run())
+    assert fresh == [jobs[1]]
+    assert scheduler.shed == 2
+    # Dropped utterances resolve to None (skipped, not failed)
+    assert jobs[0].future.result() is None and jobs[2].future.result() is None
+    assert not jobs[1].future.done()
+
+
+def test_tier_is_chosen_per_batch_and_counted():
+    engine = FakeEngine(tier="fast")
+
+    async def run():
+        scheduler = STTScheduler(engine, max_batch=8, max_wait=0.05, deadline=10)
+        try:
+            await asyncio.gather(*(
+                scheduler.transcribe(np.full(160, i, dtype=np.float32)) for i in range(3)
+            ))
+        finally:
+            scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert engine.backlogs == [3]
+    assert scheduler.tier_counts == {"fast": 3}
+    assert scheduler.batches == 1
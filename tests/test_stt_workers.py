@@ -0,0 +1,110 @@
+import glob
+import time
+import numpy as np
+import pytest
+from src.services import stt_workers
+from multiprocessing import resource_tracker, shared_memory
+from src.services.stt_workers import STTWorkerPool
+
+
+class StubEngine:
+    """
+    Stands in for STTEngine in the worker processes (imported there by name).
+    """
+    def __init__(self, cpu_threads=0):
+        self.cpu_threads = cpu_threads
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    def load_lite(self):
+        pass
+
+    def choose_tier(self, duration, backlog=0, waited=0.0, deadline=None):
+        return stt_workers.TIERS[0]
+
+    def transcribe(self, audio, language="ja", beam_size=5, initial_prompt=None, tier=None):
+        if initial_prompt == "hang":
+            time.sleep(60)
+        if initial_prompt == "fail":
+            raise ValueError("decoder error")
+        return f"{len(audio)}:{float(audio.sum()):.1f}:{tier.name if tier else None}"
+
+    def transcribe_batch(self, audios, language="ja", beam_size=5, initial_prompt=None, tier=None):
+        return [f"{len(audio)}:{float(audio.sum()):.1f}" for audio in audios]
+
+    def transcribe_words(self, audio, language="ja", beam_size=1, initial_prompt=None):
+        return [(0.0, len(audio) / 16000, "word")]
+
+
+def _shared_blocks():
+    return set(glob.glob("/dev/shm/psm_*"))
+
+
+def _wait_for(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool():
+    pool = STTWorkerPool(num_workers=1, cpu_threads=1, engine_class=StubEngine)
+    pool.load_in_background()
+    assert pool.wait_ready(timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_round_trip_through_shared_memory(pool):
+    before = _shared_blocks()
+    audio = np.full(16000, 0.5, dtype=np.float32)
+    assert pool.transcribe(audio, tier=stt_workers.TIERS[1]) == "16000:8000.0:fast"
+    assert pool.transcribe_batch([audio[:100], None, audio[:10]]) == ["100:50.0", "0:0.0", "10:5.0"]
+    assert pool.transcribe_words(audio) == [(0.0, 1.0, "word")]
+    # The parent unlinks every block once the worker answered
+    assert _shared_blocks() == before
+
+
+def test_worker_errors_are_raised_in_the_caller(pool):
+    with pytest.raises(RuntimeError, match="decoder error"):
+        pool.transcribe(np.zeros(160, dtype=np.float32), initial_prompt="fail")
+    assert pool.transcribe(np.ones(160, dtype=np.float32)) == "160:160.0:None"
+
+
+def test_hung_worker_times_out_and_is_restarted(pool, monkeypatch):
+    monkeypatch.setattr(stt_workers, "STT_WORKER_TIMEOUT", 0.5)
+    monkeypatch.setattr(stt_workers, "STT_WORKER_TIMEOUT_FACTOR", 0.0)
+    before = _shared_blocks()
+    first = pool.workers[0].process
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="did not answer"):
+        pool.transcribe(np.zeros(160, dtype=np.float32), initial_prompt="hang")
+    assert time.monotonic() - started < 5
+    assert pool.timeouts == 1
+    assert _shared_blocks() == before
+
+    _wait_for(lambda: pool.restarts == 1 and pool.is_ready)
+    assert not first.is_alive()
+    assert pool.workers[0].process is not first
+    assert pool.transcribe(np.ones(16, dtype=np.float32)) == "16:16.0:None"
+
+
+def test_workers_attach_without_registering_the_block(monkeypatch):
+    owner = shared_memory.SharedMemory(create=True, size=64)
+    registered = []
+    monkeypatch.setattr(resource_tracker, "register", lambda name, rtype: registered.append((name, rtype)))
+    try:
+        attached = stt_workers._attach(owner.name)
+        attached.close()
+        # Only the parent, which created the block, tracks and unlinks it
+        assert registered == []
+    finally:
+        owner.close()
+        owner.unlink()
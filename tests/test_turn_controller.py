@@ -0,0 +1,62 @@
+import asyncio
+from src.services.turn_controller import TurnController
+
+
+class FakePipeline:
+    def __init__(self):
+        self.fades = []
+
+    def fade_out(self, duration):
+        self.fades.append(duration)
+
+
+async def _reply(text, delay=0.05):
+    await asyncio.sleep(delay)
+    return text
+
+
+def test_newer_turn_replaces_current_one():
+    async def run():
+        turns = TurnController(FakePipeline())
+        first = asyncio.create_task(turns.run(_reply("first")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(turns.run(_reply("second")))
+        await asyncio.sleep(0)
+        third = turns.run(_reply("third"))
+        return await asyncio.gather(first, second, third), turns
+
+    results, turns = asyncio.run(run())
+    assert results == [None, None, "third"]
+    assert not turns.busy
+    assert not turns._interrupted
+
+
+def test_barge_in_fades_out_and_interrupts():
+    async def run():
+        pipeline = FakePipeline()
+        turns = TurnController(pipeline)
+        assert not turns.barge_in()
+        turn = asyncio.create_task(turns.run(_reply("hello", delay=1)))
+        await asyncio.sleep(0)
+        assert turns.barge_in(fade=0.1)
+        return await turn, turns, pipeline
+
+    result, turns, pipeline = asyncio.run(run())
+    assert result is None
+    assert turns.barge_ins == 1
+    assert pipeline.fades == [0.1]
+
+
+def test_caller_cancellation_still_propagates():
+    async def run():
+        turns = TurnController(FakePipeline())
+        turn = asyncio.create_task(turns.run(_reply("hello", delay=1)))
+        await asyncio.sleep(0)
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(run())
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from src.utils.vad import VoiceActivityDetector
+
+FRAME = 960  # 20ms at 48kHz
+rng = np.random.default_rng(0)
+
+
+def tone(amplitude=0.3, freq=220.0):
+    t = np.arange(FRAME) / 48000
+    return (amplitude * np.sin(2 * np.pi * freq * t) * 32767).astype(np.int16)
+
+
+def noise(amplitude=0.001):
+    return (rng.standard_normal(FRAME) * amplitude * 32767).astype(np.int16)
+
+
+def run(vad, state, frames):
+    return [vad.process_frame(frame, state) for frame in frames]
+
+
+def test_onset_needs_consecutive_speech_frames():
+    vad = VoiceActivityDetector()
+    state = vad.new_state()
+    run(vad, state, [noise() for _ in range(20)])
+    # A single click is not speech
+    assert run(vad, state, [tone(), noise(), noise()]) == [False, False, False]
+    assert run(vad, state, [tone(), tone()]) == [False, True]
+
+
+def test_hangover_keeps_speech_through_short_gaps_then_ends():
+    vad = VoiceActivityDetector(hangover_frames=8)
+    state = vad.new_state()
+    run(vad, state, [noise() for _ in range(20)] + [tone() for _ in range(10)])
+    assert state.speaking
+    decisions = run(vad, state, [noise() for _ in range(10)])
+    assert decisions == [True] * 7 + [False] * 3
+    assert state.silence_frames == 10
+
+
+def test_noise_floor_follows_background_level():
+    vad = VoiceActivityDetector()
+    state = vad.new_state()
+    assert not any(run(vad, state, [noise(0.01) for _ in range(300)]))
+    assert -45 < state.noise_floor < -35  # ~-43 dBFS of noise
+    # Steady loud hum becomes the floor instead of staying "speech"
+    decisions = run(vad, state, [noise(0.03) for _ in range(300)])
+    assert not any(decisions[-50:])
+    # Digital silence does not push the floor below its bound
+    run(vad, state, [np.zeros(FRAME, dtype=np.int16) for _ in range(200)])
+    assert state.noise_floor == vad.min_floor_db
+
+
+def test_end_of_speech_timeout_learns_pauses_within_bounds():
+    vad = VoiceActivityDetector()
+    state = vad.new_state()
+    assert vad.end_of_speech_timeout(state) == vad.max_eos
+
+    run(vad, state, [noise() for _ in range(20)])
+    for _ in range(5):
+        # 13 quiet frames, plus the first frame of the next onset
+        run(vad, state, [tone() for _ in range(10)] + [noise() for _ in range(13)])
+    assert state.pause_ema == pytest.approx(14)
+    timeout = vad.end_of_speech_timeout(state)
+    assert timeout == pytest.approx(2.5 * 14 * 0.02)
+    assert vad.min_eos <= timeout <= vad.max_eos
+
+    state.pause_ema = 1
+    assert vad.end_of_speech_timeout(state) == vad.min_eos
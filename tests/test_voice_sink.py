@@ -0,0 +1,92 @@
+import pytest
+from src.utils import voice_sink
+from src.utils.voice_sink import OpusGate, SpeechGateSink, SILENT_FRAME, is_silent_opus
+
+OPUS_SILENCE = b"\xf8\xff\xfe"
+SPEECH = b"\x78" + bytes(60)
+
+
+class FakeDecoder:
+    def __init__(self):
+        self.calls = []
+
+    def decode(self, data, *, fec=False):
+        self.calls.append(data)
+        return SILENT_FRAME
+
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+
+
+class FakeData:
+    def __init__(self, opus):
+        self.opus = opus
+        self.pcm = None
+
+
+@pytest.fixture(autouse=True)
+def fake_opus(monkeypatch):
+    # No libopus needed: every decoder the gate creates is a FakeDecoder
+    monkeypatch.setattr(voice_sink.discord.opus, "Decoder", FakeDecoder)
+
+
+def test_silence_is_not_mistaken_for_loss():
+    assert is_silent_opus(OPUS_SILENCE)
+    assert not is_silent_opus(b"")
+    assert not is_silent_opus(None)
+    assert not is_silent_opus(SPEECH)
+
+
+def test_silent_frames_are_gated():
+    gate = OpusGate()
+    assert gate.decode(1, OPUS_SILENCE) == b""
+    assert gate.gated == 1
+    assert gate.decoders == {}
+
+
+def test_lost_packets_without_a_decoder_are_gated():
+    gate = OpusGate()
+    assert gate.decode(1, b"") == b""
+    assert gate.decode(1, None) == b""
+    assert gate.gated == 2
+    assert gate.concealed == 0
+    assert gate.decoders == {}
+
+
+def test_lost_packets_of_a_speaker_are_concealed():
+    gate = OpusGate()
+    assert gate.decode(1, SPEECH) == SILENT_FRAME
+    assert gate.decode(1, b"") == SILENT_FRAME
+    assert gate.decode(1, None) == SILENT_FRAME
+    assert gate.decoders[1].calls == [SPEECH, None, None]
+    assert (gate.decoded, gate.concealed, gate.gated) == (1, 2, 0)
+
+    # Another member's loss is not concealed with this speaker's decoder
+    assert gate.decode(2, b"") == b""
+    gate.drop(1)
+    assert gate.decode(1, b"") == b""
+
+
+def test_sink_drops_ignored_users_and_passes_gated_frames_on():
+    received = []
+    sink = SpeechGateSink(lambda user, data: received.append((user.id, data.pcm)), ignore=lambda user: user.bot)
+    assert sink.wants_opus()
+
+    sink.write(FakeUser(1), FakeData(SPEECH))
+    sink.write(FakeUser(1), FakeData(OPUS_SILENCE))
+    sink.write(FakeUser(2, bot=True), FakeData(SPEECH))
+    sink.write(None, FakeData(SPEECH))
+
+    assert received == [(1, SILENT_FRAME), (1, b"")]
+    assert sink.dropped == 2
+    assert list(sink.gate.decoders) == [1]
+
+    sink.on_voice_member_disconnect(FakeUser(1), 1234)
+    assert sink.gate.decoders == {}
+    sink.write(FakeUser(3), FakeData(SPEECH))
+    sink.cleanup()
+    assert sink.gate.decoders == {}
+
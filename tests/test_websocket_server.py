@@ -0,0 +1,134 @@
+import asyncio
+import json
+import pytest
+from src.services import websocket_server
+from src.services.websocket_server import ClientConnection, WebSocketServer
+
+
+class FakeWebSocket:
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.closed = False
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_text(self, text):
+        await self.unblocked.wait()
+        self.sent.append(json.loads(text) if text.startswith("{") else text)
+
+    async def send_bytes(self, data):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def no_connections():
+    websocket_server.active_connections.clear()
+    yield
+    websocket_server.active_connections.clear()
+
+
+def _connect(websocket, **kwargs):
+    client = ClientConnection(websocket, **kwargs)
+    websocket_server.active_connections[websocket] = client
+    return client
+
+
+async def _drain():
+    # Every send goes through wait_for (a task of its own), so give the writers a few iterations
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_partial_transcripts_are_coalesced_per_speaker():
+    async def run():
+        websocket = FakeWebSocket(blocked=True)
+        _connect(websocket)
+        server = WebSocketServer()
+        # The first message is taken by the writer, the rest wait behind the blocked send
+        server.broadcast_nowait({"type": "status", "text": "first"})
+        await _drain()
+        for i in range(5):
+            server.broadcast_nowait({"type": "partial_transcript", "user_id": 1, "committed": f"a{i}"})
+            server.broadcast_nowait({"type": "partial_transcript", "user_id": 2, "committed": f"b{i}"})
+        server.broadcast_nowait({"type": "speaking", "text": "hi"})
+        websocket.unblocked.set()
+        await _drain()
+        return websocket.sent
+
+    sent = asyncio.run(run())
+    assert [(m["type"], m.get("committed", m.get("text"))) for m in sent] == [
+        ("status", "first"),
+        ("partial_transcript", "a4"),
+        ("partial_transcript", "b4"),
+        ("speaking", "hi"),
+    ]
+
+
+def test_full_queue_drops_the_oldest_messages():
+    async def run():
+        websocket = FakeWebSocket(blocked=True)
+        client = _connect(websocket, max_queue=3)
+        client.offer("first")
+        await _drain()  # In flight
+        client.offer("p1", key=("partial_transcript", 1))
+        for i in range(3):
+            client.offer(f"m{i}")
+        # The dropped keyed entry no longer coalesces
+        client.offer("p2", key=("partial_transcript", 1))
+        websocket.unblocked.set()
+        await _drain()
+        return websocket.sent, client.dropped
+
+    sent, dropped = asyncio.run(run())
+    assert sent == ["first", "m1", "m2", "p2"]
+    assert dropped == 2
+
+
+def test_slow_client_is_dropped_without_delaying_others():
+    async def run():
+        slow = FakeWebSocket(blocked=True)
+        fast = FakeWebSocket()
+        slow_client = _connect(slow, send_timeout=0.05)
+        _connect(fast)
+        server = WebSocketServer()
+        server.broadcast_nowait({"type": "status", "text": "hello"})
+        await _drain()
+        assert [m["text"] for m in fast.sent] == ["hello"]
+        await asyncio.sleep(0.1)
+        await _drain()
+        return slow, slow_client
+
+    slow, slow_client = asyncio.run(run())
+    assert slow_client.closed
+    assert slow.closed
+    assert slow not in websocket_server.active_connections
+
+
+def test_binary_frames_only_go_to_subscribers():
+    async def run():
+        subscribed = FakeWebSocket()
+        other = FakeWebSocket()
+        client = _connect(subscribed)
+        _connect(other)
+        server = WebSocketServer()
+        assert not server.has_subscribers("envelope")
+        assert client.handle_command(json.dumps({"type": "subscribe", "channel": "envelope"}))
+        assert server.has_subscribers("envelope")
+        server.broadcast_binary_nowait(b"\x01\x02", "envelope")
+        await _drain()
+        assert client.handle_command(json.dumps({"type": "unsubscribe", "channel": "envelope"}))
+        server.broadcast_binary_nowait(b"\x03", "envelope")
+        assert client.handle_command(json.dumps({"type": "subscribe", "channel": "nope"}))
+        assert not client.handle_command("hello")
+        assert not client.handle_command(json.dumps({"type": "speaking"}))
+        await _drain()
+        return subscribed.sent, other.sent
+
+    subscribed, other = asyncio.run(run())
+    assert subscribed == [b"\x01\x02", {"type": "error", "message": "unknown channel: nope"}]
+    assert other == []